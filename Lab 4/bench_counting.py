@@ -0,0 +1,172 @@
+"""
+Lab 4 - Counting benchmark: str-tuple dicts (old q1/q2/q3 loop) vs integer-id tables,
+serial, pipelined (reader/tokenizer/counter threads), sharded over a process pool, spilling to
+disk within a memory budget, and the approximate sketch mode (its unique counts are HyperLogLog estimates, so it is not compared).
+
+Each variant runs in its own subprocess so peak RSS is measured independently.
+Without a corpus argument a Zipfian Gujarati-like corpus is generated (and cached) in the temp dir.
+
+Usage:
+  python bench_counting.py [corpus.txt] [--tokens 2000000] [--max-n 4] [--workers N] [--memory-mb 64]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Deque, Dict, Tuple
+
+import numpy as np
+
+from ngram_external import count_ngrams_external
+from ngram_parallel import count_ngrams_parallel
+from ngram_pipeline import count_ngrams_pipelined
+from ngram_sketch import count_ngrams_sketch
+from ngram_table import count_ngrams, stream_tokens
+
+CONSONANTS = "કખગઘચછજઝટઠડઢણતથદધનપફબભમયરલવશષસહળ"
+VOWEL_SIGNS = ["", "ા", "િ", "ી", "ુ", "ૂ", "ે", "ૈ", "ો", "ૌ", "ં"]
+SUFFIXES = ["", "", "", "નો", "ની", "નું", "માં", "થી", "ને"]
+
+
+######## Corpus Generation ########
+def make_zipf_corpus(path: Path, n_tokens: int, vocab_size: int = 50000, s: float = 1.1,
+					 line_len: int = 12, seed: int = 0):
+	"""Write n_tokens whitespace-separated tokens whose frequencies follow rank^-s."""
+	rng = np.random.default_rng(seed)
+	words = set()
+	while len(words) < vocab_size:
+		syl = rng.integers(1, 5)
+		w = "".join(CONSONANTS[rng.integers(len(CONSONANTS))] + VOWEL_SIGNS[rng.integers(len(VOWEL_SIGNS))] for _ in range(syl))
+		words.add(w + SUFFIXES[rng.integers(len(SUFFIXES))])
+	words = sorted(words)
+	rng.shuffle(words)
+	p = 1.0 / np.arange(1, vocab_size + 1) ** s
+	p /= p.sum()
+	with path.open("w", encoding="utf-8") as f:
+		done = 0
+		while done < n_tokens:
+			m = min(1 << 18, n_tokens - done)
+			ids = rng.choice(vocab_size, size=m, p=p)
+			toks = [words[i] for i in ids]
+			f.write("\n".join(" ".join(toks[i:i + line_len]) for i in range(0, m, line_len)) + "\n")
+			done += m
+
+
+######## Variants ########
+def count_dicts(path: Path, max_n: int, workers: int, memory_mb: int) -> Dict[int, int]:
+	"""The original q1 counting loop: one dict of str tuples per order."""
+	counts: Dict[int, Dict[Tuple[str, ...], int]] = {n: defaultdict(int) for n in range(1, max_n + 1)}
+	window: Deque[str] = deque(maxlen=max_n - 1)
+	for tok in stream_tokens(path):
+		counts[1][(tok,)] += 1
+		if max_n > 1:
+			hist = list(window)
+			hl = len(hist)
+			for n in range(2, max_n + 1):
+				need = n - 1
+				if hl >= need:
+					counts[n][tuple(hist[-need:] + [tok])] += 1
+		window.append(tok)
+	return {n: len(counts[n]) for n in counts}
+
+
+def count_tables(path: Path, max_n: int, workers: int, memory_mb: int) -> Dict[int, int]:
+	counts = count_ngrams(path, max_n)
+	return {n: counts.unique(n) for n in range(1, max_n + 1)}
+
+
+def count_pipeline(path: Path, max_n: int, workers: int, memory_mb: int) -> Dict[int, int]:
+	counts, _ = count_ngrams_pipelined(path, max_n)
+	return {n: counts.unique(n) for n in range(1, max_n + 1)}
+
+
+def count_shards(path: Path, max_n: int, workers: int, memory_mb: int) -> Dict[int, int]:
+	counts = count_ngrams_parallel(path, max_n, workers)
+	return {n: counts.unique(n) for n in range(1, max_n + 1)}
+
+
+def count_external(path: Path, max_n: int, workers: int, memory_mb: int) -> Dict[int, int]:
+	out_dir = Path(tempfile.mkdtemp(prefix="bench-ngrams-"))  # run files and store live here
+	try:
+		counts = count_ngrams_external(path, out_dir / "bench.ngrams", max_n, memory_mb << 20)
+		return {n: counts.unique(n) for n in range(1, max_n + 1)}
+	finally:
+		shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def count_sketch(path: Path, max_n: int, workers: int, memory_mb: int) -> Dict[int, int]:
+	counts = count_ngrams_sketch(path, max_n)
+	return {n: counts.unique(n) for n in range(1, max_n + 1)}
+
+
+VARIANTS = {"dict": count_dicts, "table": count_tables, "pipeline": count_pipeline, "shards": count_shards, "external": count_external,
+			"sketch": count_sketch}
+APPROXIMATE = {"sketch"}
+
+
+def run_variant(name: str, path: Path, max_n: int, workers: int, memory_mb: int):
+	t0 = time.perf_counter()
+	unique = VARIANTS[name](path, max_n, workers, memory_mb)
+	elapsed = time.perf_counter() - t0
+	print(json.dumps({
+		"variant": name,
+		"seconds": elapsed,
+		# pool workers are reaped by then, so RUSAGE_CHILDREN holds the largest worker
+		"peak_rss_mb": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+						   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024,
+		"unique": unique,
+	}))
+
+
+######## Main ########
+def main():
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--tokens", type=int, default=2_000_000, help="size of the generated corpus")
+	ap.add_argument("--max-n", type=int, default=4)
+	ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="pool size for the shards variant")
+	ap.add_argument("--memory-mb", type=int, default=64, help="table budget for the external variant")
+	ap.add_argument("--variant", choices=sorted(VARIANTS), help=argparse.SUPPRESS)
+	args = ap.parse_args()
+
+	if args.variant:
+		run_variant(args.variant, args.corpus, args.max_n, args.workers, args.memory_mb)
+		return
+
+	corpus = args.corpus
+	if corpus is None:
+		corpus = Path(tempfile.gettempdir()) / f"zipf_gu_{args.tokens}.txt"
+		if not corpus.is_file():
+			print(f"Generating {args.tokens} tokens -> {corpus}")
+			make_zipf_corpus(corpus, args.tokens)
+	n_tokens = sum(1 for _ in stream_tokens(corpus))
+
+	results = {}
+	for name in VARIANTS:
+		out = subprocess.run([sys.executable, __file__, str(corpus), "--max-n", str(args.max_n),
+							  "--workers", str(args.workers), "--memory-mb", str(args.memory_mb), "--variant", name],
+							 check=True, capture_output=True, text=True).stdout
+		results[name] = json.loads(out.strip().splitlines()[-1])
+	assert all(r["unique"] == results["dict"]["unique"] for name, r in results.items() if name not in APPROXIMATE), \
+		"variants disagree on n-gram counts"
+
+	print(f"Corpus: {corpus} ({n_tokens} tokens, MAX_N={args.max_n}, shards variant: {args.workers} workers, "
+		  f"external variant: {args.memory_mb} MB)")
+	print(f"{'variant':<8} {'seconds':>9} {'tokens/s':>12} {'peak RSS MB':>12}")
+	for name, r in results.items():
+		print(f"{name:<8} {r['seconds']:>9.2f} {n_tokens / r['seconds']:>12,.0f} {r['peak_rss_mb']:>12.1f}")
+	print("Unique n-grams: " + ", ".join(f"{n}: {u}" for n, u in results["table"]["unique"].items()))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,87 @@
+"""
+Lab 4 - Export benchmark: q2's smoothed TSVs vs the columnar .cols files.
+
+  write  - write_smoothed (smoothed_columns formatted as text) vs smoothed_columns + write_columns
+  read   - parse the TSV back into per-column lists vs read_columns (memory-mapped) and one
+		   full pass over every column (sum), so the pages are actually touched
+
+Usage:
+  python bench_export.py [corpus.txt] [--tokens 2000000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bench_counting import make_zipf_corpus
+from ngram_columns import read_columns, write_columns, write_vocab
+from ngram_good_turing import SimpleGoodTuring
+from ngram_kneser_ney import load_or_build_kneser_ney
+from ngram_store import default_store_path, load_or_build
+from q2 import MAX_N, smoothed_columns, write_smoothed
+
+
+def parse_tsv(path: Path):
+	with path.open("r", encoding="utf-8") as f:
+		header = f.readline().rstrip("\n").split("\t")
+		cols = [[] for _ in header]
+		for line in f:
+			for col, v in zip(cols, line.rstrip("\n").split("\t")):
+				col.append(v)
+	n = header.index("count")
+	return cols[:n], [list(map(int, cols[n]))] + [list(map(float, c)) for c in cols[n + 1:]]
+
+
+def main():
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--tokens", type=int, default=2_000_000, help="size of the generated corpus")
+	args = ap.parse_args()
+
+	corpus = args.corpus
+	if corpus is None:
+		corpus = Path(tempfile.gettempdir()) / f"zipf_gu_{args.tokens}.txt"
+		if not corpus.is_file():
+			make_zipf_corpus(corpus, args.tokens)
+	counts = load_or_build(corpus, MAX_N)
+	vocab_size = len(counts.vocab)
+	kn = load_or_build_kneser_ney(counts, default_store_path(corpus))
+	gt = {n: SimpleGoodTuring.fit(counts.count_of_counts(n)) for n in range(2, MAX_N + 1)}
+	for n in range(2, MAX_N + 1):
+		counts.sorted_rows(n)  # sort once up front; both writers share it
+
+	print(f"{'n':>2} {'rows':>9} {'tsv MB':>7} {'cols MB':>8} {'tsv write':>10} {'cols write':>11} {'tsv read':>9} {'cols read':>10}")
+	with tempfile.TemporaryDirectory() as tmp:
+		tmp = Path(tmp)
+		write_vocab(counts.vocab, tmp)
+		for n in range(2, MAX_N + 1):
+			tsv, cols = tmp / f"{n}.tsv", tmp / f"{n}.cols"
+			t0 = time.perf_counter()
+			write_smoothed(n, counts, vocab_size, kn, gt[n], tsv)
+			t_tsv_w = time.perf_counter() - t0
+
+			t0 = time.perf_counter()
+			write_columns(cols, *smoothed_columns(n, counts, vocab_size, kn, gt[n]))
+			t_cols_w = time.perf_counter() - t0
+
+			t0 = time.perf_counter()
+			parse_tsv(tsv)
+			t_tsv_r = time.perf_counter() - t0
+
+			t0 = time.perf_counter()
+			table = read_columns(cols)
+			_ = [float(np.sum(table[name])) for name in table.names]
+			t_cols_r = time.perf_counter() - t0
+
+			print(f"{n:>2} {len(table):>9} {tsv.stat().st_size / 2**20:>7.1f} {cols.stat().st_size / 2**20:>8.1f} "
+				  f"{t_tsv_w:>9.2f}s {t_cols_w:>10.3f}s {t_tsv_r:>8.2f}s {t_cols_r:>9.3f}s")
+			del table
+
+
+if __name__ == "__main__":
+	main()
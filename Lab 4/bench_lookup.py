@@ -0,0 +1,93 @@
+"""
+Lab 4 - Lookup benchmark: str-tuple dict vs memory-mapped sorted tables.
+
+Workload: every n-gram (n = 2..MAX_N) of the q3_data.txt sentences, which mostly miss on a
+foreign corpus, plus as many n-grams sampled from the corpus itself (hits).
+  dict    - counts[n].get(gram) on a resident {tuple(str): count} dict (old q3 path)
+  scalar  - NGramCounts.count(ids): one np.searchsorted per order on the mmapped store
+  batch   - NGramCounts.count_many(ids): the same walk vectorized over all queries of an order
+
+Usage:
+  python bench_lookup.py [corpus.txt] [--tokens 2000000] [--samples 100000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from bench_counting import make_zipf_corpus
+from ngram_store import load_counts, load_or_build
+from q3 import MAX_N, SENTENCE_FILE, find_file, read_sentences
+
+
+def rss_mb() -> float:
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def workload(counts, n: int, n_samples: int, rng: np.random.Generator) -> List[Tuple[str, ...]]:
+	grams = []
+	for _, toks in read_sentences(find_file(SENTENCE_FILE)):
+		grams.extend(tuple(toks[i:i + n]) for i in range(len(toks) - n + 1))
+	live = np.flatnonzero(np.asarray(counts.counts[n]) > 0)
+	idx = live[rng.integers(0, len(live), n_samples)] if len(live) else live
+	tokens = counts.vocab.tokens
+	grams.extend(tuple(tokens[i] for i in ids) for ids in counts.rows(n, idx).tolist())
+	return grams
+
+
+def main():
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--tokens", type=int, default=2_000_000, help="size of the generated corpus")
+	ap.add_argument("--samples", type=int, default=100_000, help="corpus n-grams sampled per order")
+	args = ap.parse_args()
+
+	corpus = args.corpus
+	if corpus is None:
+		corpus = Path(tempfile.gettempdir()) / f"zipf_gu_{args.tokens}.txt"
+		if not corpus.is_file():
+			make_zipf_corpus(corpus, args.tokens)
+	load_or_build(corpus, MAX_N)  # make sure the store exists, then map it fresh
+	t0 = time.perf_counter()
+	counts = load_counts(Path(str(corpus) + ".ngrams"))
+	print(f"Store mapped in {1000 * (time.perf_counter() - t0):.1f} ms; "
+		  f"tables {sum(counts.nbytes(n) for n in range(1, MAX_N + 1)) / 2**20:.1f} MB on disk")
+
+	rng = np.random.default_rng(0)
+	before = rss_mb()
+	dicts: Dict[int, Dict[Tuple[str, ...], int]] = {n: dict(counts.iter_sorted(n)) for n in range(1, MAX_N + 1)}
+	print(f"Resident str-tuple dicts: +{rss_mb() - before:.0f} MB peak RSS")
+
+	print(f"{'n':>2} {'queries':>8} {'hit%':>6} {'dict ns':>9} {'scalar ns':>10} {'batch ns':>9}")
+	for n in range(2, MAX_N + 1):
+		grams = workload(counts, n, args.samples, rng)
+		id_grams = [tuple(counts.vocab.encode(g)) for g in grams]
+		id_array = np.array(id_grams, dtype=np.int64).reshape(-1, n)
+		d = dicts[n]
+
+		t0 = time.perf_counter_ns()
+		expected = [d.get(g, 0) for g in grams]
+		t_dict = (time.perf_counter_ns() - t0) / len(grams)
+
+		t0 = time.perf_counter_ns()
+		scalar = [counts.count(g) for g in id_grams]
+		t_scalar = (time.perf_counter_ns() - t0) / len(grams)
+
+		t0 = time.perf_counter_ns()
+		batch, _ = counts.count_many(id_array)
+		t_batch = (time.perf_counter_ns() - t0) / len(grams)
+
+		assert scalar == expected and batch.tolist() == expected, f"order {n}: lookups disagree"
+		hits = 100 * sum(1 for c in expected if c) / len(expected)
+		print(f"{n:>2} {len(grams):>8} {hits:>6.1f} {t_dict:>9.0f} {t_scalar:>10.0f} {t_batch:>9.0f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,103 @@
+"""
+Lab 4 - Sentence scoring benchmark for q3.
+
+  dict    - the original sentence_prob over {tuple(str): count} dicts, including its
+			sum(counts[1].values()) per sentence-initial token
+  scalar  - q3.sentence_prob over the integer-id tables, one sentence and order at a time
+  multi   - ngram_scoring.SentenceScorer: one sentence at a time, all orders in one walk, with
+			the LRU cache of (order, prefix row, token) lookups shared across sentences
+  batch   - ngram_scoring.score_sentences, all sentences and NGRAM_ORDERS at once
+
+All four must agree exactly. q3_data.txt is repeated --repeat times to get a larger batch.
+
+Usage:
+  python bench_scoring.py [corpus.txt] [--repeat 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from ngram_scoring import CACHE_SIZE, SentenceScorer, score_sentences
+from ngram_store import load_or_build
+from q3 import ADD_K, INPUT_FILENAME, MAX_N, NGRAM_ORDERS, SENTENCE_FILE, find_file, read_sentences, sentence_prob
+
+
+def dict_sentence_prob(tokens: List[str], n: int, counts: Dict[int, Dict[Tuple[str, ...], int]], vocab_size: int) -> Tuple[float, float, float]:
+	"""q3.sentence_prob as it was before the integer-id tables (condensed, same arithmetic)."""
+	log10_add1 = log10_addK = token_type_sum = 0.0
+	history: List[str] = []
+	for w in tokens:
+		history.append(w)
+		use_hist = history[:-1]
+		order = n
+		while order > 1 and len(use_hist) < order - 1:
+			order -= 1
+		if order == 1:
+			count_w = counts[1].get((w,), 0)
+			total_tokens = sum(counts[1].values())
+			add1_p = (count_w + 1) / (total_tokens + vocab_size)
+			addK_p = (count_w + ADD_K) / (total_tokens + ADD_K * vocab_size)
+			token_type_sum += count_w + len(set(w))
+		else:
+			hist_slice = tuple(use_hist[-(order - 1):])
+			count_hw = counts[order].get(hist_slice + (w,), 0)
+			count_h = counts[order - 1].get(hist_slice, 0)
+			add1_p = (count_hw + 1) / (count_h + vocab_size) if vocab_size else 0.0
+			addK_p = (count_hw + ADD_K) / (count_h + ADD_K * vocab_size) if vocab_size else 0.0
+			token_type_sum += count_hw + len(set(w))
+		log10_add1 += math.log10(add1_p if add1_p > 0 else 1e-20)
+		log10_addK += math.log10(addK_p if addK_p > 0 else 1e-20)
+	return log10_add1, log10_addK, token_type_sum
+
+
+def main():
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--repeat", type=int, default=5, help="copies of q3_data.txt to score")
+	ap.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="SentenceScorer LRU entries")
+	args = ap.parse_args()
+
+	counts = load_or_build(args.corpus or find_file(INPUT_FILENAME), MAX_N)
+	vocab_size = len(counts.vocab)
+	sentences = [toks for _, toks in read_sentences(find_file(SENTENCE_FILE))] * args.repeat
+	dicts = {n: dict(counts.iter_sorted(n)) for n in range(1, MAX_N + 1)}
+	n_scores = len(sentences) * len(NGRAM_ORDERS)
+
+	t0 = time.perf_counter()
+	ref = {n: [dict_sentence_prob(s, n, dicts, vocab_size) for s in sentences] for n in NGRAM_ORDERS}
+	t_dict = time.perf_counter() - t0
+
+	t0 = time.perf_counter()
+	scalar = {n: [sentence_prob(s, n, counts, vocab_size) for s in sentences] for n in NGRAM_ORDERS}
+	t_scalar = time.perf_counter() - t0
+
+	t0 = time.perf_counter()
+	scorer = SentenceScorer(counts, vocab_size, ADD_K, args.cache_size)
+	per_sentence = [scorer.score(s, NGRAM_ORDERS) for s in sentences]
+	t_multi = time.perf_counter() - t0
+
+	t0 = time.perf_counter()
+	batch = score_sentences(sentences, NGRAM_ORDERS, counts, vocab_size, ADD_K)
+	t_batch = time.perf_counter() - t0
+
+	for n in NGRAM_ORDERS:
+		cols = list(zip(batch[n]["add1_log10"].tolist(), batch[n]["addK_log10"].tolist(), batch[n]["token_type"].tolist()))
+		multi = [scores[n] for scores in per_sentence]
+		assert ref[n] == scalar[n] == multi == cols, f"order {n}: scorers disagree"
+
+	print(f"{len(sentences)} sentences x orders {NGRAM_ORDERS} = {n_scores} scores (V = {vocab_size})")
+	print(f"{'scorer':<8} {'seconds':>9} {'scores/s':>12} {'speed-up':>9}")
+	for name, t in (("dict", t_dict), ("scalar", t_scalar), ("multi", t_multi), ("batch", t_batch)):
+		print(f"{name:<8} {t:>9.3f} {n_scores / t:>12,.0f} {t_dict / t:>8.1f}x")
+	cache = scorer.cache
+	print(f"multi cache: {len(cache.data)}/{cache.capacity} entries, {cache.hits:,} hits, {cache.misses:,} misses "
+		  f"({cache.hit_rate():.1%} hit rate)")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,146 @@
+"""
+Lab 4 - Load test for the scoring server (ngram_server.py).
+
+Opens --concurrency keep-alive connections that together send --requests POST /score requests,
+each with --sentences q3_data.txt sentences (cycled), and reports requests/s, sentences/s and
+p50/p90/p99 latency. The server's /health counters give the average requests per kernel batch.
+
+With --spawn the server is started as a subprocess (with --batch-window-ms / --max-batch) and
+stopped afterwards; otherwise the client talks to a running server.
+
+Usage:
+  python bench_server.py --spawn [corpus.txt] [--concurrency 32] [--requests 2000] [--max-batch 1]
+  python bench_server.py [--port 8765 | --unix /tmp/ngram.sock]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from itertools import cycle
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ngram_server import BATCH_WINDOW_MS, MAX_BATCH, PORT
+from q3 import SENTENCE_FILE, find_file, read_sentences
+
+
+async def _connect(port: int, unix: Optional[Path]):
+	if unix is not None:
+		return await asyncio.open_unix_connection(str(unix))
+	return await asyncio.open_connection("127.0.0.1", port)
+
+
+async def request(reader, writer, method: str, path: str, payload: Optional[dict] = None) -> dict:
+	body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+	writer.write((f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+				  f"Content-Length: {len(body)}\r\n\r\n").encode("ascii") + body)
+	await writer.drain()
+	status = await reader.readline()
+	if not status:
+		raise ConnectionError("server closed the connection")
+	size = 0
+	while True:
+		h = await reader.readline()
+		if h in (b"\r\n", b""):
+			break
+		k, _, v = h.decode("latin-1").partition(":")
+		if k.strip().lower() == "content-length":
+			size = int(v)
+	data = json.loads(await reader.readexactly(size))
+	if not status.startswith(b"HTTP/1.1 200"):
+		raise RuntimeError(f"{status.decode().strip()}: {data}")
+	return data
+
+
+async def wait_ready(port: int, unix: Optional[Path], timeout: float = 120.0) -> dict:
+	deadline = time.monotonic() + timeout
+	while True:
+		try:
+			reader, writer = await _connect(port, unix)
+			try:
+				return await request(reader, writer, "GET", "/health")
+			finally:
+				writer.close()
+		except (OSError, ConnectionError):
+			if time.monotonic() > deadline:
+				raise
+			await asyncio.sleep(0.2)
+
+
+async def load_test(port: int, unix: Optional[Path], payloads: List[dict], concurrency: int) -> Tuple[float, np.ndarray]:
+	latencies: List[float] = []
+	it = iter(payloads)
+
+	async def worker():
+		reader, writer = await _connect(port, unix)
+		try:
+			for payload in it:  # shared iterator: each payload is sent once
+				t0 = time.perf_counter()
+				await request(reader, writer, "POST", "/score", payload)
+				latencies.append(time.perf_counter() - t0)
+		finally:
+			writer.close()
+
+	t0 = time.perf_counter()
+	await asyncio.gather(*(worker() for _ in range(concurrency)))
+	return time.perf_counter() - t0, np.array(latencies)
+
+
+async def run(args) -> None:
+	sentences = [" ".join(toks) for _, toks in read_sentences(find_file(SENTENCE_FILE))]
+	src = cycle(sentences)
+	payloads = [{"sentences": [next(src) for _ in range(args.sentences)], "orders": [2, 3, 4]}
+				for _ in range(args.requests)]
+	before = await wait_ready(args.port, args.unix)
+	await load_test(args.port, args.unix, payloads[:args.concurrency], args.concurrency)  # warm-up
+	mid = await wait_ready(args.port, args.unix)
+	seconds, lat = await load_test(args.port, args.unix, payloads, args.concurrency)
+	after = await wait_ready(args.port, args.unix)
+
+	batches = after["batches"] - mid["batches"]
+	print(f"server: {before['total_tokens']} tokens, V = {before['vocab_size']}, Kneser-Ney: {before['kneser_ney']}")
+	print(f"{len(lat)} requests x {args.sentences} sentence(s), concurrency {args.concurrency}: "
+		  f"{seconds:.2f} s, {len(lat) / seconds:,.0f} req/s, {len(lat) * args.sentences / seconds:,.0f} sentences/s")
+	p50, p90, p99 = np.percentile(lat * 1000, [50, 90, 99])
+	print(f"latency ms: p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  max {lat.max() * 1000:.2f}")
+	if batches:
+		print(f"kernel batches: {batches} ({(after['requests'] - mid['requests']) / batches:.1f} requests per batch)")
+
+
+def main():
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path, help="with --spawn: corpus for the server")
+	ap.add_argument("--port", type=int, default=PORT)
+	ap.add_argument("--unix", type=Path)
+	ap.add_argument("--concurrency", type=int, default=32)
+	ap.add_argument("--requests", type=int, default=2000)
+	ap.add_argument("--sentences", type=int, default=1, help="sentences per request")
+	ap.add_argument("--spawn", action="store_true", help="start ngram_server.py for the duration of the test")
+	ap.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS, help="with --spawn")
+	ap.add_argument("--max-batch", type=int, default=MAX_BATCH, help="with --spawn")
+	args = ap.parse_args()
+
+	proc = None
+	if args.spawn:
+		cmd = [sys.executable, str(Path(__file__).with_name("ngram_server.py"))]
+		cmd += [str(args.corpus)] if args.corpus else []
+		cmd += ["--unix", str(args.unix)] if args.unix else ["--port", str(args.port)]
+		cmd += ["--batch-window-ms", str(args.batch_window_ms), "--max-batch", str(args.max_batch)]
+		proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+	try:
+		asyncio.run(run(args))
+	finally:
+		if proc is not None:
+			proc.terminate()
+			proc.wait()
+
+
+if __name__ == "__main__":
+	main()
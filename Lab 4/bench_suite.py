@@ -0,0 +1,217 @@
+"""
+Lab 4 - Benchmark suite: counting, q1/q2 exports and q3 scoring end to end, saved as JSON.
+
+Stages, each in its own subprocess so wall time and peak RSS are per stage:
+  count  - build the count store from scratch (ngram_store.load_or_build)
+  q1     - q1.main on the store: n-gram TSVs + columns
+  q2     - q2.main: smoothed TSVs + columns (builds the Kneser-Ney tables)
+  q3     - q3.main: sentence_probs.tsv for q3_data.txt
+
+Corpora are files given on the command line and/or generated Zipfian Gujarati-like corpora
+(--zipf N, cached in the temp dir; the real IndicCorp file is not in the repo). Every corpus is
+linked into a fresh temporary directory, so the store, the Kneser-Ney tables and all outputs stay
+out of the repo and out of the corpus directory.
+
+Recorded per stage: seconds, tokens/s and peak RSS; per corpus: tokens, vocabulary size and
+unique n-grams per order. --out writes everything as JSON (plus git commit, Python/NumPy versions
+and platform); --compare reads an earlier file and prints new/old ratios, marking slowdowns and
+memory growth beyond --tolerance.
+
+Usage:
+  python bench_suite.py [corpus.txt ...] [--zipf 500000 2000000] [--stages count q1 q2 q3]
+						[--repeat 3] [--out results.json] [--compare old_results.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from bench_counting import make_zipf_corpus
+
+STAGES = ("count", "q1", "q2", "q3")
+TOLERANCE = 0.10             # ratios above 1 + TOLERANCE are flagged
+
+
+######## Stage (subprocess side) ########
+def run_stage(stage: str, corpus: Path, work_dir: Path):
+	import q1
+	import q2
+	import q3
+	from ngram_store import default_store_path, load_or_build, read_header
+
+	t0 = time.perf_counter()
+	with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+		if stage == "count":
+			counts = load_or_build(corpus, q1.MAX_N, q1.LOSSY_EPSILON, q1.WORKERS)
+		else:
+			{"q1": q1.main, "q2": q2.main, "q3": q3.main}[stage](corpus, work_dir)
+	seconds = time.perf_counter() - t0
+	result = {
+		"stage": stage,
+		"seconds": seconds,
+		# RUSAGE_CHILDREN covers the counting pool when q1.WORKERS > 1
+		"peak_rss_mb": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+						   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024,
+	}
+	if stage == "count":
+		result["unique"] = {n: counts.unique(n) for n in range(1, counts.max_n + 1)}
+		result["vocab_size"] = len(counts.vocab)
+	result["tokens"] = read_header(default_store_path(corpus))[0]["total_tokens"]
+	print(json.dumps(result))
+
+
+######## Suite (parent side) ########
+def _link(corpus: Path, work_dir: Path) -> Path:
+	link = work_dir / corpus.name
+	try:
+		os.symlink(corpus.resolve(), link)
+	except OSError:  # no symlink permission (e.g. Windows): copy instead
+		shutil.copyfile(corpus, link)
+	return link
+
+
+def bench_corpus(corpus: Path, stages: List[str], repeat: int) -> Dict[str, object]:
+	"""Run the stages `repeat` times, each time in a fresh directory (so `count` starts cold)."""
+	runs: Dict[str, List[dict]] = {s: [] for s in stages}
+	for _ in range(repeat):
+		work_dir = Path(tempfile.mkdtemp(prefix="bench-suite-"))
+		try:
+			link = _link(corpus, work_dir)
+			for stage in ["count"] + [s for s in stages if s != "count"]:  # later stages need the store
+				out = subprocess.run([sys.executable, __file__, "--stage", stage, "--corpus", str(link),
+									  "--work-dir", str(work_dir)],
+									 check=True, capture_output=True, text=True, cwd=Path(__file__).parent).stdout
+				res = json.loads(out.strip().splitlines()[-1])
+				if stage in runs:
+					runs[stage].append(res)
+		finally:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+	first = runs[stages[0]][0]
+	count = runs["count"][0] if "count" in runs else None
+	summary: Dict[str, object] = {"path": str(corpus), "tokens": first["tokens"], "stages": {}}
+	if count is not None:
+		summary["vocab_size"] = count["vocab_size"]
+		summary["unique"] = count["unique"]
+	for stage, results in runs.items():
+		seconds = [r["seconds"] for r in results]
+		med = float(np.median(seconds))
+		summary["stages"][stage] = {
+			"seconds": med,
+			"seconds_runs": seconds,
+			"tokens_per_s": first["tokens"] / med if med else 0.0,
+			"peak_rss_mb": max(r["peak_rss_mb"] for r in results),
+		}
+	return summary
+
+
+def environment() -> Dict[str, object]:
+	try:
+		commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+								cwd=Path(__file__).parent, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+		"commit": commit,
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"platform": platform.platform(),
+		"cpus": os.cpu_count(),
+	}
+
+
+def print_results(results: Dict[str, dict]):
+	print(f"{'corpus':<24} {'stage':<6} {'seconds':>9} {'tokens/s':>12} {'peak RSS MB':>12}")
+	for label, r in results.items():
+		for stage, s in r["stages"].items():
+			print(f"{label:<24} {stage:<6} {s['seconds']:>9.2f} {s['tokens_per_s']:>12,.0f} {s['peak_rss_mb']:>12.1f}")
+		if "unique" in r:
+			print(f"{'':<24} {r['tokens']:,} tokens, V = {r['vocab_size']:,}, unique n-grams: "
+				  + ", ".join(f"{n}: {u:,}" for n, u in r["unique"].items()))
+
+
+def compare(results: Dict[str, dict], old: Dict[str, object], tolerance: float) -> int:
+	"""Print new/old ratios for every (corpus, stage) in both runs; return the number flagged."""
+	print(f"\nAgainst {old['environment'].get('commit')} ({old['environment'].get('time')}), "
+		  f"flagging ratios > {1 + tolerance:.2f}:")
+	print(f"{'corpus':<24} {'stage':<6} {'time new/old':>13} {'RSS new/old':>12}")
+	flagged = 0
+	for label, r in results.items():
+		before = old["corpora"].get(label)
+		if before is None:
+			continue
+		if before.get("unique") and r.get("unique") and before["unique"] != r["unique"]:
+			print(f"{label:<24} unique n-gram counts differ: {before['unique']} -> {r['unique']}")
+			flagged += 1
+		for stage, s in r["stages"].items():
+			b = before["stages"].get(stage)
+			if b is None:
+				continue
+			t, m = s["seconds"] / b["seconds"], s["peak_rss_mb"] / b["peak_rss_mb"]
+			marks = [name for name, ratio in (("slower", t), ("more memory", m)) if ratio > 1 + tolerance]
+			flagged += bool(marks)
+			print(f"{label:<24} {stage:<6} {t:>13.2f} {m:>12.2f}  {', '.join(marks)}")
+	return flagged
+
+
+def main():
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpora", nargs="*", type=Path)
+	ap.add_argument("--zipf", type=int, nargs="*", default=None,
+					help="generated corpus sizes in tokens (default 2000000 when no corpus is given)")
+	ap.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+	ap.add_argument("--repeat", type=int, default=1, help="runs per stage; the median time is reported")
+	ap.add_argument("--out", type=Path, help="write the results as JSON")
+	ap.add_argument("--compare", type=Path, help="earlier --out file to compare against")
+	ap.add_argument("--tolerance", type=float, default=TOLERANCE)
+	ap.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+	ap.add_argument("--corpus", type=Path, help=argparse.SUPPRESS)
+	ap.add_argument("--work-dir", type=Path, help=argparse.SUPPRESS)
+	args = ap.parse_args()
+
+	if args.stage:
+		run_stage(args.stage, args.corpus, args.work_dir)
+		return
+
+	corpora: Dict[str, Path] = {p.name: p for p in args.corpora}
+	sizes = args.zipf if args.zipf is not None else ([] if corpora else [2_000_000])
+	for n_tokens in sizes:
+		path = Path(tempfile.gettempdir()) / f"zipf_gu_{n_tokens}.txt"
+		if not path.is_file():
+			print(f"Generating {n_tokens} tokens -> {path}")
+			make_zipf_corpus(path, n_tokens)
+		corpora[f"zipf-{n_tokens}"] = path
+
+	results = {}
+	for label, path in corpora.items():
+		print(f"Running {', '.join(args.stages)} on {label} ({path}) x{args.repeat}", flush=True)
+		results[label] = bench_corpus(path, args.stages, args.repeat)
+	print()
+	print_results(results)
+
+	report = {"environment": environment(), "repeat": args.repeat, "corpora": results}
+	if args.out:
+		args.out.write_text(json.dumps(report, indent=1), encoding="utf-8")
+		print(f"\nWrote {args.out}")
+	if args.compare:
+		flagged = compare(results, json.loads(args.compare.read_text(encoding="utf-8")), args.tolerance)
+		print(f"{flagged} flagged")
+
+
+if __name__ == "__main__":
+	main()
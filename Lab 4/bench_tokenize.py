@@ -0,0 +1,84 @@
+"""
+Lab 4 - Tokenizer benchmark: corpus bytes -> token-id arrays, in MB/s.
+
+  lines   - the original path: text-mode line iteration, strip().split(), strip() per token, one
+			generator step and one Vocab.add per token
+  tokens  - stream_tokens (the compatibility generator, now over the bulk reader) + Vocab.add
+  bulk    - stream_token_ids: binary blocks, one split per block, Vocab.add_many
+
+All three must produce the same ids. Each variant gets a fresh Vocab; best of --repeat runs.
+
+Usage:
+  python bench_tokenize.py [corpus.txt] [--tokens 2000000] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from bench_counting import make_zipf_corpus
+from ngram_table import Vocab, stream_token_ids, stream_tokens
+
+
+def legacy_tokens(path: Path):
+	with path.open("r", encoding="utf-8", errors="ignore") as f:
+		for line in f:
+			for tok in line.strip().split():
+				t = tok.strip()
+				if t:
+					yield t
+
+
+def ids_per_token(tokens, vocab: Vocab) -> np.ndarray:
+	buf = array("q")
+	add = vocab.add
+	for tok in tokens:
+		buf.append(add(tok))
+	return np.frombuffer(buf, dtype=np.int64)
+
+
+VARIANTS = {
+	"lines": lambda path, vocab: ids_per_token(legacy_tokens(path), vocab),
+	"tokens": lambda path, vocab: ids_per_token(stream_tokens(path), vocab),
+	"bulk": lambda path, vocab: np.concatenate(list(stream_token_ids(path, vocab))),
+}
+
+
+def main():
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--tokens", type=int, default=2_000_000, help="size of the generated corpus")
+	ap.add_argument("--repeat", type=int, default=3)
+	args = ap.parse_args()
+
+	corpus = args.corpus
+	if corpus is None:
+		corpus = Path(tempfile.gettempdir()) / f"zipf_gu_{args.tokens}.txt"
+		if not corpus.is_file():
+			make_zipf_corpus(corpus, args.tokens)
+	mb = corpus.stat().st_size / 2**20
+
+	print(f"Corpus: {corpus} ({mb:.1f} MB)")
+	print(f"{'variant':<8} {'seconds':>8} {'MB/s':>8} {'tokens/s':>12}")
+	ref = None
+	for name, run in VARIANTS.items():
+		best = float("inf")
+		for _ in range(args.repeat):
+			vocab = Vocab()
+			t0 = time.perf_counter()
+			ids = run(corpus, vocab)
+			best = min(best, time.perf_counter() - t0)
+		if ref is None:
+			ref = (ids, vocab.tokens)
+		assert np.array_equal(ids, ref[0]) and vocab.tokens == ref[1], f"{name} disagrees with lines"
+		print(f"{name:<8} {best:>8.2f} {mb / best:>8.1f} {len(ids) / best:>12,.0f}")
+
+
+if __name__ == "__main__":
+	main()
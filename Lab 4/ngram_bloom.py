@@ -0,0 +1,211 @@
+"""
+Lab 4 - Register-Blocked Bloom Filters over the N‑gram Keys (fast path for unseen n-grams)
+
+On real text most higher-order lookups miss: the history was seen, the n-gram was not. A miss
+still costs a binary search over the whole (memory-mapped) table of that order. A Bloom filter
+over the table's keys answers "definitely absent" for most of them from a single word:
+
+  * one filter per order n >= 2 over the flat keys (prefix row << 32 | id) of table n, including
+	count-0 placeholder rows, so lookups return exactly the rows they returned before;
+  * register-blocked layout: a key hashes (splitmix64, ngram_sketch.gram_hashes) to one 64-bit
+	word (top 24 bits, multiply-shift) and sets k bits in it (6-bit fields of the low 40 bits),
+	so a query is one gather and one mask compare, ~4x cheaper than k probes over a 512-bit block;
+  * sized for FP_RATE with the word loads as Poisson(64 / bits per key):
+	FP = E[(1 - (1 - 1/64)^(k L))^k], the smallest bits per key (and its best k <= 6) that meets
+	the target. That is ~12 bits/key for 1%, against 9.6 for an unblocked filter; the CLI measures
+	the real rate on the scoring workload.
+
+NGramCounts.lookup checks the filter of each level before its binary search and only searches the
+queries that may be present. The filters count queries checked, definite misses skipped and false
+positives (passed the filter, missed in the table). The ContextTrie and suffix-array paths and the
+scalar per-sentence scorer do not use them.
+
+The filters are saved next to the count store (<corpus>.ngrams.bloom, ngram_store.py container),
+memory-mapped by later runs and rebuilt when the store or the FP rate changes.
+
+Usage:
+  python ngram_bloom.py [corpus.txt] [--fp-rate 0.01] [--repeat 5] [--sentences q3_data.txt]
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+
+from ngram_sketch import gram_hashes
+from ngram_store import map_array, read_header, store_stamp, write_arrays
+from ngram_table import NGramCounts
+
+BLOOM_MAGIC = b"NGRAMBF1"
+BLOOM_VERSION = 1
+BLOOM_SUFFIX = ".bloom"
+FP_RATE = 0.01               # target false-positive rate per filter
+WORD_BITS = 64
+MAX_K = 6                    # bit positions per key: 6-bit fields of the 40 hash bits below the word index
+BUILD_KEYS = 1 << 20         # keys hashed per step while building
+
+
+def false_positive_rate(bits_per_key: float, k: int) -> float:
+	"""Expected FP rate of a register-blocked filter (word loads ~ Poisson)."""
+	lam = WORD_BITS / bits_per_key
+	p, total, load = math.exp(-lam), 0.0, 0
+	while load < 6 * lam + 50:
+		total += p * (1 - (1 - 1 / WORD_BITS) ** (k * load)) ** k
+		load += 1
+		p *= lam / load
+	return total
+
+
+def filter_size(fp_rate: float) -> Tuple[float, int]:
+	"""(bits per key, k): the smallest size, in steps of 1/4 bit, whose expected FP rate meets fp_rate."""
+	bits = 4.0
+	while bits < WORD_BITS:
+		k = min(range(1, MAX_K + 1), key=lambda k: false_positive_rate(bits, k))
+		if false_positive_rate(bits, k) <= fp_rate:
+			return bits, k
+		bits += 0.25
+	return float(WORD_BITS), 1
+
+
+class BloomFilter:
+	"""Register-blocked Bloom filter over uint64 keys (see module docstring)."""
+
+	def __init__(self, words: np.ndarray, k: int, n_keys: int):
+		self.words = words
+		self.k = k
+		self.n_keys = n_keys
+		self.checked = 0
+		self.skipped = 0
+		self.false_positives = 0
+
+	@classmethod
+	def build(cls, keys: np.ndarray, fp_rate: float = FP_RATE) -> "BloomFilter":
+		bits_per_key, k = filter_size(fp_rate)
+		n_words = min(max(1, math.ceil(len(keys) * bits_per_key / WORD_BITS)), 1 << 40)
+		words = np.zeros(n_words, dtype="<u8")
+		for lo in range(0, len(keys), BUILD_KEYS):
+			word, mask = cls._hash(keys[lo:lo + BUILD_KEYS], n_words, k)
+			np.bitwise_or.at(words, word, mask)
+		return cls(words, k, len(keys))
+
+	@staticmethod
+	def _hash(keys: np.ndarray, n_words: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+		"""(word index, mask of the key's k bits)."""
+		h = gram_hashes(np.asarray(keys).astype(np.int64)[:, None])
+		word = (((h >> np.uint64(40)) * np.uint64(n_words)) >> np.uint64(24)).astype(np.int64)
+		mask = np.zeros(len(h), dtype=np.uint64)
+		for i in range(k):
+			mask |= np.uint64(1) << ((h >> np.uint64(6 * i)) & np.uint64(63))
+		return word, mask
+
+	def contains(self, keys: np.ndarray) -> np.ndarray:
+		"""False where a key is definitely absent; True where it may be present."""
+		word, mask = self._hash(keys, len(self.words), self.k)
+		out = (self.words[word] & mask) == mask
+		self.checked += len(out)
+		self.skipped += len(out) - int(np.count_nonzero(out))
+		return out
+
+	def nbytes(self) -> int:
+		return int(self.words.nbytes)
+
+
+######## Store ########
+def default_bloom_path(store: Path) -> Path:
+	return store.with_name(store.name + BLOOM_SUFFIX)
+
+
+def build_filters(counts: NGramCounts, fp_rate: float = FP_RATE) -> Dict[int, BloomFilter]:
+	return {n: BloomFilter.build(counts.keys[n], fp_rate) for n in range(2, counts.max_n + 1)}
+
+
+def save_filters(filters: Dict[int, BloomFilter], path: Path, store: Path, fp_rate: float):
+	write_arrays(path, {
+		"version": BLOOM_VERSION,
+		"fp_rate": fp_rate,
+		"filters": {str(n): {"k": f.k, "n_keys": f.n_keys} for n, f in filters.items()},
+		"store": store_stamp(store),
+	}, {f"bits_{n}": f.words for n, f in filters.items()}, BLOOM_MAGIC)
+
+
+def load_filters(path: Path) -> Dict[int, BloomFilter]:
+	header, base = read_header(path, BLOOM_MAGIC, BLOOM_VERSION)
+	return {int(n): BloomFilter(map_array(path, header, base, f"bits_{n}"), f["k"], f["n_keys"])
+			for n, f in header["filters"].items()}
+
+
+def load_or_build_filters(counts: NGramCounts, store: Path, fp_rate: float = FP_RATE) -> Dict[int, BloomFilter]:
+	"""Memory-map the filters saved next to `store`, or build and save them if the store changed."""
+	path = default_bloom_path(store)
+	if path.is_file():
+		try:
+			header, _ = read_header(path, BLOOM_MAGIC, BLOOM_VERSION)
+			if (header["store"] == store_stamp(store) and header["fp_rate"] == fp_rate
+					and all(str(n) in header["filters"] for n in range(2, counts.max_n + 1))):
+				return load_filters(path)
+		except (ValueError, KeyError, OSError):
+			pass
+	filters = build_filters(counts, fp_rate)
+	if store.is_file():
+		save_filters(filters, path, store, fp_rate)
+	return filters
+
+
+def main():
+	from ngram_kneser_ney import load_or_build_kneser_ney
+	from ngram_scoring import score_sentences
+	from ngram_store import default_store_path, load_or_build
+	from q3 import ADD_K, INPUT_FILENAME, MAX_N, NGRAM_ORDERS, SENTENCE_FILE, find_file, read_sentences
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--fp-rate", type=float, default=FP_RATE)
+	ap.add_argument("--sentences", type=Path, help=f"evaluation sentences (default {SENTENCE_FILE})")
+	ap.add_argument("--repeat", type=int, default=5, help="timed scoring passes per variant (best is reported)")
+	args = ap.parse_args()
+
+	corpus = args.corpus or find_file(INPUT_FILENAME)
+	store = default_store_path(corpus)
+	counts = load_or_build(corpus, MAX_N)
+	kn = load_or_build_kneser_ney(counts, store)
+	t0 = time.perf_counter()
+	filters = load_or_build_filters(counts, store, args.fp_rate)
+	print(f"Filters ready in {time.perf_counter() - t0:.2f} s (target FP rate {args.fp_rate:g}):")
+	for n, f in filters.items():
+		print(f"  n={n}: {f.n_keys} keys, k={f.k}, {f.nbytes() / 2**20:.1f} MB ({8 * f.nbytes() / max(f.n_keys, 1):.1f} bits/key)")
+
+	sent_path = args.sentences or find_file(SENTENCE_FILE)
+	sentences = [toks for _, toks in read_sentences(sent_path)]
+	timings: Dict[str, float] = {}
+	results = {}
+	for name, bloom in (("no filter", None), ("Bloom", filters)):
+		counts.bloom = bloom
+		best = math.inf
+		for _ in range(args.repeat):
+			for f in filters.values():
+				f.checked = f.skipped = f.false_positives = 0
+			t0 = time.perf_counter()
+			results[name] = score_sentences(sentences, NGRAM_ORDERS, counts, len(counts.vocab), ADD_K, kn)
+			best = min(best, time.perf_counter() - t0)
+		timings[name] = best
+	counts.bloom = None
+
+	same = all(np.array_equal(results["no filter"][n][c], results["Bloom"][n][c])
+			   for n in NGRAM_ORDERS for c in results["Bloom"][n])
+	print(f"\nScoring {sent_path.name} (orders {', '.join(map(str, NGRAM_ORDERS))}, Kneser-Ney included), one pass:")
+	print(f"  {'n':>3} {'checked':>9} {'skipped':>9} {'searched':>9} {'false pos':>9} {'FP rate':>8}")
+	for n, f in filters.items():
+		misses = f.skipped + f.false_positives
+		print(f"  {n:>3} {f.checked:>9} {f.skipped:>9} {f.checked - f.skipped:>9} {f.false_positives:>9} "
+			  f"{f.false_positives / misses if misses else 0.0:>8.4f}")
+	print(f"  no filter: {timings['no filter'] * 1e3:.1f} ms; Bloom: {timings['Bloom'] * 1e3:.1f} ms "
+		  f"({timings['no filter'] / timings['Bloom']:.2f}x); same scores: {same}")
+
+
+if __name__ == "__main__":
+	main()
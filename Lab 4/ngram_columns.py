@@ -0,0 +1,92 @@
+"""
+Lab 4 - Columnar N‑gram Tables (binary export next to the TSVs)
+
+The TSVs are for reading; tools that post-process the tables should use the columnar files,
+which are written in bulk from arrays and memory-mapped back without parsing:
+
+  <table>.cols  - same container as the count store (ngram_store.write_arrays), magic b"NGRAMCL1":
+				  w1..wn (uint32 token ids), count (int64), then the table's value columns
+				  (float64 or float32 probabilities, int64 scores), rows in TSV order
+  vocab.txt     - utf-8, one token per line; line i is token id i (shared by all tables in a directory)
+
+Usage:
+  table = read_columns(Path("bigrams_smoothing.cols"))
+  table["add1_p"], table.ids(), table.vocab.decode(table.ids()[0])
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ngram_store import map_array, read_header, write_arrays
+from ngram_table import Vocab
+
+COLUMNS_MAGIC = b"NGRAMCL1"
+COLUMNS_VERSION = 1
+COLUMNS_SUFFIX = ".cols"
+VOCAB_FILE = "vocab.txt"
+
+
+######## Write ########
+def write_vocab(vocab: Vocab, out_dir: Path) -> Path:
+	path = out_dir / VOCAB_FILE
+	with path.open("w", encoding="utf-8", newline="\n") as f:
+		f.writelines(tok + "\n" for tok in vocab.tokens)
+	return path
+
+
+def write_columns(path: Path, ids: np.ndarray, columns: Dict[str, np.ndarray], meta: Optional[Dict[str, object]] = None):
+	"""Write an (m, n) token-id matrix plus named per-row columns; the vocab file is written separately."""
+	m, n = ids.shape
+	arrays: Dict[str, np.ndarray] = {f"w{j + 1}": np.ascontiguousarray(ids[:, j], dtype="<u4") for j in range(n)}
+	for name, col in columns.items():
+		col = np.asarray(col)
+		if len(col) != m:
+			raise ValueError(f"column {name!r} has {len(col)} rows, expected {m}")
+		arrays[name] = np.ascontiguousarray(col, dtype=col.dtype.newbyteorder("<"))
+	header = {"version": COLUMNS_VERSION, "n": n, "rows": m, "vocab": VOCAB_FILE,
+			  "columns": list(arrays), "meta": meta or {}}
+	write_arrays(path, header, arrays, COLUMNS_MAGIC)
+
+
+######## Read ########
+class ColumnTable:
+	"""A memory-mapped columnar table: table[name] is a zero-copy read-only array."""
+
+	def __init__(self, path: Path):
+		self.path = path
+		self.header, base = read_header(path, COLUMNS_MAGIC, COLUMNS_VERSION)
+		self.n: int = self.header["n"]
+		self.rows: int = self.header["rows"]
+		self.meta: Dict[str, object] = self.header["meta"]
+		self.columns: Dict[str, np.ndarray] = {name: map_array(path, self.header, base, name)
+											   for name in self.header["columns"]}
+		self._vocab: Optional[Vocab] = None
+
+	def __len__(self) -> int:
+		return self.rows
+
+	def __getitem__(self, name: str) -> np.ndarray:
+		return self.columns[name]
+
+	@property
+	def names(self) -> List[str]:
+		return list(self.columns)
+
+	def ids(self) -> np.ndarray:
+		"""(rows, n) int64 token-id matrix (a copy: the id columns are stored separately)."""
+		return np.stack([self.columns[f"w{j + 1}"] for j in range(self.n)], axis=1).astype(np.int64)
+
+	@property
+	def vocab(self) -> Vocab:
+		if self._vocab is None:
+			text = (self.path.parent / self.header["vocab"]).read_text(encoding="utf-8")
+			self._vocab = Vocab.from_tokens(text.split("\n")[:-1])
+		return self._vocab
+
+
+def read_columns(path: Path) -> ColumnTable:
+	return ColumnTable(path)
@@ -0,0 +1,292 @@
+"""
+Lab 4 - Quantized Compact Language Model (deployment export of the Kneser-Ney model)
+
+The smoothed tables spend 8 bytes per key plus 8 per probability (or ~10 characters of text per
+value in *_smoothing.tsv). For scoring, only the Kneser-Ney model of order N = MAX_N is needed, in
+backoff form:
+
+  P_N(w | h) = p_j(s)                                 s = longest suffix of hw in table j
+			   * prod over longer histories h_i of b_i(h_i)   (1 for an unseen history)
+
+  p_j(row) - P_j(w | h) of the model of order N for every row of table j (ngram_predict.level_probs:
+			 alpha_j + gamma_j(h) * P_{j-1}; the "low" variant below N, so sentence-initial tokens get
+			 the same lower-order distributions as KneserNey.probs)
+  b_j(row) - gamma_{j+1} of row j taken as a history (j < N); the empty history and unknown tokens
+			 use gamma_1 / V
+
+which is the interpolated recursion of KneserNey.probs unrolled: an unseen hw has alpha = 0, so
+P_j = gamma_j(h) * P_{j-1}. Stored per order j:
+
+  ids, starts     - the ContextTrie layout (ngram_trie.py), each array bit-packed to the bits of its
+					largest value (BitArray: ~16 bits per id for a 50k vocabulary, instead of 64)
+  prob/backoff    - log10 values quantized to QUANT_BITS (8 or 16) codes with a per-order codebook:
+					rows are cut into 2^bits equal-size bins by value and each bin is decoded as its
+					mean (lossless when an order has fewer distinct values than codes). Unigram
+					probabilities always get UNIGRAM_BITS: most unigram rows are rare words sharing
+					a few values, so 8-bit bins would lump the frequent words together, and every
+					backed-off token ends on a unigram (+10% perplexity at 8 bits, <0.1% at 16)
+
+The file uses the ngram_store.py container (<corpus>.ngrams.q8.lm by default), memory-mapped on
+load. Scoring walks the bit-packed trie directly (ngram_trie.walk), decodes codes through the
+codebooks and needs neither the count store nor the Kneser-Ney tables.
+
+Usage:
+  python ngram_compact.py [corpus.txt] [--bits 8 16] [--out model.lm]
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from ngram_kneser_ney import KneserNey
+from ngram_predict import level_probs
+from ngram_scoring import MIN_PROB, sum_in_order
+from ngram_store import map_array, read_header, write_arrays
+from ngram_table import NGramCounts, Vocab
+from ngram_trie import ContextTrie, walk
+
+LM_MAGIC = b"NGRAMLM1"
+LM_VERSION = 1
+QUANT_BITS = 8               # 8 or 16-bit probability / backoff codes
+UNIGRAM_BITS = 16            # unigram probabilities: few rows, but they decide every backed-off token
+
+
+######## Packing ########
+class BitArray:
+	"""Unsigned integers of `bits` bits each, packed into little-endian uint64 words."""
+
+	def __init__(self, words: np.ndarray, bits: int, length: int):
+		self.words = words
+		self.bits = bits
+		self.length = length
+		self._mask = np.uint64((1 << bits) - 1)
+
+	@classmethod
+	def pack(cls, values: np.ndarray) -> "BitArray":
+		values = np.asarray(values).astype(np.uint64)
+		bits = max(1, int(values.max()).bit_length()) if len(values) else 1
+		bit_rows = np.empty((len(values), bits), dtype=np.uint8)
+		for b in range(bits):
+			bit_rows[:, b] = (values >> np.uint64(b)) & np.uint64(1)
+		packed = np.packbits(bit_rows.reshape(-1), bitorder="little")
+		words = np.zeros(len(packed) // 8 + 2, dtype="<u8")  # a spare word for reads that straddle the end
+		words.view(np.uint8)[:len(packed)] = packed
+		return cls(words, bits, len(values))
+
+	def __len__(self) -> int:
+		return self.length
+
+	def __getitem__(self, idx) -> np.ndarray:
+		pos = np.asarray(idx, dtype=np.int64) * self.bits
+		word = pos >> 6
+		off = (pos & 63).astype(np.uint64)
+		lo = self.words[word] >> off
+		hi = np.where(off > 0, self.words[word + 1] << ((np.uint64(64) - off) & np.uint64(63)), np.uint64(0))
+		return ((lo | hi) & self._mask).astype(np.int64)
+
+	def nbytes(self) -> int:
+		return int(self.words.nbytes)
+
+
+def _code_dtype(bits: int) -> str:
+	return "u1" if bits <= 8 else "<u2"
+
+
+def quantize(values: np.ndarray, bits: int) -> Tuple[np.ndarray, np.ndarray]:
+	"""(codes, codebook) with codebook[codes] ~ values: equal-size bins by value, decoded as their mean."""
+	values = np.asarray(values, dtype=np.float64)
+	dtype = _code_dtype(bits)
+	distinct = np.unique(values)
+	if len(distinct) <= 1 << bits:  # few enough values to keep them all
+		return np.searchsorted(distinct, values).astype(dtype), distinct
+	order = np.argsort(values, kind="stable")
+	bins = (np.arange(len(values), dtype=np.int64) << bits) // len(values)
+	book = np.bincount(bins, weights=values[order]) / np.bincount(bins)
+	codes = np.empty(len(values), dtype=dtype)
+	codes[order] = bins
+	return codes, book
+
+
+######## Model ########
+class CompactLM:
+	"""Quantized backoff form of a Kneser-Ney model over a bit-packed trie (module docstring)."""
+
+	def __init__(self, vocab: Vocab, ids: Dict[int, BitArray], starts: Dict[int, BitArray],
+				 prob_codes: Dict[int, np.ndarray], prob_book: Dict[int, np.ndarray],
+				 backoff_codes: Dict[int, np.ndarray], backoff_book: Dict[int, np.ndarray],
+				 oov_log10: float, bits: int):
+		self.vocab = vocab
+		self.ids = ids
+		self.starts = starts
+		self.prob_codes = prob_codes
+		self.prob_book = prob_book
+		self.backoff_codes = backoff_codes
+		self.backoff_book = backoff_book
+		self.oov_log10 = oov_log10    # log10 P_1 of an unknown token: gamma_1 / V
+		self.bits = bits
+		self.max_n = len(ids)
+
+	@classmethod
+	def build(cls, counts: NGramCounts, kn: KneserNey, bits: int = QUANT_BITS) -> "CompactLM":
+		max_n = kn.max_n
+		probs = level_probs(kn)
+		trie = ContextTrie.from_counts(counts)
+		ids: Dict[int, BitArray] = {}
+		starts: Dict[int, BitArray] = {}
+		prob_codes: Dict[int, np.ndarray] = {}
+		prob_book: Dict[int, np.ndarray] = {}
+		backoff_codes: Dict[int, np.ndarray] = {}
+		backoff_book: Dict[int, np.ndarray] = {}
+		for j in range(1, max_n + 1):
+			p = probs[j]
+			zero = np.flatnonzero(np.asarray(counts.counts[j]) == 0)
+			if len(zero):  # prefix placeholders: their backed-off probability (level_probs leaves 0)
+				p = p.copy()
+				p[zero] = kn.probs(counts.rows(j, zero), max_n)
+			prob_codes[j], prob_book[j] = quantize(np.log10(np.maximum(p, MIN_PROB)), max(bits, UNIGRAM_BITS) if j == 1 else bits)
+			if j < max_n:
+				g = kn.gamma["top" if j + 1 == max_n else "low"][j + 1]
+				backoff_codes[j], backoff_book[j] = quantize(np.log10(np.maximum(g, MIN_PROB)), bits)
+			ids[j] = BitArray.pack(trie.ids[j])
+			if j > 1:
+				starts[j] = BitArray.pack(trie.starts[j])
+		gamma_1 = float(kn.gamma["top" if max_n == 1 else "low"][1][0])
+		oov = math.log10(max(gamma_1 / max(kn.vocab_size, 1), MIN_PROB))
+		return cls(counts.vocab, ids, starts, prob_codes, prob_book, backoff_codes, backoff_book, oov, bits)
+
+	def log10_probs(self, grams: np.ndarray) -> np.ndarray:
+		"""log10 P(w | h) for an (m, k) array of token ids (-1 = unknown), k <= max_n."""
+		grams = np.asarray(grams, dtype=np.int64)
+		m, k = grams.shape
+		lp = np.full(m, self.oov_log10)
+		for j in range(1, k + 1):
+			row, hist = walk(self.ids, self.starts, grams[:, k - j:])
+			found = row >= 0
+			if j > 1:
+				seen_h = hist >= 0
+				lp[seen_h] += self.backoff_book[j - 1][self.backoff_codes[j - 1][hist[seen_h]]]
+			lp[found] = self.prob_book[j][self.prob_codes[j][row[found]]]
+		return lp
+
+	def score(self, sentences: Sequence[List[str]]) -> np.ndarray:
+		"""Per-sentence log10 probability; sentence-initial tokens use their shorter histories (like q3)."""
+		lengths = np.fromiter((len(t) for t in sentences), dtype=np.int64, count=len(sentences))
+		ids = np.array(self.vocab.encode([w for toks in sentences for w in toks]), dtype=np.int64)
+		sent = np.repeat(np.arange(len(sentences)), lengths)
+		pos = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+		eff = np.minimum(self.max_n, pos + 1)
+		lp = np.zeros(len(ids), dtype=np.float64)
+		for o in range(1, self.max_n + 1):
+			at = np.flatnonzero(eff == o)
+			if len(at):
+				lp[at] = self.log10_probs(ids[at[:, None] + np.arange(1 - o, 1)])
+		return sum_in_order(lp, sent, pos, len(sentences))
+
+	def nbytes(self) -> int:
+		return (sum(a.nbytes() for a in self.ids.values()) + sum(a.nbytes() for a in self.starts.values())
+				+ sum(int(a.nbytes) for t in (self.prob_codes, self.prob_book, self.backoff_codes, self.backoff_book)
+					  for a in t.values()))
+
+
+######## File ########
+def default_lm_path(store: Path, bits: int = QUANT_BITS) -> Path:
+	return store.with_name(f"{store.name}.q{bits}.lm")
+
+
+def save_compact_lm(lm: CompactLM, path: Path):
+	arrays: Dict[str, np.ndarray] = {}
+	shapes: Dict[str, Dict[str, int]] = {}
+	for j in range(1, lm.max_n + 1):
+		for name, packed in (("ids", lm.ids.get(j)), ("starts", lm.starts.get(j))):
+			if packed is not None:
+				arrays[f"{name}_{j}"] = packed.words
+				shapes[f"{name}_{j}"] = {"bits": packed.bits, "length": packed.length}
+		arrays[f"prob_codes_{j}"] = np.ascontiguousarray(lm.prob_codes[j], dtype=_code_dtype(lm.prob_codes[j].dtype.itemsize * 8))
+		arrays[f"prob_book_{j}"] = np.ascontiguousarray(lm.prob_book[j], dtype="<f8")
+		if j in lm.backoff_codes:
+			arrays[f"backoff_codes_{j}"] = np.ascontiguousarray(lm.backoff_codes[j], dtype=_code_dtype(lm.bits))
+			arrays[f"backoff_book_{j}"] = np.ascontiguousarray(lm.backoff_book[j], dtype="<f8")
+	arrays["vocab"] = np.frombuffer("\n".join(lm.vocab.tokens).encode("utf-8"), dtype=np.uint8)
+	write_arrays(path, {"version": LM_VERSION, "max_n": lm.max_n, "bits": lm.bits, "oov_log10": lm.oov_log10,
+						"packed": shapes}, arrays, LM_MAGIC)
+
+
+def load_compact_lm(path: Path) -> CompactLM:
+	header, base = read_header(path, LM_MAGIC, LM_VERSION)
+
+	def array(name: str) -> np.ndarray:
+		return map_array(path, header, base, name)
+
+	def packed(name: str) -> BitArray:
+		shape = header["packed"][name]
+		return BitArray(array(name), shape["bits"], shape["length"])
+
+	blob = array("vocab").tobytes().decode("utf-8")
+	vocab = Vocab.from_tokens(blob.split("\n") if blob else [])
+	max_n = header["max_n"]
+	low = range(1, max_n)
+	return CompactLM(vocab, {j: packed(f"ids_{j}") for j in range(1, max_n + 1)},
+					 {j: packed(f"starts_{j}") for j in range(2, max_n + 1)},
+					 {j: array(f"prob_codes_{j}") for j in range(1, max_n + 1)},
+					 {j: array(f"prob_book_{j}") for j in range(1, max_n + 1)},
+					 {j: array(f"backoff_codes_{j}") for j in low}, {j: array(f"backoff_book_{j}") for j in low},
+					 header["oov_log10"], header["bits"])
+
+
+######## Report ########
+def float_model_nbytes(counts: NGramCounts) -> int:
+	"""The same backoff model unquantized: uint64 key + float64 log10 p per row, + float64 backoff below N."""
+	return sum(len(counts.keys[j]) * (8 + 8 + (8 if j < counts.max_n else 0)) for j in range(1, counts.max_n + 1))
+
+
+def main():
+	from ngram_kneser_ney import load_or_build_kneser_ney
+	from ngram_scoring import score_sentences
+	from ngram_store import default_store_path, load_or_build
+	from q3 import ADD_K, INPUT_FILENAME, MAX_N, SENTENCE_FILE, find_file, read_sentences
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--bits", type=int, nargs="+", choices=(8, 16), default=[8, 16])
+	ap.add_argument("--out", type=Path, help="model file (default <corpus>.ngrams.q<bits>.lm); only with one --bits")
+	args = ap.parse_args()
+
+	corpus = args.corpus or find_file(INPUT_FILENAME)
+	store = default_store_path(corpus)
+	counts = load_or_build(corpus, MAX_N)
+	kn = load_or_build_kneser_ney(counts, store)
+	sentences = [toks for _, toks in read_sentences(find_file(SENTENCE_FILE))]
+	n_tokens = sum(len(t) for t in sentences)
+	exact = score_sentences(sentences, [MAX_N], counts, len(counts.vocab), ADD_K, kn)[MAX_N]["kn_log10"]
+	ppl_exact = 10 ** (-float(exact.sum()) / n_tokens) if n_tokens else 0.0
+
+	kn_mb = (sum(counts.nbytes(n) for n in range(1, MAX_N + 1)) + kn.nbytes()) / 2**20
+	print(f"Kneser-Ney, order {MAX_N}, {SENTENCE_FILE} ({n_tokens} tokens):")
+	print(f"  {'model':<34} {'MB':>8} {'vs float64':>10} {'perplexity':>11} {'delta':>8}")
+	print(f"  {'count store tables + .kn tables':<34} {kn_mb:>8.1f} {'':>10} {ppl_exact:>11.3f}")
+	float_mb = float_model_nbytes(counts) / 2**20
+	print(f"  {'backoff form, uint64 keys + float64':<34} {float_mb:>8.1f} {'1.00x':>10} {ppl_exact:>11.3f}")
+	for bits in args.bits:
+		t0 = time.perf_counter()
+		lm = CompactLM.build(counts, kn, bits)
+		path = args.out if args.out and len(args.bits) == 1 else default_lm_path(store, bits)
+		save_compact_lm(lm, path)
+		built = time.perf_counter() - t0
+		lm = load_compact_lm(path)
+		t0 = time.perf_counter()
+		scores = lm.score(sentences)
+		scored = time.perf_counter() - t0
+		ppl = 10 ** (-float(scores.sum()) / n_tokens) if n_tokens else 0.0
+		mb = path.stat().st_size / 2**20
+		print(f"  {f'{bits}-bit codes, bit-packed trie':<34} {mb:>8.1f} {float_mb / mb:>9.1f}x {ppl:>11.3f} "
+			  f"{(ppl / ppl_exact - 1) if ppl_exact else 0.0:>+8.3%}   ({path.name}: built {built:.2f} s, scored {scored:.3f} s)")
+
+
+if __name__ == "__main__":
+	main()
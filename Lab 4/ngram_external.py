@@ -0,0 +1,173 @@
+"""
+Lab 4 - Bounded-Memory N‑gram Counting (spill sorted runs to disk, merge by id range)
+
+Exact counts for a corpus of any size with a fixed memory budget for the n-gram tables:
+
+  count:  chunks are counted into in-memory tables as usual (ngram_table.NGramCounter). When
+		  the resident tables outgrow their share of the budget they are merged into one sorted
+		  run and written to disk (one .npy file per order and array), and counting continues
+		  from an empty table.
+  merge:  rows sort by id tuple, so every run splits into contiguous blocks by first-token id.
+		  The id space is cut into ranges whose rows (summed over all runs) fit the budget; for
+		  each range the blocks of all runs are read from the memory-mapped run files and
+		  k-way merged, and the merged block is appended to the output. Blocks stack in id
+		  order, so the output is the same table count_ngrams builds in memory.
+
+The merged tables are written straight into the count store (ngram_store.py), which q1/q2/q3
+then memory-map. The budget covers the n-gram tables and their merge temporaries; the
+vocabulary (one dict entry per distinct token) and the interpreter are on top of it.
+Counting is serial.
+"""
+
+from __future__ import annotations
+
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ngram_table import (CHUNK_TOKENS, KEY_SHIFT, CountOfCounts, NGramCounter, NGramCounts, Tables, Vocab,
+						 count_of_counts, merge_all, merge_count_of_counts, split_tables, stream_token_ids,
+						 table_cuts, table_nbytes)
+
+MERGE_OVERHEAD = 4           # resident tables get 1/MERGE_OVERHEAD of the budget; merges need the rest
+ROW_BYTES = 16               # uint64 key + int64 count
+CHUNK_BYTES_PER_TOKEN = 64   # _encode_chunk temporaries per token and order
+
+
+######## Spilling Counter ########
+class SpillingCounter(NGramCounter):
+	"""NGramCounter that writes its tables to sorted run files instead of growing past a budget."""
+
+	def __init__(self, vocab: Vocab, max_n: int, memory_budget: int, spill_dir: Path, monitor=None):
+		super().__init__(vocab, max_n, monitor=monitor)
+		self.table_budget = memory_budget // MERGE_OVERHEAD
+		self.spill_dir = spill_dir
+		self.spilled: List[Tables] = []
+
+	def table_stats(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+		"""Rows include the spilled runs; bytes are the resident tables only."""
+		rows, nbytes = super().table_stats()
+		for keys, _ in self.spilled:
+			for n in rows:
+				rows[n] += len(keys[n])
+		return rows, nbytes
+
+	def _push(self, run: Tables):
+		super()._push(run)
+		if sum(table_nbytes(r) for r in self._runs) > self.table_budget:
+			self.spill()
+
+	def spill(self):
+		"""Merge the resident runs and write them to disk as one more memory-mapped run."""
+		if not self._runs:
+			return
+		keys, counts = merge_all(self._runs)
+		self._runs = []
+		r = len(self.spilled)
+		mapped: Tables = ({}, {})
+		for n in range(1, self.max_n + 1):
+			for name, arr, out in ((f"keys{n}", keys[n], mapped[0]), (f"counts{n}", counts[n], mapped[1])):
+				path = self.spill_dir / f"run{r:04d}_{name}.npy"
+				np.save(path, arr)
+				out[n] = np.load(path, mmap_mode="r").view(np.ndarray)
+		self.spilled.append(mapped)
+
+
+######## Merge ########
+def _rows_before(tables: Tables, n_ids: int) -> np.ndarray:
+	"""rows_before[i] = number of rows (all orders) whose first token id is < i."""
+	cuts = table_cuts(tables[0], np.arange(n_ids + 1))
+	return sum(cuts.values())
+
+
+def _id_ranges(rows_before: np.ndarray, part_rows: int) -> List[int]:
+	"""Greedy first-token id bounds so that each range holds at most part_rows rows.
+
+	A single id with more rows than that still gets a range of its own.
+	"""
+	bounds = [0]
+	n_ids = len(rows_before) - 1
+	while bounds[-1] < n_ids:
+		lo = bounds[-1]
+		hi = int(np.searchsorted(rows_before, rows_before[lo] + part_rows, side="right")) - 1
+		bounds.append(min(n_ids, max(hi, lo + 1)))
+	return bounds
+
+
+def _append_part(part: Tables, files: Dict[str, object], written: Dict[int, int],
+				 coc: Dict[int, List[CountOfCounts]]):
+	keys, counts = part
+	for n in sorted(keys):
+		coc[n].append(count_of_counts(counts[n]))  # parts are disjoint: their histograms add up
+		k = keys[n]
+		if n > 1:
+			k = k + (np.uint64(written[n - 1]) << KEY_SHIFT)  # prefix rows were relative to the part
+		k.astype("<u8", copy=False).tofile(files[f"keys{n}"])
+		counts[n].astype("<i8", copy=False).tofile(files[f"counts{n}"])
+	for n in sorted(keys):
+		written[n] += len(keys[n])
+
+
+def merge_runs(runs: List[Tables], max_n: int, n_ids: int, part_rows: int,
+			   out_dir: Path) -> Tuple[Dict[str, Path], Dict[int, CountOfCounts]]:
+	"""K-way merge spilled runs one first-token id range at a time into per-array files.
+
+	Also returns the count-of-counts of the merged tables, summed over the ranges.
+	"""
+	rows_before = sum((_rows_before(run, n_ids) for run in runs), np.zeros(n_ids + 1, dtype=np.int64))
+	bounds = _id_ranges(rows_before, part_rows)
+	paths = {f"{a}{n}": out_dir / f"merged_{a}{n}.bin" for n in range(1, max_n + 1) for a in ("keys", "counts")}
+	files = {name: path.open("wb") for name, path in paths.items()}
+	written = {n: 0 for n in range(1, max_n + 1)}
+	coc: Dict[int, List[CountOfCounts]] = {n: [] for n in range(1, max_n + 1)}
+	try:
+		for lo, hi in zip(bounds[:-1], bounds[1:]):
+			_append_part(merge_all([split_tables(run, [lo, hi])[0] for run in runs]), files, written, coc)
+	finally:
+		for f in files.values():
+			f.close()
+	return paths, {n: merge_count_of_counts(parts) for n, parts in coc.items()}
+
+
+def _map(path: Path, dtype: str) -> np.ndarray:
+	size = path.stat().st_size // np.dtype(dtype).itemsize
+	if size == 0:
+		return np.empty(0, dtype=dtype)
+	return np.memmap(path, dtype=dtype, mode="r", shape=(size,)).view(np.ndarray)
+
+
+def count_ngrams_external(path: Path, store: Path, max_n: int = 4, memory_budget: int = 256 << 20,
+						  source: Optional[Dict[str, object]] = None, chunk_tokens: int = CHUNK_TOKENS,
+						  spill_dir: Optional[Path] = None, monitor=None) -> NGramCounts:
+	"""Count n-grams exactly within memory_budget bytes and write them to the store at `store`.
+
+	Run files go to a temporary directory in spill_dir (default: next to the store, since the
+	system temp directory may live in RAM). Returns the memory-mapped store; monitor gets its final
+	snapshot from it.
+	"""
+	from ngram_store import load_counts, save_counts
+
+	chunk_tokens = max(1 << 12, min(chunk_tokens, memory_budget // (MERGE_OVERHEAD * CHUNK_BYTES_PER_TOKEN * max_n)))
+	part_rows = max(1, memory_budget // (MERGE_OVERHEAD * ROW_BYTES))
+	with tempfile.TemporaryDirectory(prefix=".ngram-spill-", dir=spill_dir or store.parent,
+									 ignore_cleanup_errors=True) as tmp:
+		tmp = Path(tmp)
+		vocab = Vocab()
+		counter = SpillingCounter(vocab, max_n, memory_budget, tmp, monitor)
+		for ids in stream_token_ids(path, vocab, chunk_tokens):
+			counter.update(ids)
+		counter.spill()
+		print(f"Counted {counter.total_tokens} tokens into {len(counter.spilled)} spilled run(s); merging")
+
+		paths, coc = merge_runs(counter.spilled, max_n, len(vocab), part_rows, tmp)
+		counter.spilled.clear()  # release the run mappings before the directory is removed
+		keys = {n: _map(paths[f"keys{n}"], "<u8") for n in range(1, max_n + 1)}
+		counts = {n: _map(paths[f"counts{n}"], "<i8") for n in range(1, max_n + 1)}
+		save_counts(NGramCounts(vocab, keys, counts, counter.total_tokens, tail=counter._tail, coc=coc), store, source)
+		del keys, counts
+	counts = load_counts(store, max_n)
+	if monitor is not None:
+		monitor.finish(counts)
+	return counts
@@ -0,0 +1,115 @@
+"""
+Lab 4 - Simple Good-Turing Smoothing (Gale & Sampson) from count-of-counts
+
+Good-Turing replaces a count r by r* = (r + 1) N_{r+1} / N_r, where N_r is the number of
+n-grams seen exactly r times, and gives the unseen n-grams the mass P0 = N_1 / N. The raw N_r
+are noisy and mostly zero for large r, so Simple Good-Turing smooths them first:
+
+  Z_r  = N_r / (0.5 * (t - q))      q, t = the observed r just below and above (q = 0 for the
+									first, t = 2r - q for the last): averages N_r over the gap
+  log Z_r = a + b log r             least squares over the observed r
+  y_r  = r (1 + 1/r)^(b + 1)        r* from the fitted line (Linear Good-Turing)
+  x_r  = (r + 1) N_{r+1} / N_r      r* from the raw counts (Turing)
+
+x_r is used for small r while it differs from y_r by more than 1.96 standard deviations
+(sd^2 = (r + 1)^2 N_{r+1} / N_r^2 * (1 + N_{r+1} / N_r)); from the first r where it does not (or
+N_{r+1} = 0), y_r is used for that r and every larger one. Finally the r* are scaled so that the
+seen n-grams share exactly 1 - P0: c*(r) = (1 - P0) * N * r* / sum_r N_r r*.
+
+Everything comes from the count-of-counts the counting stage keeps per order
+(NGramCounts.count_of_counts), so fitting is O(distinct r) and never reads the n-gram tables;
+applying it to a count column is one searchsorted (adjusted()). With lossy counting the pruned
+rare n-grams are missing from N_1, N_2, ..., which skews the fit.
+
+Usage:
+  python ngram_good_turing.py [corpus.txt]    # N_r per order, the fitted lines and r* for small r
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from ngram_table import CountOfCounts
+
+CONFIDENCE = 1.96            # z of the Turing / LGT switch test
+
+
+class SimpleGoodTuring:
+	"""Adjusted counts c*(r) for every observed r of one order (see module docstring)."""
+
+	def __init__(self, r: np.ndarray, n_r: np.ndarray, r_star: np.ndarray, p0: float,
+				 intercept: float, slope: float, turing_below: int):
+		self.r = r
+		self.n_r = n_r
+		self.r_star = r_star              # normalized adjusted counts, parallel to r
+		self.p0 = p0                      # mass of the unseen n-grams
+		self.intercept = intercept
+		self.slope = slope                # b; Gale & Sampson require b < -1
+		self.turing_below = turing_below  # r < this use x_r (Turing), the rest y_r (LGT)
+		self.total = int((r * n_r).sum())
+
+	@classmethod
+	def fit(cls, coc: CountOfCounts) -> "SimpleGoodTuring":
+		r, n_r = (np.asarray(a, dtype=np.int64) for a in coc)
+		total = int((r * n_r).sum())
+		if total == 0:
+			return cls(r, n_r, r.astype(np.float64), 0.0, 0.0, -1.0, 0)
+		rf, nf = r.astype(np.float64), n_r.astype(np.float64)
+		p0 = float(nf[0]) / total if r[0] == 1 else 0.0
+
+		q = np.concatenate(([0.0], rf[:-1]))
+		t = np.concatenate((rf[1:], [2 * rf[-1] - q[-1]]))
+		z = nf / (0.5 * (t - q))
+		if len(r) > 1:
+			slope, intercept = np.polyfit(np.log(rf), np.log(z), 1)
+		else:  # one point: no line to fit, LGT leaves r unchanged (b = -1)
+			slope, intercept = -1.0, float(np.log(z[0]))
+		y = rf * (1 + 1 / rf) ** (slope + 1)
+
+		nxt = np.concatenate((r[1:] == r[:-1] + 1, [False]))  # N_{r+1} observed
+		n_next = np.where(nxt, np.concatenate((nf[1:], [0.0])), 0.0)
+		x = (rf + 1) * n_next / nf
+		sd = np.sqrt((rf + 1) ** 2 * n_next / nf ** 2 * (1 + n_next / nf))
+		turing = nxt & (np.abs(x - y) > CONFIDENCE * sd)
+		switch = int(np.argmin(turing)) if not turing.all() else len(r)  # first r that uses LGT
+		r_star = np.where(np.arange(len(r)) < switch, x, y)
+		r_star *= (1 - p0) * total / float((nf * r_star).sum())
+		turing_below = int(r[switch]) if switch < len(r) else int(r[-1]) + 1
+		return cls(r, n_r, r_star, p0, float(intercept), float(slope), turing_below)
+
+	def adjusted(self, c: np.ndarray) -> np.ndarray:
+		"""c*(c) for an array of counts that occur in the fitted table (0 for count 0)."""
+		c = np.asarray(c, dtype=np.int64)
+		if len(self.r) == 0:
+			return np.zeros(len(c), dtype=np.float64)
+		i = np.searchsorted(self.r, c).clip(0, len(self.r) - 1)
+		return np.where(self.r[i] == c, self.r_star[i], 0.0)
+
+	def lines(self, show: int = 5) -> List[str]:
+		out = [f"N = {self.total}, P0 = {self.p0:.6f}, log Z = {self.intercept:.3f} + {self.slope:.3f} log r, "
+			   f"Turing estimates for r < {self.turing_below}"]
+		for r, n_r, s in zip(self.r[:show].tolist(), self.n_r[:show].tolist(), self.r_star[:show].tolist()):
+			out.append(f"  r = {r:<4} N_r = {n_r:<10} r* = {s:.4f}")
+		return out
+
+
+def main():
+	from ngram_store import load_or_build
+	from q2 import MAX_N, find_input_file
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	args = ap.parse_args()
+
+	counts = load_or_build(args.corpus or find_input_file(), MAX_N)
+	for n in range(1, counts.max_n + 1):
+		print(f"\n{n}-grams:")
+		print("\n".join(SimpleGoodTuring.fit(counts.count_of_counts(n)).lines()))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,203 @@
+"""
+Lab 4 - Interpolated Modified Kneser-Ney Smoothing (precomputed backoff tables)
+
+For a model of order N (Chen & Goodman's interpolated modified Kneser-Ney):
+
+  P_k(w | h) = max(x(hw) - D_k(x(hw)), 0) / x(h•)  +  gamma_k(h) * P_{k-1}(w | h')
+  gamma_k(h) = (D_k1 * N1(h•) + D_k2 * N2(h•) + D_k3+ * N3+(h•)) / x(h•)
+  P_0(w)     = 1 / V
+
+  h' drops the oldest token of h; x(h•) = sum over w of x(hw); N1/N2/N3+(h•) = number of
+  followers of h with x = 1, 2, >= 3. At the top level (k = N) x is the raw count c(hw); at lower
+  levels it is the continuation count N1+(•hw), the number of distinct tokens seen before hw.
+  Discounts come from the count-of-counts n1..n4 of x at each level (Y = n1 / (n1 + 2 n2)):
+	D_k1 = 1 - 2Y n2/n1,  D_k2 = 2 - 3Y n3/n2,  D_k3+ = 3 - 4Y n4/n3
+  A history that was never followed by anything (x(h•) = 0) passes all its mass down (gamma = 1).
+  Discounts outside (0, j] fall back to Y (see discounts()).
+
+Everything that aggregates over followers is computed once, per level and for both the "top"
+(raw counts) and "low" (continuation counts) variants, so a model of any order 1..max_n can be
+queried from the same tables:
+
+  alpha_{v}_{k} - per row of table k: the discounted first term above (0 for count-0 rows)
+  gamma_{v}_{k} - per row of table k-1 (a single value for k = 1): the backoff weight
+
+A query P(w | h) with |h| = k-1 is then k table lookups (one per suffix of hw) and
+P = alpha_k + gamma_k * (alpha_{k-1} + gamma_{k-1} * (... + gamma_1 / V)). Shorter histories (at
+sentence start) use the model's own lower levels, i.e. the continuation distributions.
+
+The tables are saved next to the count store (<corpus>.ngrams.kn, same container as
+ngram_store.py) and memory-mapped by later runs; they are rebuilt when the store changes.
+Discounts assume exact counts: with lossy counting the pruned rare n-grams skew n1..n4.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ngram_store import map_array, read_header, store_stamp, write_arrays
+from ngram_table import ID_MASK, KEY_SHIFT, NGramCounts
+
+KN_MAGIC = b"NGRAMKN1"
+KN_VERSION = 1
+KN_SUFFIX = ".kn"
+VARIANTS = ("top", "low")   # raw counts (highest order of the model) / continuation counts
+
+
+######## Precomputation ########
+def discounts(x: np.ndarray) -> Tuple[float, float, float]:
+	"""(D1, D2, D3+) from the count-of-counts of x.
+
+	A discount outside (0, j] (undefined, or skewed count-of-counts on small or unusual corpora)
+	falls back to the absolute discount Y, so every history keeps some mass for unseen words.
+	"""
+	n = [int(v) for v in np.bincount(np.minimum(x, 5), minlength=6)[1:5]]
+	y = n[0] / (n[0] + 2 * n[1]) if n[0] else 0.5
+	out = []
+	for j in (1, 2, 3):
+		d = j - (j + 1) * y * n[j] / n[j - 1] if n[j - 1] else y
+		out.append(d if 0 < d <= j else y)
+	return out[0], out[1], out[2]
+
+
+def suffix_rows(counts: NGramCounts) -> Dict[int, np.ndarray]:
+	"""suffix[k][r] = row in table k-1 of the last k-1 tokens of row r of table k (-1 if absent)."""
+	suffix: Dict[int, np.ndarray] = {}
+	for k in range(2, counts.max_n + 1):
+		keys = counts.keys[k]
+		last = keys & ID_MASK
+		if k == 2:
+			q = last
+		else:
+			prev = suffix[k - 1][(keys >> KEY_SHIFT).astype(np.int64)]
+			q = (prev.clip(0).astype(np.uint64) << KEY_SHIFT) | last
+		target = counts.keys[k - 1]
+		pos = np.searchsorted(target, q)
+		hit = pos < len(target)
+		hit[hit] = target[pos[hit]] == q[hit]
+		if k > 2:
+			hit &= prev >= 0
+		suffix[k] = np.where(hit, pos, -1)
+	return suffix
+
+
+def _level(x: np.ndarray, prefix: Optional[np.ndarray], n_hist: int) -> Tuple[np.ndarray, np.ndarray, Tuple[float, float, float]]:
+	"""alpha (per row), gamma (per history row) and discounts for one level and variant."""
+	d = discounts(x[x > 0])
+	d_of = np.array((0.0,) + d, dtype=np.float64)[np.minimum(x, 3)]
+	band = np.minimum(x, 3)
+	if prefix is None:  # unigrams: one history
+		den = np.array([x.sum()], dtype=np.float64)
+		mass = np.array([sum(d[j - 1] * np.count_nonzero(band == j) for j in (1, 2, 3))], dtype=np.float64)
+		prefix = np.zeros(len(x), dtype=np.int64)
+	else:
+		den = np.bincount(prefix, weights=x, minlength=n_hist)
+		mass = sum(d[j - 1] * np.bincount(prefix[band == j], minlength=n_hist) for j in (1, 2, 3))
+	safe = np.maximum(den, 1.0)
+	alpha = np.where(x > 0, np.maximum(x - d_of, 0.0) / safe[prefix], 0.0)
+	gamma = np.where(den > 0, mass / safe, 1.0)
+	return alpha, gamma, d
+
+
+######## Model ########
+class KneserNey:
+	"""Interpolated modified Kneser-Ney over an NGramCounts (tables described in the module docstring)."""
+
+	def __init__(self, counts: NGramCounts, alpha: Dict[str, Dict[int, np.ndarray]],
+				 gamma: Dict[str, Dict[int, np.ndarray]], discounts: Dict[str, Dict[int, Tuple[float, float, float]]]):
+		self.counts = counts
+		self.alpha = alpha
+		self.gamma = gamma
+		self.discounts = discounts
+		self.max_n = counts.max_n
+		self.vocab_size = len(counts.vocab)
+
+	@classmethod
+	def build(cls, counts: NGramCounts) -> "KneserNey":
+		"""Precompute continuation counts, discounts and backoff weights for every level."""
+		max_n = counts.max_n
+		suffix = suffix_rows(counts)
+		alpha: Dict[str, Dict[int, np.ndarray]] = {v: {} for v in VARIANTS}
+		gamma: Dict[str, Dict[int, np.ndarray]] = {v: {} for v in VARIANTS}
+		disc: Dict[str, Dict[int, Tuple[float, float, float]]] = {v: {} for v in VARIANTS}
+		for k in range(1, max_n + 1):
+			prefix = (counts.keys[k] >> KEY_SHIFT).astype(np.int64) if k > 1 else None
+			n_hist = len(counts.keys[k - 1]) if k > 1 else 1
+			x = {"top": np.asarray(counts.counts[k], dtype=np.int64)}
+			if k < max_n:  # level max_n is only ever the top level
+				live = (suffix[k + 1] >= 0) & (counts.counts[k + 1] > 0)
+				x["low"] = np.bincount(suffix[k + 1][live], minlength=len(counts.keys[k]))
+			for v, xv in x.items():
+				alpha[v][k], gamma[v][k], disc[v][k] = _level(xv, prefix, n_hist)
+		return cls(counts, alpha, gamma, disc)
+
+	def probs(self, grams: np.ndarray, order: Optional[int] = None) -> np.ndarray:
+		"""P(w | h) for an (m, k) array of token ids (-1 = unknown) under the model of `order` >= k."""
+		grams = np.asarray(grams, dtype=np.int64)
+		m, k = grams.shape
+		order = order or k
+		p = np.full(m, 1.0 / max(self.vocab_size, 1))
+		for j in range(1, k + 1):
+			v = "top" if j == order else "low"
+			row, hist = self.counts.lookup(grams[:, k - j:])
+			a, g = self.alpha[v][j], self.gamma[v][j]
+			p_hw = np.where(row >= 0, a[row.clip(0)] if len(a) else 0.0, 0.0)
+			if j == 1:
+				p = p_hw + g[0] * p
+			else:
+				p = p_hw + np.where(hist >= 0, g[hist.clip(0)] if len(g) else 1.0, 1.0) * p
+		return p
+
+	def prob(self, gram_ids: List[int], order: Optional[int] = None) -> float:
+		return float(self.probs(np.asarray([gram_ids], dtype=np.int64), order)[0])
+
+	def nbytes(self) -> int:
+		return sum(a.nbytes for tables in (self.alpha, self.gamma) for v in tables.values() for a in v.values())
+
+
+######## Store ########
+def default_kn_path(store: Path) -> Path:
+	return store.with_name(store.name + KN_SUFFIX)
+
+
+def save_kneser_ney(model: KneserNey, path: Path, store: Path):
+	arrays = {f"{t}_{v}_{k}": np.ascontiguousarray(a, dtype="<f8")
+			  for t, tables in (("alpha", model.alpha), ("gamma", model.gamma))
+			  for v in VARIANTS for k, a in tables[v].items()}
+	write_arrays(path, {
+		"version": KN_VERSION,
+		"max_n": model.max_n,
+		"discounts": {v: {str(k): list(d) for k, d in model.discounts[v].items()} for v in VARIANTS},
+		"store": store_stamp(store),
+	}, arrays, KN_MAGIC)
+
+
+def load_kneser_ney(path: Path, counts: NGramCounts) -> KneserNey:
+	header, base = read_header(path, KN_MAGIC, KN_VERSION)
+	alpha: Dict[str, Dict[int, np.ndarray]] = {v: {} for v in VARIANTS}
+	gamma: Dict[str, Dict[int, np.ndarray]] = {v: {} for v in VARIANTS}
+	for name in header["arrays"]:
+		table, v, k = name.split("_")
+		if int(k) <= counts.max_n:
+			(alpha if table == "alpha" else gamma)[v][int(k)] = map_array(path, header, base, name)
+	disc = {v: {int(k): tuple(d) for k, d in header["discounts"][v].items()} for v in VARIANTS}
+	return KneserNey(counts, alpha, gamma, disc)
+
+
+def load_or_build_kneser_ney(counts: NGramCounts, store: Path) -> KneserNey:
+	"""Memory-map the tables saved next to `store`, or build and save them if the store changed."""
+	path = default_kn_path(store)
+	if path.is_file():
+		try:
+			header, _ = read_header(path, KN_MAGIC, KN_VERSION)
+			if header["store"] == store_stamp(store) and header["max_n"] >= counts.max_n:
+				return load_kneser_ney(path, counts)
+		except (ValueError, KeyError, OSError):
+			pass
+	model = KneserNey.build(counts)
+	if store.is_file():
+		save_kneser_ney(model, path, store)
+	return model
@@ -0,0 +1,185 @@
+"""
+Lab 4 - Counting Instrumentation (periodic progress snapshots through pluggable sinks)
+
+A long count over a multi-GB corpus otherwise says nothing until the final totals. A
+CountingMonitor attached to the counter reports, every REPORT_SECONDS:
+
+  tokens          - tokens counted so far, tokens/s overall and since the previous snapshot
+  vocab           - distinct tokens so far
+  rows per order  - table rows held by the counter (+ spilled runs with a memory budget). While
+					several sorted runs are pending the same n-gram can sit in more than one, so this
+					is an upper bound on the unique n-grams; the final snapshot is exact
+  table bytes     - bytes of the in-memory tables per order (keys + counts, + lossy deltas)
+  RSS             - resident set size of the process (/proc/self/statm; peak RSS elsewhere)
+
+NGramCounter.update calls tick() after every chunk; tick() only reads the clock until the
+interval is up, and a snapshot costs O(runs x orders), so the overhead is a clock read per chunk
+(CHUNK_TOKENS tokens). The final snapshot (finish) is taken from the finished NGramCounts.
+
+A sink is any callable taking a CountingSnapshot: LogSink prints one line per snapshot,
+JsonLinesSink appends one JSON object per line to a file, and a plain function works as a callback.
+Serial, pipelined and bounded-memory counting report periodically; sharded counting
+(workers > 1) counts in other processes and reports only the final snapshot.
+
+Usage:
+  python ngram_monitor.py [corpus.txt] [--interval 1] [--jsonl progress.jsonl]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, TextIO
+
+REPORT_SECONDS = 10.0        # seconds between snapshots
+
+Sink = Callable[["CountingSnapshot"], None]
+
+
+def rss_bytes() -> int:
+	"""Current resident set size (Linux), else the peak RSS reported by getrusage."""
+	try:
+		with open("/proc/self/statm", "rb") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError, IndexError):
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peak if sys.platform == "darwin" else peak * 1024
+
+
+class CountingSnapshot:
+	"""Counting progress at one point in time (see module docstring)."""
+
+	def __init__(self, elapsed: float, tokens: int, tokens_per_sec: float, recent_tokens_per_sec: float,
+				 vocab_size: int, rows: Dict[int, int], table_bytes: Dict[int, int], rss: int, final: bool):
+		self.elapsed = elapsed
+		self.tokens = tokens
+		self.tokens_per_sec = tokens_per_sec
+		self.recent_tokens_per_sec = recent_tokens_per_sec  # since the previous snapshot
+		self.vocab_size = vocab_size
+		self.rows = rows                  # upper bound on unique n-grams until final
+		self.table_bytes = table_bytes
+		self.rss = rss
+		self.final = final
+
+	def to_json(self) -> Dict[str, object]:
+		return {"elapsed": round(self.elapsed, 3), "tokens": self.tokens,
+				"tokens_per_sec": round(self.tokens_per_sec, 1),
+				"recent_tokens_per_sec": round(self.recent_tokens_per_sec, 1), "vocab_size": self.vocab_size,
+				"rows": {str(n): r for n, r in self.rows.items()},
+				"table_bytes": {str(n): b for n, b in self.table_bytes.items()},
+				"rss_bytes": self.rss, "final": self.final}
+
+	def line(self) -> str:
+		rows = ", ".join(f"{n}: {r:,}" for n, r in self.rows.items())
+		return (f"[{self.elapsed:8.1f} s] {self.tokens:,} tokens ({self.tokens_per_sec:,.0f}/s, recent "
+				f"{self.recent_tokens_per_sec:,.0f}/s), vocab {self.vocab_size:,}; "
+				f"{'unique' if self.final else 'rows <='} {rows}; "
+				f"tables {sum(self.table_bytes.values()) / 2**20:.1f} MB; RSS {self.rss / 2**20:.1f} MB"
+				+ (" (done)" if self.final else ""))
+
+
+######## Sinks ########
+class LogSink:
+	"""One line per snapshot on a text stream (stdout by default)."""
+
+	def __init__(self, stream: Optional[TextIO] = None):
+		self.stream = stream
+
+	def __call__(self, snap: CountingSnapshot):
+		print(snap.line(), file=self.stream or sys.stdout, flush=True)
+
+
+class JsonLinesSink:
+	"""One JSON object per snapshot, appended to a file and flushed (tail -f friendly)."""
+
+	def __init__(self, path: Path):
+		self.path = path
+		self._f = path.open("a", encoding="utf-8")
+
+	def __call__(self, snap: CountingSnapshot):
+		self._f.write(json.dumps(snap.to_json()) + "\n")
+		self._f.flush()
+
+	def close(self):
+		self._f.close()
+
+
+######## Monitor ########
+class CountingMonitor:
+	"""Sends a snapshot to every sink at most once per `interval` seconds, and once at the end.
+
+	tick() takes anything with total_tokens, vocab and table_stats() (NGramCounter, NGramCounts).
+	The counters call start() when counting begins, so elapsed time and tokens/s leave out
+	whatever ran between building the monitor and counting (e.g. the store's corpus hash).
+	"""
+
+	def __init__(self, sinks: Sequence[Sink], interval: float = REPORT_SECONDS):
+		self.sinks = list(sinks)
+		self.interval = interval
+		self.snapshots = 0
+		self.start()
+
+	def start(self):
+		"""Restart the clock and the snapshot interval."""
+		self._t0 = time.perf_counter()
+		self._next = self._t0 + self.interval
+		self._last = (self._t0, 0)
+
+	def tick(self, source):
+		if time.perf_counter() >= self._next:
+			self._emit(source, False)
+
+	def finish(self, source):
+		self._emit(source, True)
+
+	def _emit(self, source, final: bool):
+		now = time.perf_counter()
+		tokens = source.total_tokens
+		rows, nbytes = source.table_stats()
+		last_t, last_tokens = self._last
+		snap = CountingSnapshot(now - self._t0, tokens, tokens / (now - self._t0) if now > self._t0 else 0.0,
+								(tokens - last_tokens) / (now - last_t) if now > last_t else 0.0,
+								len(source.vocab), rows, nbytes, rss_bytes(), final)
+		for sink in self.sinks:
+			sink(snap)
+		self.snapshots += 1
+		self._last = (now, tokens)
+		self._next = now + self.interval
+
+
+def main():
+	from ngram_table import count_ngrams
+	from q1 import MAX_N, find_input_file
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--interval", type=float, default=1.0, help="seconds between snapshots")
+	ap.add_argument("--jsonl", type=Path, help="also append snapshots to this JSON lines file")
+	ap.add_argument("--max-n", type=int, default=MAX_N)
+	args = ap.parse_args()
+
+	corpus = args.corpus or find_input_file()
+	t0 = time.perf_counter()
+	count_ngrams(corpus, args.max_n)
+	plain = time.perf_counter() - t0
+	sinks: List[Sink] = [LogSink()]
+	if args.jsonl:
+		sinks.append(JsonLinesSink(args.jsonl))
+	monitor = CountingMonitor(sinks, args.interval)
+	t0 = time.perf_counter()
+	count_ngrams(corpus, args.max_n, monitor=monitor)
+	monitored = time.perf_counter() - t0
+	for sink in sinks:
+		if isinstance(sink, JsonLinesSink):
+			sink.close()
+	print(f"Without monitor: {plain:.2f} s; with ({monitor.snapshots} snapshots): {monitored:.2f} s "
+		  f"({monitored / plain - 1:+.1%})")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,146 @@
+"""
+Lab 4 - Sharded N‑gram Counting (map-reduce over a process pool)
+
+  map:    the corpus is cut into byte ranges on line boundaries; each worker counts its range
+		  with its own Vocab into an integer-id table (ngram_table.py).
+  reduce: shard vocabularies are folded into one global Vocab in file order; shard tables are
+		  rewritten onto the global ids and cut by first-token id range, and each range is merged
+		  in the pool. Rows sort by id tuple, so the merged ranges stack into the final table and
+		  the parent only does O(vocab) work.
+
+Shard edges: a worker first reads the MAX_N-1 tokens that precede its range and primes its
+counter with them, so it counts exactly the n-grams that END inside its range (including the
+ones that start in an earlier shard). Every n-gram ends in exactly one shard, so the merged
+counts equal the serial ones, and because vocabularies are folded in file order even the token
+ids come out the same.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ngram_table import (CHUNK_TOKENS, CountOfCounts, LossyReport, NGramCounter, NGramCounts, Tables, Vocab,
+						 concat_tables, count_of_counts, merge_all, merge_count_of_counts, remap_ids, split_tables)
+
+SHARDS_PER_WORKER = 4        # more shards than workers keeps the pool busy when shards differ in cost
+READ_BYTES = 1 << 22         # bytes read per block inside a shard
+
+
+######## Sharding ########
+def shard_ranges(path: Path, n_shards: int) -> List[Tuple[int, int]]:
+	"""Split the file into at most n_shards byte ranges that start and end on line boundaries."""
+	size = path.stat().st_size
+	cuts = [0]
+	with path.open("rb") as f:
+		for i in range(1, n_shards):
+			f.seek(max(i * size // n_shards, cuts[-1]))
+			f.readline()  # move to the start of the next line
+			cuts.append(min(f.tell(), size))
+	cuts.append(size)
+	return [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+
+def _context_before(f: BinaryIO, start: int, k: int) -> List[str]:
+	"""The last k tokens before byte offset `start` (fewer near the start of the file)."""
+	if k <= 0 or start == 0:
+		return []
+	span = 4096
+	while True:
+		lo = max(0, start - span)
+		f.seek(lo)
+		data = f.read(start - lo)
+		if lo > 0:
+			# the block may begin mid-line (or mid-character): only keep complete lines
+			cut = data.find(b"\n")
+			data = data[cut + 1:] if cut >= 0 else b""
+		toks = data.decode("utf-8", errors="ignore").split()
+		if len(toks) >= k or lo == 0:
+			return toks[-k:]
+		span *= 4
+
+
+def _count_shard(path: Path, shard: Tuple[int, int], max_n: int, epsilon: Optional[float],
+				 chunk_tokens: int) -> Tuple[List[str], Tables, int, Optional[LossyReport], np.ndarray]:
+	start, end = shard
+	vocab = Vocab()
+	counter = NGramCounter(vocab, max_n, epsilon)
+	with path.open("rb") as f:
+		counter.prime(np.array([vocab.add(t) for t in _context_before(f, start, max_n - 1)], dtype=np.int64))
+		f.seek(start)
+		pos = start
+		pending: List[np.ndarray] = []
+		n_pending = 0
+		while pos < end:
+			block = f.read(min(READ_BYTES, end - pos))
+			if pos + len(block) < end:
+				block += f.readline()  # finish the current line so no token is cut in two
+			pos += len(block)
+			pending.append(vocab.add_many(block.decode("utf-8", errors="ignore").split()))
+			n_pending += len(pending[-1])
+			if n_pending >= chunk_tokens or pos >= end:
+				counter.update(np.concatenate(pending))
+				pending, n_pending = [], 0
+	counts = counter.finalize()
+	return vocab.tokens, (counts.keys, counts.counts), counts.total_tokens, counts.lossy, counts.tail
+
+
+######## Reduce ########
+def _remap_split(tables: Tables, id_map: np.ndarray, id_bounds: np.ndarray) -> List[Tables]:
+	return split_tables(remap_ids(tables, id_map), id_bounds)
+
+
+def _merge_range(parts: List[Tables]) -> Tuple[Tables, Dict[int, CountOfCounts]]:
+	"""Merge one first-token range, with its count-of-counts (ranges are disjoint, so these add up)."""
+	merged = merge_all(parts)
+	return merged, {n: count_of_counts(c) for n, c in merged[1].items()}
+
+
+def _balanced_bounds(unigram_counts: np.ndarray, n_parts: int) -> np.ndarray:
+	"""First-token id boundaries giving each part about the same number of token occurrences."""
+	cum = np.cumsum(unigram_counts)
+	cuts = np.searchsorted(cum, cum[-1] * np.arange(1, n_parts) / n_parts, side="right")
+	return np.unique(np.concatenate(([0], cuts, [len(unigram_counts)])))
+
+
+def count_ngrams_parallel(path: Path, max_n: int = 4, workers: Optional[int] = None,
+						  epsilon: Optional[float] = None, chunk_tokens: int = CHUNK_TOKENS) -> NGramCounts:
+	"""Count n-grams of orders 1..max_n over byte-range shards in a process pool.
+
+	Exact counts are identical to ngram_table.count_ngrams. With epsilon set, every shard does
+	its own lossy counting; shard undercounts add up, so the bound is still epsilon * tokens.
+	"""
+	workers = workers or os.cpu_count() or 1
+	shards = shard_ranges(path, workers * SHARDS_PER_WORKER)
+	with ProcessPoolExecutor(workers) as pool:
+		counted = list(pool.map(_count_shard, repeat(path), shards, repeat(max_n), repeat(epsilon), repeat(chunk_tokens)))
+		if not counted:
+			return NGramCounter(Vocab(), max_n, epsilon).finalize()
+
+		# folding shard vocabularies in file order gives the same ids as the serial path
+		vocab = Vocab()
+		id_maps = [np.fromiter((vocab.add(t) for t in tokens), dtype=np.int64, count=len(tokens)) for tokens, *_ in counted]
+		unigram_counts = np.zeros(len(vocab), dtype=np.int64)
+		for id_map, (_, (keys, counts), *_) in zip(id_maps, counted):
+			unigram_counts[id_map[keys[1].astype(np.int64)]] += counts[1]
+		id_bounds = _balanced_bounds(unigram_counts, workers * SHARDS_PER_WORKER)
+
+		# reduce by first-token range: each part merges independently and the parts simply stack
+		split = list(pool.map(_remap_split, [tables for _, tables, *_ in counted], id_maps, repeat(id_bounds)))
+		total_tokens = sum(n_tokens for _, _, n_tokens, *_ in counted)
+		tail = id_maps[-1][counted[-1][4]]  # the last shard was primed with the context before it
+		lossy = None
+		if epsilon is not None:
+			lossy = LossyReport(epsilon, max_n)
+			for _, _, _, report, _ in counted:
+				lossy.merge(report)
+		del counted
+		merged, cocs = zip(*pool.map(_merge_range, [list(parts) for parts in zip(*split)]))
+	keys, counts = concat_tables(merged)
+	coc = {n: merge_count_of_counts([c[n] for c in cocs]) for n in keys}
+	return NGramCounts(vocab, keys, counts, total_tokens, lossy, tail, coc)
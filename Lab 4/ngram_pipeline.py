@@ -0,0 +1,252 @@
+"""
+Lab 4 - Pipelined N‑gram Counting (reader -> tokenizers -> counter, bounded queues)
+
+  read      - one thread reads the corpus in binary blocks cut at line breaks (read_byte_blocks)
+  tokenize  - TOKENIZERS threads decode and split a block and look its tokens up in the Vocab
+			  (read-only: unknown tokens come back as -1 and travel on as strings; the
+			  rest of the block's strings are dropped before queueing)
+  count     - the calling thread takes blocks back in file order, gives the unknown tokens their
+			  ids (Vocab.add_missing, so ids are the serial ones), re-chunks to chunk_tokens and
+			  feeds NGramCounter.update
+
+Stages talk through queue.Queue(maxsize=QUEUE_DEPTH): a stage that runs ahead blocks on put until
+the next one catches up, so at most ~2 * QUEUE_DEPTH + TOKENIZERS blocks are in memory at once. The
+counter keeps blocks that arrive out of order until their turn; it never blocks on anything but
+its input, so this cannot deadlock. An error in any stage stops the others and is raised here.
+
+Every stage records busy time (doing its work), time starved (waiting on its input queue) and time
+blocked (waiting on a full output queue). Utilization = busy / (wall * threads): the stage closest
+to 100% is the bottleneck, and a stage that is mostly blocked has spare capacity. Threads share
+the GIL: decode, split and the NumPy kernels release it only in part, so busy time includes time
+spent waiting for it, and on one core the busy times of all stages add up to about the wall time.
+
+The result is the same NGramCounts as count_ngrams (same ids, counts, tail and lossy report).
+
+Usage:
+  python ngram_pipeline.py [corpus.txt] [--tokenizers 1] [--queue-depth 4] [--block-mb 4] [--max-n 4]
+"""
+
+from __future__ import annotations
+
+import argparse
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ngram_table import CHUNK_TOKENS, READ_BYTES, NGramCounter, NGramCounts, Vocab, read_byte_blocks, unknown_tokens
+
+TOKENIZERS = 1               # tokenizer threads (more only help when decode/split is the bottleneck)
+QUEUE_DEPTH = 4              # blocks per queue before the producing stage blocks
+POLL_SECONDS = 0.1           # how often a blocked stage checks whether another one failed
+
+
+class _Aborted(Exception):
+	"""Another stage failed; unwind quietly (its error is raised by the caller)."""
+
+
+######## Stage Statistics ########
+class StageStats:
+	"""Seconds a stage spent working, waiting for input and waiting for room downstream."""
+
+	def __init__(self, name: str, threads: int = 1):
+		self.name = name
+		self.threads = threads
+		self.items = 0
+		self.busy = 0.0
+		self.starved = 0.0
+		self.blocked = 0.0
+		self._lock = threading.Lock()
+
+	def add(self, busy: float = 0.0, starved: float = 0.0, blocked: float = 0.0, items: int = 0):
+		with self._lock:  # tokenizer threads share one record
+			self.busy += busy
+			self.starved += starved
+			self.blocked += blocked
+			self.items += items
+
+	def utilization(self, wall: float) -> float:
+		return self.busy / (wall * self.threads) if wall > 0 else 0.0
+
+
+class PipelineReport:
+	def __init__(self, stages: List[StageStats], wall: float, n_bytes: int):
+		self.stages = stages
+		self.wall = wall
+		self.n_bytes = n_bytes
+
+	def bottleneck(self) -> StageStats:
+		return max(self.stages, key=lambda s: s.utilization(self.wall))
+
+	def lines(self) -> List[str]:
+		mb = self.n_bytes / 2**20
+		out = [f"Pipeline: {mb:.1f} MB in {self.wall:.2f} s ({mb / self.wall if self.wall else 0.0:.1f} MB/s); "
+			   f"bottleneck: {self.bottleneck().name}",
+			   f"  {'stage':<9} {'threads':>7} {'blocks':>7} {'busy s':>7} {'starved s':>9} {'blocked s':>9} {'util':>5}"]
+		for s in self.stages:
+			out.append(f"  {s.name:<9} {s.threads:>7} {s.items:>7} {s.busy:>7.2f} {s.starved:>9.2f} "
+					   f"{s.blocked:>9.2f} {s.utilization(self.wall):>5.0%}")
+		return out
+
+
+######## Pipeline ########
+def count_ngrams_pipelined(path: Path, max_n: int = 4, epsilon: Optional[float] = None,
+						   chunk_tokens: int = CHUNK_TOKENS, tokenizers: int = TOKENIZERS,
+						   queue_depth: int = QUEUE_DEPTH, block_bytes: int = READ_BYTES,
+						   monitor=None) -> Tuple[NGramCounts, PipelineReport]:
+	"""count_ngrams with reading, tokenizing and counting overlapped in threads (module docstring)."""
+	vocab = Vocab()
+	counter = NGramCounter(vocab, max_n, epsilon, monitor)  # ticked from the counting (calling) thread
+	blocks: queue.Queue = queue.Queue(maxsize=queue_depth)
+	tokenized: queue.Queue = queue.Queue(maxsize=queue_depth)
+	read = StageStats("read")
+	tokenize = StageStats("tokenize", tokenizers)
+	count = StageStats("count")
+	abort = threading.Event()
+	errors: List[BaseException] = []
+	n_bytes = 0
+
+	def put(q: queue.Queue, item, stats: StageStats):
+		t0 = time.perf_counter()
+		while True:
+			try:
+				q.put(item, timeout=POLL_SECONDS)
+				break
+			except queue.Full:
+				if abort.is_set():
+					raise _Aborted
+		stats.add(blocked=time.perf_counter() - t0)
+
+	def get(q: queue.Queue, stats: StageStats):
+		t0 = time.perf_counter()
+		while True:
+			try:
+				item = q.get(timeout=POLL_SECONDS)
+				break
+			except queue.Empty:
+				if abort.is_set():
+					raise _Aborted
+		stats.add(starved=time.perf_counter() - t0)
+		return item
+
+	def reader():
+		nonlocal n_bytes
+		it = read_byte_blocks(path, block_bytes)
+		seq = 0
+		while True:
+			t0 = time.perf_counter()
+			data = next(it, None)
+			read.add(busy=time.perf_counter() - t0)
+			if data is None:
+				break
+			n_bytes += len(data)
+			put(blocks, (seq, data), read)
+			read.add(items=1)
+			seq += 1
+		for _ in range(tokenizers):  # one end marker per tokenizer
+			put(blocks, None, read)
+
+	def tokenizer():
+		while True:
+			item = get(blocks, tokenize)
+			if item is None:
+				put(tokenized, None, tokenize)
+				return
+			t0 = time.perf_counter()
+			seq, data = item
+			toks = data.decode("utf-8", errors="ignore").split()
+			ids = vocab.encode_array(toks)
+			missing = unknown_tokens(toks, ids)
+			del toks
+			tokenize.add(busy=time.perf_counter() - t0, items=1)
+			put(tokenized, (seq, ids, missing), tokenize)
+
+	def guard(stage):
+		try:
+			stage()
+		except _Aborted:
+			pass
+		except BaseException as e:
+			errors.append(e)
+			abort.set()
+
+	t_start = time.perf_counter()
+	threads = [threading.Thread(target=guard, args=(reader,), name="ngram-read", daemon=True)]
+	threads += [threading.Thread(target=guard, args=(tokenizer,), name=f"ngram-tokenize-{i}", daemon=True)
+				for i in range(tokenizers)]
+	for t in threads:
+		t.start()
+	try:
+		pending: Dict[int, Tuple[np.ndarray, List[str]]] = {}
+		parts: List[np.ndarray] = []
+		have = 0
+		next_seq = 0
+		done = 0
+		while done < tokenizers:
+			item = get(tokenized, count)
+			if item is None:
+				done += 1
+				continue
+			seq, ids, missing = item
+			pending[seq] = (ids, missing)
+			while next_seq in pending:
+				ids, missing = pending.pop(next_seq)
+				next_seq += 1
+				t0 = time.perf_counter()
+				parts.append(vocab.add_missing(ids, missing))
+				have += len(ids)
+				while have >= chunk_tokens:  # same chunks as stream_token_ids
+					ids = np.concatenate(parts) if len(parts) > 1 else parts[0]
+					counter.update(ids[:chunk_tokens])
+					parts = [ids[chunk_tokens:]]
+					have -= chunk_tokens
+				count.add(busy=time.perf_counter() - t0, items=1)
+		t0 = time.perf_counter()
+		if have:
+			counter.update(np.concatenate(parts))
+		counts = counter.finalize()
+		count.add(busy=time.perf_counter() - t0)
+	except _Aborted:
+		pass
+	except BaseException:
+		abort.set()
+		raise
+	finally:
+		for t in threads:
+			t.join()
+	if errors:
+		raise errors[0]
+	return counts, PipelineReport([read, tokenize, count], time.perf_counter() - t_start, n_bytes)
+
+
+def main():
+	from ngram_table import count_ngrams
+	from q1 import MAX_N, find_input_file
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--tokenizers", type=int, default=TOKENIZERS)
+	ap.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH)
+	ap.add_argument("--block-mb", type=float, default=READ_BYTES / 2**20)
+	ap.add_argument("--max-n", type=int, default=MAX_N)
+	args = ap.parse_args()
+
+	corpus = args.corpus or find_input_file()
+	print(f"Corpus: {corpus}")
+	t0 = time.perf_counter()
+	serial = count_ngrams(corpus, args.max_n)
+	print(f"Serial count_ngrams: {time.perf_counter() - t0:.2f} s")
+	counts, report = count_ngrams_pipelined(corpus, args.max_n, tokenizers=args.tokenizers,
+											queue_depth=args.queue_depth, block_bytes=int(args.block_mb * 2**20))
+	print("\n".join(report.lines()))
+	same = serial.vocab.tokens == counts.vocab.tokens and all(
+		np.array_equal(serial.keys[n], counts.keys[n]) and np.array_equal(serial.counts[n], counts.counts[n])
+		for n in range(1, args.max_n + 1))
+	print(f"Same counts as serial: {same}")
+
+
+if __name__ == "__main__":
+	main()
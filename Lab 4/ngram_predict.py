@@ -0,0 +1,205 @@
+"""
+Lab 4 - Next-Word Prediction (precomputed top-k continuations)
+
+For every history of length 0..max_n-1 (row of table j-1, the empty history for j = 1), the index
+keeps the k likeliest followers under the Kneser-Ney model of order max_n (ngram_kneser_ney.py),
+best first. The probabilities of all rows of table j come from one pass over the tables, level by
+level, reusing the level below:
+
+  P_j(row) = alpha_j(row) + gamma_j(prefix row) * P_{j-1}(suffix row),    P_0 = 1 / V
+
+(the same operations, in the same order, as KneserNey.probs, so the values are bit-identical).
+Rows of table j are already grouped by prefix row, so the top k per history is one lexsort per
+level; they are stored as CSR arrays (offsets_{j}, ids_{j}, probs_{j}) next to the count store
+(<corpus>.ngrams.topk) and memory-mapped.
+
+Query (suggest): take the last max_n-1 tokens, then walk from the longest history to the empty
+one. Every seen history contributes its list scaled by the product of the backoff weights gamma
+of the longer histories (1 for an unseen history), and a token keeps the value from its longest
+history. Exactness: a follower w of h that did not make h's list is beaten by the k that did, and
+an unseen w' scores gamma(h) * P(w'|h'), which is below every entry of h''s list. So the merged
+top k equals the top k of P(w | h) over the whole vocabulary.
+
+Usage:
+  python ngram_predict.py [corpus.txt] [--k 10] ["w1 w2 w3" ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ngram_kneser_ney import KneserNey, load_or_build_kneser_ney, suffix_rows
+from ngram_store import default_store_path, load_or_build, map_array, read_header, store_stamp, write_arrays
+from ngram_table import ID_MASK, KEY_SHIFT, NGramCounts
+
+TOPK_MAGIC = b"NGRAMTK1"
+TOPK_VERSION = 1
+TOPK_SUFFIX = ".topk"
+TOP_K = 10
+
+
+######## Build ########
+def level_probs(kn: KneserNey) -> Dict[int, np.ndarray]:
+	"""P(w | h) under kn's model of order max_n for every row of every table (0 for count-0 rows)."""
+	counts = kn.counts
+	suffix = suffix_rows(counts)
+	probs: Dict[int, np.ndarray] = {}
+	for j in range(1, kn.max_n + 1):
+		v = "top" if j == kn.max_n else "low"
+		a, g = kn.alpha[v][j], kn.gamma[v][j]
+		if j == 1:
+			p = a + g[0] * (1.0 / max(kn.vocab_size, 1))
+		else:
+			lower = probs[j - 1][suffix[j].clip(0)]
+			p = a + g[(counts.keys[j] >> KEY_SHIFT).astype(np.int64)] * lower
+		probs[j] = np.where(counts.counts[j] > 0, p, 0.0)
+	return probs
+
+
+def top_k(prefix: np.ndarray, p: np.ndarray, live: np.ndarray, n_hist: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+	"""(offsets, rows) of the k largest p per history: rows of history h are rows[offsets[h]:offsets[h + 1]]."""
+	rows = np.flatnonzero(live)
+	pre = prefix[rows]
+	order = np.lexsort((rows, -p[rows], pre))  # ties: lower row (= lower token id) first
+	rows, pre = rows[order], pre[order]
+	first = np.searchsorted(pre, pre)  # start of each history's block
+	keep = np.arange(len(rows)) - first < k
+	rows, pre = rows[keep], pre[keep]
+	offsets = np.zeros(n_hist + 1, dtype=np.int64)
+	np.cumsum(np.bincount(pre, minlength=n_hist), out=offsets[1:])
+	return offsets, rows
+
+
+class NextWordIndex:
+	"""Top-k followers per history plus the backoff weights to merge them (module docstring)."""
+
+	def __init__(self, counts: NGramCounts, kn: KneserNey, k: int, offsets: Dict[int, np.ndarray],
+				 ids: Dict[int, np.ndarray], probs: Dict[int, np.ndarray]):
+		self.counts = counts
+		self.kn = kn
+		self.k = k
+		self.offsets = offsets
+		self.ids = ids
+		self.probs = probs
+		self.max_n = kn.max_n
+		self._gamma = {j: kn.gamma["top" if j == self.max_n else "low"][j] for j in range(1, self.max_n + 1)}
+
+	@classmethod
+	def build(cls, counts: NGramCounts, kn: KneserNey, k: int = TOP_K) -> "NextWordIndex":
+		probs = level_probs(kn)
+		offsets: Dict[int, np.ndarray] = {}
+		ids: Dict[int, np.ndarray] = {}
+		top: Dict[int, np.ndarray] = {}
+		for j in range(1, kn.max_n + 1):
+			live = counts.counts[j] > 0
+			if j == 1:
+				prefix, n_hist = np.zeros(len(live), dtype=np.int64), 1
+			else:
+				prefix, n_hist = (counts.keys[j] >> KEY_SHIFT).astype(np.int64), len(counts.keys[j - 1])
+			offsets[j], rows = top_k(prefix, probs[j], live, n_hist, k)
+			ids[j] = (counts.keys[j][rows] & ID_MASK).astype(np.int32)
+			top[j] = probs[j][rows]
+		return cls(counts, kn, k, offsets, ids, top)
+
+	def suggest(self, history: Sequence[str], k: Optional[int] = None) -> List[Tuple[str, float]]:
+		"""The k likeliest next tokens after `history` (tokens), with their probabilities."""
+		k = min(k or self.k, self.k)
+		h = self.counts.vocab.encode(list(history)[max(0, len(history) - (self.max_n - 1)):])
+		found: Dict[int, float] = {}
+		scale = 1.0
+		for start in range(len(h) + 1):  # longest history first
+			j = len(h) - start + 1
+			if j == 1:
+				row = 0
+			else:
+				row = self.counts.index(h[start:])
+				if row < 0:
+					continue  # unseen history: gamma = 1
+			lo, hi = int(self.offsets[j][row]), int(self.offsets[j][row + 1])
+			for w, p in zip(self.ids[j][lo:hi].tolist(), self.probs[j][lo:hi].tolist()):
+				if w not in found:
+					found[w] = scale * p
+			scale *= float(self._gamma[j][row])
+		best = sorted(found.items(), key=lambda t: (-t[1], t[0]))[:k]
+		tokens = self.counts.vocab.tokens
+		return [(tokens[w], p) for w, p in best]
+
+	def nbytes(self) -> int:
+		return sum(int(a.nbytes) for t in (self.offsets, self.ids, self.probs) for a in t.values())
+
+
+######## Store ########
+def default_topk_path(store: Path) -> Path:
+	return store.with_name(store.name + TOPK_SUFFIX)
+
+
+def save_next_word_index(index: NextWordIndex, path: Path, store: Path):
+	arrays: Dict[str, np.ndarray] = {}
+	for j in index.offsets:
+		arrays[f"offsets_{j}"] = np.ascontiguousarray(index.offsets[j], dtype="<i8")
+		arrays[f"ids_{j}"] = np.ascontiguousarray(index.ids[j], dtype="<i4")
+		arrays[f"probs_{j}"] = np.ascontiguousarray(index.probs[j], dtype="<f8")
+	write_arrays(path, {"version": TOPK_VERSION, "max_n": index.max_n, "k": index.k, "store": store_stamp(store)},
+				 arrays, TOPK_MAGIC)
+
+
+def load_next_word_index(path: Path, counts: NGramCounts, kn: KneserNey) -> NextWordIndex:
+	header, base = read_header(path, TOPK_MAGIC, TOPK_VERSION)
+	tables = {t: {j: map_array(path, header, base, f"{t}_{j}") for j in range(1, header["max_n"] + 1)}
+			  for t in ("offsets", "ids", "probs")}
+	return NextWordIndex(counts, kn, header["k"], tables["offsets"], tables["ids"], tables["probs"])
+
+
+def load_or_build_next_word_index(counts: NGramCounts, store: Path, k: int = TOP_K) -> NextWordIndex:
+	"""Memory-map the index saved next to `store`, or build and save it (store changed, or smaller k)."""
+	kn = load_or_build_kneser_ney(counts, store)
+	path = default_topk_path(store)
+	if path.is_file():
+		try:
+			header, _ = read_header(path, TOPK_MAGIC, TOPK_VERSION)
+			if header["store"] == store_stamp(store) and header["max_n"] == counts.max_n and header["k"] >= k:
+				return load_next_word_index(path, counts, kn)
+		except (ValueError, KeyError, OSError):
+			pass
+	index = NextWordIndex.build(counts, kn, k)
+	if store.is_file():
+		save_next_word_index(index, path, store)
+	return index
+
+
+def main():
+	from q3 import INPUT_FILENAME, MAX_N, SENTENCE_FILE, find_file, read_sentences
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("queries", nargs="*", help="histories to complete (whitespace-separated tokens)")
+	ap.add_argument("--k", type=int, default=TOP_K)
+	args = ap.parse_args()
+
+	corpus = args.corpus or find_file(INPUT_FILENAME)
+	counts = load_or_build(corpus, MAX_N)
+	t0 = time.perf_counter()
+	index = load_or_build_next_word_index(counts, default_store_path(corpus), args.k)
+	print(f"Top-{index.k} index: {index.nbytes() / 2**20:.1f} MB ({time.perf_counter() - t0:.2f} s)")
+
+	for q in args.queries:
+		print(f"\n{q} ->")
+		for tok, p in index.suggest(q.split(), args.k):
+			print(f"  {tok}\t{p:.6f}")
+
+	# latency over every prefix of the q3 sentences (histories of length 0..max_n-1)
+	histories = [toks[:i] for _, toks in read_sentences(find_file(SENTENCE_FILE)) for i in range(len(toks))]
+	t0 = time.perf_counter()
+	for h in histories:
+		index.suggest(h, args.k)
+	dt = time.perf_counter() - t0
+	print(f"\n{len(histories)} queries: {dt / max(len(histories), 1) * 1e6:.1f} us per query")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,293 @@
+"""
+Lab 4 - Batch Sentence Scoring (vectorized q3)
+
+score_sentences() takes every sentence and every model order at once and reproduces
+q3.sentence_prob exactly, without a Python-level lookup per token:
+
+  1. all sentence tokens are flattened into one id array (unknown tokens -> -1);
+  2. per order n, each token's effective order is min(n, position + 1) (the same implicit
+	 backoff at sentence start as q3), and the n-grams of each effective order are gathered as
+	 an (m, order) id matrix;
+  3. NGramCounts.count_many returns c(h,w) and c(h) for the whole matrix (c(h) = total tokens
+	 for unigrams), and the Add-One / Add-K / Token-Type columns are array expressions;
+  4. log10 values are summed per sentence in token order, so the floating point results are
+	 bit-identical to the scalar loop.
+
+Given a KneserNey model, the same n-gram matrices also yield Kneser-Ney log10 probabilities
+(KneserNey.probs; sentence-initial tokens use the model's lower-order distributions).
+
+add_k_sweep() evaluates a whole grid of Add-K constants in the same pass: c(h,w) and c(h) are
+gathered once per order, reduced to their distinct (c(h,w), c(h)) pairs with multiplicities, and
+log10 P is broadcast over a (K, pair) grid, so each extra K costs one array row instead of a rerun.
+
+SentenceScorer is the per-sentence path (one sentence at a time, e.g. a stream), also equal to
+q3.sentence_prob. It walks the tokens once for all orders: the history of order o at position i
+is the (o-1)-gram ending at i-1, whose row and count the previous step already has, so every
+order costs a single extension search (prefix row, token) -> row. Those searches go through a
+bounded LRU cache shared across sentences, with hit/miss counters. Given a KneserNey model, the
+same rows give the Kneser-Ney probabilities (score_many, used by q3 with SCORER = "multi").
+"""
+
+from __future__ import annotations
+
+import math
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ngram_kneser_ney import KneserNey
+from ngram_table import ID_BITS, NGramCounts
+
+MIN_PROB = 1e-20  # q3 replaces p <= 0 with this before taking log10
+CACHE_SIZE = 1 << 16  # (order, prefix row, token) -> row entries kept by SentenceScorer
+SWEEP_CELLS = 1 << 22  # (K, count pair) cells evaluated per block by add_k_sweep
+
+
+def log10_exact(p: np.ndarray) -> np.ndarray:
+	"""math.log10 applied element-wise (once per distinct value).
+
+	NumPy's SIMD log10 may differ from libm in the last ulp, which would change q3's output.
+	"""
+	if len(p) == 0:
+		return p.astype(np.float64)
+	u, inv = np.unique(p, return_inverse=True)
+	return np.fromiter(map(math.log10, u.tolist()), dtype=np.float64, count=len(u))[inv.reshape(-1)]
+
+
+def sum_in_order(values: np.ndarray, sent: np.ndarray, pos: np.ndarray, n_sent: int) -> np.ndarray:
+	"""Per-sentence sums accumulated left to right, like `total += x` in a Python loop.
+
+	Values are grouped by position (stable sort, O(tokens) memory) and the groups are added in
+	position order, one term per sentence each, so every total sees its terms in token order.
+	"""
+	acc = np.zeros(n_sent, dtype=np.float64)
+	if len(pos) == 0:
+		return acc
+	by_pos = np.argsort(pos, kind="stable")
+	for seg in np.split(by_pos, np.flatnonzero(np.diff(pos[by_pos])) + 1):
+		acc[sent[seg]] += values[seg]  # a sentence occurs at most once per position
+	return acc
+
+
+def _flatten(sentences: Sequence[List[str]], counts: NGramCounts):
+	"""(lengths, flat tokens, ids, sentence index, position in sentence) over all sentences."""
+	lengths = np.fromiter((len(t) for t in sentences), dtype=np.int64, count=len(sentences))
+	flat = [w for toks in sentences for w in toks]
+	ids = np.array(counts.vocab.encode(flat), dtype=np.int64)
+	sent = np.repeat(np.arange(len(sentences)), lengths)
+	pos = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+	return lengths, flat, ids, sent, pos
+
+
+def _order_grams(ids: np.ndarray, eff: np.ndarray, n: int):
+	"""(token positions, (m, o) id matrix) for every effective order o <= n that occurs."""
+	for o in range(1, n + 1):
+		at = np.flatnonzero(eff == o)
+		if len(at):
+			yield at, ids[at[:, None] + np.arange(1 - o, 1)]
+
+
+def score_sentences(sentences: Sequence[List[str]], orders: Sequence[int], counts: NGramCounts,
+					vocab_size: int, k: float, kn: Optional[KneserNey] = None) -> Dict[int, Dict[str, np.ndarray]]:
+	"""Score every sentence under every order in `orders`.
+
+	Returns {n: {"tokens": m, "add1_log10": ..., "addK_log10": ..., "token_type": ...}}, one
+	array entry per sentence, equal to q3.sentence_prob(tokens, n, counts, vocab_size); with
+	`kn`, also "kn_log10" (Kneser-Ney model of order n).
+	"""
+	lengths, flat, ids, sent, pos = _flatten(sentences, counts)
+
+	char_types = {w: len(set(w)) for w in set(flat)}  # unique characters, once per distinct token
+	type_bonus = np.fromiter((char_types[w] for w in flat), dtype=np.int64, count=len(flat))
+
+	results: Dict[int, Dict[str, np.ndarray]] = {}
+	for n in orders:
+		eff = np.minimum(n, pos + 1)
+		c_hw = np.zeros(len(flat), dtype=np.int64)
+		c_h = np.zeros(len(flat), dtype=np.int64)
+		kn_p = np.ones(len(flat), dtype=np.float64)
+		for at, grams in _order_grams(ids, eff, n):
+			c_hw[at], c_h[at] = counts.count_many(grams)
+			if kn is not None:
+				kn_p[at] = kn.probs(grams, n)
+		if vocab_size:
+			add1 = (c_hw + 1) / (c_h + vocab_size)
+			addk = (c_hw + k) / (c_h + k * vocab_size)
+		else:
+			add1 = addk = np.zeros(len(flat))
+		add1[add1 <= 0] = MIN_PROB
+		addk[addk <= 0] = MIN_PROB
+		results[n] = {
+			"tokens": lengths,
+			"add1_log10": sum_in_order(log10_exact(add1), sent, pos, len(sentences)),
+			"addK_log10": sum_in_order(log10_exact(addk), sent, pos, len(sentences)),
+			"token_type": np.bincount(sent, weights=c_hw + type_bonus, minlength=len(sentences)),
+		}
+		if kn is not None:
+			results[n]["kn_log10"] = sum_in_order(np.log10(np.maximum(kn_p, MIN_PROB)), sent, pos, len(sentences))
+	return results
+
+
+def add_k_sweep(sentences: Sequence[List[str]], orders: Sequence[int], counts: NGramCounts,
+				vocab_size: int, ks: Sequence[float]) -> Dict[int, np.ndarray]:
+	"""Total Add-K log10 likelihood of all sentence tokens for every K in ks, per order.
+
+	Returns {n: array of len(ks)}; the same totals as summing score_sentences(..., k)[n]["addK_log10"]
+	for each k separately (up to the order of the floating point additions).
+	"""
+	ks = np.asarray(ks, dtype=np.float64)
+	_, _, ids, _, pos = _flatten(sentences, counts)
+	results: Dict[int, np.ndarray] = {}
+	for n in orders:
+		c_hw = np.zeros(len(ids), dtype=np.int64)
+		c_h = np.zeros(len(ids), dtype=np.int64)
+		for at, grams in _order_grams(ids, np.minimum(n, pos + 1), n):
+			c_hw[at], c_h[at] = counts.count_many(grams)
+		pairs, mult = np.unique(np.stack([c_hw, c_h], axis=1), axis=0, return_counts=True)
+		total = np.zeros(len(ks), dtype=np.float64)
+		step = max(1, SWEEP_CELLS // max(len(ks), 1))
+		for lo in range(0, len(pairs), step):
+			hw, h = pairs[lo:lo + step, 0], pairs[lo:lo + step, 1]
+			p = (hw + ks[:, None]) / (h + ks[:, None] * vocab_size) if vocab_size else np.zeros((len(ks), len(hw)))
+			total += np.log10(np.maximum(p, MIN_PROB)) @ mult[lo:lo + step]
+		results[n] = total
+	return results
+
+
+######## Per-Sentence Scoring ########
+class LRUCache:
+	"""Bounded mapping that evicts the least recently used entry; counts hits and misses."""
+
+	def __init__(self, capacity: int):
+		self.capacity = capacity
+		self.data: OrderedDict = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key, default=None):
+		v = self.data.get(key, default)
+		if v is default:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.data.move_to_end(key)
+		return v
+
+	def put(self, key, value):
+		self.data[key] = value
+		if len(self.data) > self.capacity:
+			self.data.popitem(last=False)
+
+	def hit_rate(self) -> float:
+		total = self.hits + self.misses
+		return self.hits / total if total else 0.0
+
+	def line(self) -> str:
+		return (f"{self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate), "
+				f"{len(self.data)}/{self.capacity} entries")
+
+
+class SentenceScorer:
+	"""Single-pass multi-order scoring of one sentence at a time (see module docstring)."""
+
+	def __init__(self, counts: NGramCounts, vocab_size: int, k: float, cache_size: int = CACHE_SIZE,
+				 kn: Optional[KneserNey] = None):
+		self.counts = counts
+		self.vocab_size = vocab_size
+		self.k = k
+		self.kn = kn
+		self.cache = LRUCache(cache_size)
+		self._counts = {n: counts.counts[n] for n in range(1, counts.max_n + 1)}
+
+	def _row(self, n: int, prefix: int, wid: int) -> int:
+		"""Row of (prefix row, token) in table n (prefix is ignored for n = 1), -1 if absent."""
+		key = (n, prefix, wid)
+		row = self.cache.get(key)
+		if row is None:
+			keys = self.counts.keys[n]
+			q = wid if n == 1 else (prefix << ID_BITS) | wid
+			i = int(keys.searchsorted(keys.dtype.type(q)))
+			row = i if i < len(keys) and keys[i] == q else -1
+			self.cache.put(key, row)
+		return row
+
+	def score(self, tokens: List[str], orders: Sequence[int]) -> Dict[int, Tuple[float, float, float]]:
+		"""{n: (add1_log10P, addK_log10P, token_type_sum)} == q3.sentence_prob(tokens, n, ...) per n."""
+		return self._score(tokens, orders)
+
+	def score_many(self, sentences: Sequence[List[str]], orders: Sequence[int]) -> Dict[int, Dict[str, np.ndarray]]:
+		"""score() over all sentences, in the result layout of score_sentences (same values).
+
+		With a KneserNey model, "kn_log10" is included; its per-token probabilities come from the
+		rows of the walk and are summed like score_sentences sums them.
+		"""
+		lengths = np.fromiter((len(t) for t in sentences), dtype=np.int64, count=len(sentences))
+		cols = ("add1_log10", "addK_log10", "token_type") + (("kn_log10",) if self.kn is not None else ())
+		results = {n: {"tokens": lengths, **{c: np.zeros(len(sentences), dtype=np.float64) for c in cols}}
+				   for n in orders}
+		for s, tokens in enumerate(sentences):
+			kn_p: Optional[Dict[int, List[float]]] = {n: [] for n in orders} if self.kn is not None else None
+			for n, values in self._score(tokens, orders, kn_p).items():
+				for c, v in zip(cols, values):
+					results[n][c][s] = v
+			if kn_p is not None:
+				for n, ps in kn_p.items():
+					total = 0.0
+					for x in np.log10(np.maximum(np.array(ps, dtype=np.float64), MIN_PROB)).tolist():
+						total += x
+					results[n]["kn_log10"][s] = total
+		return results
+
+	def _kn_prob(self, n: int, o: int, rows: List[int], prev: List[int]) -> float:
+		"""KneserNey.probs of the o-gram ending here under the order-n model, from the walk's rows."""
+		kn = self.kn
+		p = 1.0 / max(kn.vocab_size, 1)
+		for j in range(1, o + 1):
+			v = "top" if j == n else "low"
+			a, g = kn.alpha[v][j], kn.gamma[v][j]
+			row = rows[j - 1]
+			p_hw = float(a[row]) if row >= 0 and len(a) else 0.0
+			if j == 1:
+				p = p_hw + float(g[0]) * p
+			else:
+				hist = prev[j - 2]
+				p = p_hw + (float(g[hist]) if hist >= 0 and len(g) else 1.0) * p
+		return p
+
+	def _score(self, tokens: List[str], orders: Sequence[int],
+			   kn_p: Optional[Dict[int, List[float]]] = None) -> Dict[int, Tuple[float, float, float]]:
+		counts, V, k = self._counts, self.vocab_size, self.k
+		top = max(orders)
+		total = self.counts.total_tokens
+		acc = {n: [0.0, 0.0, 0.0] for n in orders}
+		prev: List[int] = []  # prev[o - 1] = row of the o-gram ending at the previous token
+		for i, (w, wid) in enumerate(zip(tokens, self.counts.vocab.encode(tokens))):
+			rows = [self._row(1, 0, wid) if wid >= 0 else -1]
+			for o in range(2, min(i + 1, top) + 1):
+				h = prev[o - 2]
+				rows.append(self._row(o, h, wid) if h >= 0 and wid >= 0 else -1)
+			bonus = len(set(w))
+			for n in orders:
+				o = min(n, i + 1)
+				row = rows[o - 1]
+				c_hw = int(counts[o][row]) if row >= 0 else 0
+				if o == 1:
+					c_h = total
+				else:
+					h = prev[o - 2]
+					c_h = int(counts[o - 1][h]) if h >= 0 else 0
+				if o == 1:
+					add1_p = (c_hw + 1) / (c_h + V)
+					addk_p = (c_hw + k) / (c_h + k * V)
+				else:
+					add1_p = (c_hw + 1) / (c_h + V) if V else 0.0
+					addk_p = (c_hw + k) / (c_h + k * V) if V else 0.0
+				a = acc[n]
+				a[0] += math.log10(add1_p if add1_p > 0 else MIN_PROB)
+				a[1] += math.log10(addk_p if addk_p > 0 else MIN_PROB)
+				a[2] += c_hw + bonus
+				if kn_p is not None:
+					kn_p[n].append(self._kn_prob(n, o, rows, prev))
+			prev = rows
+		return {n: (a[0], a[1], a[2]) for n, a in acc.items()}
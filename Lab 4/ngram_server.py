@@ -0,0 +1,248 @@
+"""
+Lab 4 - Sentence Scoring Server (asyncio, micro-batched)
+
+Loads the n-gram counts (and Kneser-Ney tables) once and serves q3-style scores over HTTP on a
+TCP port or a Unix socket. Standard library only; connections are kept alive.
+
+  POST /score   {"sentences": ["w1 w2 ...", ["w1", "w2", ...], ...], "orders": [2, 3, 4]}
+				-> {"results": [{"tokens": m, "orders": {"2": {"add1_log10": ..., "add1_perplexity": ...,
+					"addK_log10": ..., "addK_perplexity": ..., "kn_log10": ..., "kn_perplexity": ...,
+					"token_type": ...}, ...}}, ...]}
+  GET  /health  -> {"ok": true, "total_tokens": ..., "vocab_size": ..., "batches": ..., ...}
+
+Strings are split on whitespace (like q3_data.txt lines without the "N." prefix). Values are
+the ones q3 writes to sentence_probs.tsv (same kernel: ngram_scoring.score_sentences).
+
+Micro-batching: requests go into a queue; a single batcher takes the first waiting request,
+keeps collecting for up to BATCH_WINDOW_MS or until MAX_BATCH sentences, scores the whole batch
+with one score_sentences call per distinct order set and resolves every request's future.
+Under load one kernel call then covers many requests; an idle server adds at most the window.
+
+Usage:
+  python ngram_server.py [corpus.txt] [--port 8765 | --unix /tmp/ngram.sock]
+						 [--batch-window-ms 2] [--max-batch 512]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ngram_kneser_ney import KneserNey, load_or_build_kneser_ney
+from ngram_scoring import score_sentences
+from ngram_store import default_store_path, load_or_build
+from ngram_table import NGramCounts
+
+PORT = 8765
+BATCH_WINDOW_MS = 2.0        # how long the batcher waits for more requests after the first
+MAX_BATCH = 512              # sentences per kernel call
+MAX_BODY = 16 << 20          # bytes per request body
+DEFAULT_ORDERS = (2, 3, 4)
+METHODS = ("add1", "addK", "kn")
+
+
+######## Scoring ########
+class BatchScorer:
+	"""Queue of pending requests, drained in micro-batches by one background task."""
+
+	def __init__(self, counts: NGramCounts, kn: Optional[KneserNey], add_k: float,
+				 batch_window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH):
+		self.counts = counts
+		self.kn = kn
+		self.add_k = add_k
+		self.vocab_size = len(counts.vocab)
+		self.window = batch_window_ms / 1000
+		self.max_batch = max_batch
+		self.queue: asyncio.Queue = asyncio.Queue()
+		self.batches = 0
+		self.requests = 0
+		self.sentences = 0
+
+	async def score(self, sentences: List[List[str]], orders: Tuple[int, ...]) -> List[dict]:
+		fut = asyncio.get_running_loop().create_future()
+		await self.queue.put((sentences, orders, fut))
+		return await fut
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = [await self.queue.get()]
+			size = len(batch[0][0])
+			deadline = loop.time() + self.window
+			while size < self.max_batch:
+				timeout = deadline - loop.time()
+				if timeout <= 0:
+					break
+				try:
+					item = await asyncio.wait_for(self.queue.get(), timeout)
+				except asyncio.TimeoutError:
+					break
+				batch.append(item)
+				size += len(item[0])
+			# the kernel is NumPy-bound; run it off the event loop so connections keep being served
+			try:
+				results = await loop.run_in_executor(None, self._score_batch, batch)
+			except Exception as e:  # fail the requests, keep the server up
+				results = [e] * len(batch)
+			for (_, _, fut), res in zip(batch, results):
+				if fut.done():
+					continue
+				if isinstance(res, Exception):
+					fut.set_exception(res)
+				else:
+					fut.set_result(res)
+
+	def _score_batch(self, batch) -> List[List[dict]]:
+		self.batches += 1
+		self.requests += len(batch)
+		out: List[List[dict]] = [[] for _ in batch]
+		by_orders: Dict[Tuple[int, ...], List[int]] = {}
+		for i, (_, orders, _) in enumerate(batch):
+			by_orders.setdefault(orders, []).append(i)
+		for orders, members in by_orders.items():
+			sentences = [s for i in members for s in batch[i][0]]
+			self.sentences += len(sentences)
+			scores = score_sentences(sentences, orders, self.counts, self.vocab_size, self.add_k, self.kn)
+			cols = {n: {c: v.tolist() for c, v in scores[n].items()} for n in orders}
+			j = 0
+			for i in members:
+				for toks in batch[i][0]:
+					out[i].append(_sentence_result(len(toks), cols, j))
+					j += 1
+		return out
+
+
+def _sentence_result(m: int, cols: Dict[int, Dict[str, list]], j: int) -> dict:
+	orders = {}
+	for n, c in cols.items():
+		res = {}
+		for method in METHODS:
+			name = f"{method}_log10"
+			if name in c:
+				res[name] = c[name][j]
+				res[f"{method}_perplexity"] = 10 ** (-c[name][j] / m) if m else 0.0
+		res["token_type"] = c["token_type"][j]
+		orders[str(n)] = res
+	return {"tokens": m, "orders": orders}
+
+
+def parse_request(body: bytes, max_n: int) -> Tuple[List[List[str]], Tuple[int, ...]]:
+	req = json.loads(body.decode("utf-8"))
+	if not isinstance(req, dict) or not isinstance(req.get("sentences"), list):
+		raise ValueError('expected {"sentences": [...], "orders": [...]}')
+	sentences = [s.split() if isinstance(s, str) else [str(t) for t in s] for s in req["sentences"]]
+	orders = tuple(sorted({int(n) for n in req.get("orders", DEFAULT_ORDERS)}))
+	if not orders or orders[0] < 1 or orders[-1] > max_n:
+		raise ValueError(f"orders must be within 1..{max_n}")
+	return sentences, orders
+
+
+######## HTTP ########
+def _response(status: str, payload: dict, keep_alive: bool) -> bytes:
+	body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+	head = (f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n"
+			f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+	return head.encode("ascii") + body
+
+
+class ScoringServer:
+	def __init__(self, scorer: BatchScorer):
+		self.scorer = scorer
+		self.started = time.time()
+
+	async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				method, path, version = line.decode("latin-1").split()
+				headers = {}
+				while True:
+					h = await reader.readline()
+					if h in (b"\r\n", b"\n", b""):
+						break
+					k, _, v = h.decode("latin-1").partition(":")
+					headers[k.strip().lower()] = v.strip()
+				size = int(headers.get("content-length", 0))
+				if size > MAX_BODY:
+					writer.write(_response("413 Payload Too Large", {"error": "body too large"}, False))
+					break
+				body = await reader.readexactly(size) if size else b""
+				keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+				writer.write(await self.dispatch(method, path, body, keep_alive))
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+			pass
+		finally:
+			writer.close()
+
+	async def dispatch(self, method: str, path: str, body: bytes, keep_alive: bool) -> bytes:
+		scorer = self.scorer
+		if method == "GET" and path == "/health":
+			return _response("200 OK", {
+				"ok": True, "total_tokens": scorer.counts.total_tokens, "vocab_size": scorer.vocab_size,
+				"kneser_ney": scorer.kn is not None, "uptime_s": round(time.time() - self.started, 1),
+				"requests": scorer.requests, "sentences": scorer.sentences, "batches": scorer.batches,
+			}, keep_alive)
+		if method == "POST" and path == "/score":
+			try:
+				sentences, orders = parse_request(body, scorer.counts.max_n)
+			except (ValueError, KeyError, TypeError) as e:
+				return _response("400 Bad Request", {"error": str(e)}, keep_alive)
+			try:
+				results = await scorer.score(sentences, orders)
+			except Exception as e:
+				return _response("500 Internal Server Error", {"error": str(e)}, keep_alive)
+			return _response("200 OK", {"results": results}, keep_alive)
+		return _response("404 Not Found", {"error": f"no route for {method} {path}"}, keep_alive)
+
+
+async def serve(counts: NGramCounts, kn: Optional[KneserNey], add_k: float, port: int = PORT,
+				unix: Optional[Path] = None, batch_window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH):
+	scorer = BatchScorer(counts, kn, add_k, batch_window_ms, max_batch)
+	app = ScoringServer(scorer)
+	if unix is not None:
+		server = await asyncio.start_unix_server(app.handle, path=str(unix))
+		where = f"unix:{unix}"
+	else:
+		server = await asyncio.start_server(app.handle, "127.0.0.1", port)
+		where = f"http://127.0.0.1:{port}"
+	print(f"Scoring server on {where} (batch window {batch_window_ms} ms, max batch {max_batch})", flush=True)
+	batcher = asyncio.create_task(scorer.run())
+	try:
+		async with server:
+			await server.serve_forever()
+	finally:
+		batcher.cancel()
+
+
+def main(argv: Optional[Sequence[str]] = None):
+	from q3 import ADD_K, INPUT_FILENAME, MAX_N, find_file
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--port", type=int, default=PORT)
+	ap.add_argument("--unix", type=Path, help="listen on a Unix socket instead of TCP")
+	ap.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS)
+	ap.add_argument("--max-batch", type=int, default=MAX_BATCH)
+	ap.add_argument("--no-kn", action="store_true", help="skip the Kneser-Ney columns")
+	args = ap.parse_args(argv)
+
+	corpus = args.corpus or find_file(INPUT_FILENAME)
+	counts = load_or_build(corpus, MAX_N)
+	kn = None if args.no_kn else load_or_build_kneser_ney(counts, default_store_path(corpus))
+	try:
+		asyncio.run(serve(counts, kn, ADD_K, args.port, args.unix, args.batch_window_ms, args.max_batch))
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__ == "__main__":
+	main()
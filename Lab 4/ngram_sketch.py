@@ -0,0 +1,213 @@
+"""
+Lab 4 - Approximate N‑gram Counting (Count-Min sketch + Misra-Gries heavy hitters)
+
+For exploratory runs that only need the top n-grams and rough counts for the rest. Memory per
+order is fixed by the parameters, not by the corpus:
+
+  * Count-Min sketch (depth d, width w) for point queries. Estimates never undercount and, with
+	w = e / epsilon and d = ln(1 / delta), overcount by at most epsilon * N_n with probability
+	1 - delta (N_n = number of n-grams of order n in the corpus).
+  * Misra-Gries summary with `capacity` counters for the heavy hitters. Every n-gram occurring
+	more than N_n / (capacity + 1) times is tracked, and its summary count undercounts by at most
+	the total decrement (reported, and never more than N_n / (capacity + 1)). Chunks are folded in
+	with the mergeable-summary rule (add counters, subtract the (capacity+1)-th largest count).
+  * HyperLogLog (2^HLL_BITS registers) for the number of distinct n-grams (~0.8% std. error).
+
+N-grams are identified by a 64-bit hash of their id tuple (collisions are negligible at these
+sizes). Only the vocabulary is exact and grows with the corpus.
+
+count_ngrams_sketch returns a SketchCounts, an NGramCounts over the tracked heavy hitters, so
+the q1 writers and print_top work unchanged; counts are min(Count-Min, Misra-Gries upper bound).
+"""
+
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from ngram_table import CHUNK_TOKENS, NGramCounts, Vocab, stream_token_ids, tables_from_grams
+
+EPSILON = 1e-4               # Count-Min overcount bound, as a fraction of N_n
+DELTA = 0.01                 # probability of exceeding it
+CAPACITY = 1024              # Misra-Gries counters per order
+HLL_BITS = 14                # HyperLogLog registers per order = 2^HLL_BITS
+
+_SEED = np.uint64(0x9E3779B97F4A7C15)
+_STEP = np.uint64(0xBF58476D1CE4E5B9)
+
+
+######## Hashing ########
+def _mix(z: np.ndarray) -> np.ndarray:
+	"""splitmix64 finalizer (uint64 arithmetic wraps)."""
+	z = z ^ (z >> np.uint64(30))
+	z = z * np.uint64(0xBF58476D1CE4E5B9)
+	z = z ^ (z >> np.uint64(27))
+	z = z * np.uint64(0x94D049BB133111EB)
+	return z ^ (z >> np.uint64(31))
+
+
+def gram_hashes(ids: np.ndarray) -> np.ndarray:
+	"""64-bit hash of every row of an (m, n) id matrix."""
+	ids = np.asarray(ids, dtype=np.int64)
+	h = _mix(ids[:, 0].astype(np.uint64) + _SEED)
+	for j in range(1, ids.shape[1]):
+		h = _mix(h * _STEP + ids[:, j].astype(np.uint64))
+	return h
+
+
+######## Summaries ########
+class CountMinSketch:
+	def __init__(self, epsilon: float = EPSILON, delta: float = DELTA, seed: int = 0):
+		self.width = 1 << max(1, math.ceil(math.log2(math.e / epsilon)))  # power of two >= e / epsilon
+		self.depth = max(1, math.ceil(math.log(1 / delta)))
+		self._shift = np.uint64(64 - int(math.log2(self.width)))
+		rng = np.random.default_rng(seed)
+		self._mult = rng.integers(0, 2**63, self.depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+		self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+		self.total = 0
+
+	def _cells(self, h: np.ndarray, i: int) -> np.ndarray:
+		return ((h * self._mult[i]) >> self._shift).astype(np.int64)  # multiply-shift hashing
+
+	def add(self, h: np.ndarray):
+		for i in range(self.depth):
+			self.table[i] += np.bincount(self._cells(h, i), minlength=self.width)
+		self.total += len(h)
+
+	def query(self, h: np.ndarray) -> np.ndarray:
+		est = self.table[0][self._cells(h, 0)]
+		for i in range(1, self.depth):
+			est = np.minimum(est, self.table[i][self._cells(h, i)])
+		return est
+
+	def error_bound(self) -> float:
+		return math.e / self.width * self.total
+
+
+class MisraGries:
+	"""Heavy-hitter summary over hashed n-grams; keeps the id tuple of every tracked n-gram."""
+
+	def __init__(self, n: int, capacity: int = CAPACITY):
+		self.capacity = capacity
+		self.hashes = np.empty(0, dtype=np.uint64)
+		self.ids = np.empty((0, n), dtype=np.int64)
+		self.counts = np.empty(0, dtype=np.int64)
+		self.decrement = 0  # total subtracted from every counter so far = max undercount
+
+	def merge(self, hashes: np.ndarray, ids: np.ndarray, counts: np.ndarray):
+		"""Fold in exact counts of distinct n-grams (e.g. one chunk)."""
+		h = np.concatenate((self.hashes, hashes))
+		u, first, inv = np.unique(h, return_index=True, return_inverse=True)
+		c = np.bincount(inv.reshape(-1), weights=np.concatenate((self.counts, counts)), minlength=len(u)).astype(np.int64)
+		ids = np.concatenate((self.ids, ids))[first]
+		if len(u) > self.capacity:
+			cut = int(np.partition(c, len(c) - self.capacity - 1)[len(c) - self.capacity - 1])
+			c -= cut
+			self.decrement += cut
+			keep = c > 0
+			u, ids, c = u[keep], ids[keep], c[keep]
+		self.hashes, self.ids, self.counts = u, ids, c
+
+
+class HyperLogLog:
+	def __init__(self, bits: int = HLL_BITS):
+		self.bits = bits
+		self.registers = np.zeros(1 << bits, dtype=np.int64)
+
+	def add(self, h: np.ndarray):
+		idx = (h >> np.uint64(64 - self.bits)).astype(np.int64)
+		rest = h << np.uint64(self.bits)
+		with np.errstate(divide="ignore"):
+			lead = 63 - np.floor(np.log2(rest.astype(np.float64)))
+		rank = np.where(rest == 0, 64 - self.bits, np.clip(lead, 0, 64 - self.bits - 1)).astype(np.int64) + 1
+		np.maximum.at(self.registers, idx, rank)
+
+	def estimate(self) -> int:
+		m = len(self.registers)
+		est = 0.7213 / (1 + 1.079 / m) * m * m / float(np.sum(np.ldexp(1.0, -self.registers)))
+		zeros = int(np.count_nonzero(self.registers == 0))
+		if est <= 2.5 * m and zeros:
+			est = m * math.log(m / zeros)  # linear counting for small cardinalities
+		return int(round(est))
+
+
+######## Counting ########
+class SketchCounts(NGramCounts):
+	"""NGramCounts over the tracked heavy hitters; point queries and c(h) come from the sketches."""
+
+	def __init__(self, vocab: Vocab, keys, counts, total_tokens: int, sketches: Dict[int, CountMinSketch],
+				 summaries: Dict[int, MisraGries], distinct: Dict[int, HyperLogLog]):
+		super().__init__(vocab, keys, counts, total_tokens)
+		self.sketches = sketches
+		self.summaries = summaries
+		self.distinct = distinct
+
+	def unique(self, n: int) -> int:
+		return len(self.vocab) if n == 1 else self.distinct[n].estimate()
+
+	def count(self, gram_ids: Sequence[int]) -> int:
+		return int(self.count_many(np.asarray([gram_ids], dtype=np.int64))[0][0])
+
+	def count_pair(self, gram_ids: Sequence[int]) -> Tuple[int, int]:
+		c_h = self.count(gram_ids[:-1]) if len(gram_ids) > 1 else self.total_tokens
+		return self.count(gram_ids), c_h
+
+	def count_many(self, grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		grams = np.asarray(grams, dtype=np.int64)
+		m, order = grams.shape
+		known = (grams >= 0).all(axis=1)
+		c_hw = np.where(known, self.sketches[order].query(gram_hashes(grams.clip(0))), 0)
+		if order == 1:
+			return c_hw, np.full(m, self.total_tokens, dtype=np.int64)
+		c_h = np.where(known, self.sketches[order - 1].query(gram_hashes(grams[:, :-1].clip(0))), 0)
+		return c_hw, np.maximum(c_h, c_hw)
+
+	def history_counts(self, n: int) -> np.ndarray:
+		c_hw, c_h = self.count_many(self.rows(n))
+		return np.maximum(c_h, self.counts[n])
+
+	def error_bounds(self) -> Dict[int, Dict[str, float]]:
+		"""Per order: Count-Min overcount bound (holds with prob. 1 - delta) and Misra-Gries undercount."""
+		return {n: {"n_grams": self.sketches[n].total,
+					"overcount": self.sketches[n].error_bound(),
+					"undercount": self.summaries[n].decrement}
+				for n in self.sketches}
+
+
+def count_ngrams_sketch(path: Path, max_n: int = 4, epsilon: float = EPSILON, delta: float = DELTA,
+						capacity: int = CAPACITY, chunk_tokens: int = CHUNK_TOKENS) -> SketchCounts:
+	"""Approximate counts of orders 1..max_n in fixed memory per order (see module docstring)."""
+	vocab = Vocab()
+	sketches = {n: CountMinSketch(epsilon, delta, seed=n) for n in range(1, max_n + 1)}
+	summaries = {n: MisraGries(n, capacity) for n in range(1, max_n + 1)}
+	distinct = {n: HyperLogLog() for n in range(2, max_n + 1)}
+	tail = np.empty(0, dtype=np.int64)
+	total = 0
+	for ids in stream_token_ids(path, vocab, chunk_tokens):
+		x = np.concatenate((tail, ids))
+		s = len(tail)
+		h = None
+		for n in range(1, max_n + 1):
+			# h[j] hashes x[j:j+n]; only n-grams ending in the new tokens are counted
+			h = _mix(x.astype(np.uint64) + _SEED) if n == 1 else _mix(h[:-1] * _STEP + x[n - 1:].astype(np.uint64))
+			new = h[max(0, s - n + 1):]
+			if len(new) == 0:
+				continue
+			sketches[n].add(new)
+			if n > 1:
+				distinct[n].add(new)
+			u, first, c = np.unique(new, return_index=True, return_counts=True)
+			start = first + max(0, s - n + 1)
+			summaries[n].merge(u, x[start[:, None] + np.arange(n)], c)
+		tail = x[max(0, len(x) - (max_n - 1)):] if max_n > 1 else x[:0]
+		total += len(ids)
+
+	grams = {}
+	for n, mg in summaries.items():
+		est = np.minimum(sketches[n].query(mg.hashes), mg.counts + mg.decrement)
+		grams[n] = (mg.ids, est)
+	keys, counts = tables_from_grams(grams)
+	return SketchCounts(vocab, keys, counts, total, sketches, summaries, distinct)
@@ -0,0 +1,285 @@
+"""
+Lab 4 - Persistent N‑gram Count Store (build once, memory-map everywhere)
+
+q1, q2 and q3 all need the same n=1..4 counts. The first run writes them to a single binary
+file next to the corpus (<corpus>.ngrams); later runs memory-map it instead of re-streaming.
+
+File layout:
+  b"NGRAMST1" | uint64 header length | JSON header | arrays (64-byte aligned, little-endian)
+
+The JSON header holds max_n, total_tokens, the lossy-counting epsilon and report (null for exact
+counts), the corpus fingerprint (size, mtime_ns, blake2b of the content), the size and blake2b of
+the files appended since, and offset/dtype/length of every array:
+  keys{n}, counts{n}  - the sorted tables of ngram_table.py, per order
+  ranks               - string-sort rank of every token id (used by the writers)
+  vocab               - utf-8 tokens joined by "\\n" (tokens never contain whitespace)
+  tail                - ids of the last max_n - 1 tokens counted (context for appending)
+  coc_r{n}, coc_n{n}  - count-of-counts of table n: N_r rows occur exactly r times (stores
+						without them are still read; the histogram is then taken on first use)
+
+The store is rebuilt when the corpus content hash changes (the hash is only recomputed when
+size or mtime differ), when it holds fewer orders than requested, or when epsilon differs.
+
+Appending (append_to_store): new text is counted on its own, starting from the stored tail so
+the n-grams spanning the boundary are counted once, and the delta tables are merged into the
+stored ones (one searchsorted per order plus a sequential copy; nothing is re-tokenized). New
+tokens get the next ids, so existing ids stay valid. The count-of-counts are updated from the
+rows the delta touched rather than recounted. Derived tables (Kneser-Ney, q2's columns)
+are recomputed from the merged arrays: their denominators and discounts change with the totals.
+
+Usage:
+  python ngram_store.py corpus.txt [--max-n 4] [--workers N] [--memory-mb 256 | --epsilon 1e-6]
+  python ngram_store.py corpus.txt --append new_day.txt [more.txt ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ngram_table import (CHUNK_TOKENS, CountOfCounts, LossyReport, NGramCounter, NGramCounts, Vocab, count_ngrams,
+						 count_of_counts, merge_count_of_counts, merge_tables_mapped, stream_token_ids)
+
+MAGIC = b"NGRAMST1"
+FORMAT_VERSION = 3           # 2: lossy-counting epsilon/report instead of prune_cap; 3: tail + appended
+ALIGN = 64
+STORE_SUFFIX = ".ngrams"
+
+
+######## Corpus Fingerprint ########
+def corpus_hash(path: Path, block: int = 1 << 24) -> str:
+	h = hashlib.blake2b(digest_size=20)
+	with path.open("rb") as f:
+		for data in iter(lambda: f.read(block), b""):
+			h.update(data)
+	return h.hexdigest()
+
+
+def corpus_fingerprint(path: Path) -> Dict[str, object]:
+	st = path.stat()
+	return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "blake2b": corpus_hash(path)}
+
+
+def default_store_path(corpus: Path) -> Path:
+	return corpus.with_name(corpus.name + STORE_SUFFIX)
+
+
+def store_stamp(store: Path) -> Dict[str, int]:
+	"""Size and mtime of a store; tables derived from it (e.g. <corpus>.ngrams.kn) record this to detect rebuilds."""
+	st = store.stat()
+	return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+######## Container ########
+# magic | uint64 header length | JSON header | arrays, each 64-byte aligned (also used by ngram_columns.py)
+def write_arrays(path: Path, header: Dict[str, object], arrays: Dict[str, np.ndarray], magic: bytes = MAGIC):
+	"""Write arrays in bulk behind a JSON header (which gains an "arrays" layout entry)."""
+	layout = {}
+	offset = 0
+	for name, arr in arrays.items():
+		layout[name] = {"offset": offset, "dtype": arr.dtype.str, "length": len(arr)}
+		offset += -(-arr.nbytes // ALIGN) * ALIGN
+	blob = json.dumps(dict(header, arrays=layout)).encode("utf-8")
+	base = -(-(len(magic) + 8 + len(blob)) // ALIGN) * ALIGN
+
+	tmp = path.with_name(path.name + ".tmp")
+	with tmp.open("wb") as f:
+		f.write(magic)
+		f.write(len(blob).to_bytes(8, "little"))
+		f.write(blob)
+		for name, arr in arrays.items():
+			f.seek(base + layout[name]["offset"])
+			arr.tofile(f)
+		f.truncate(base + offset)
+	tmp.replace(path)  # readers never see a half-written file
+
+
+def read_header(path: Path, magic: bytes = MAGIC, version: int = FORMAT_VERSION) -> Tuple[dict, int]:
+	"""Return (header dict, byte offset of the array section)."""
+	with path.open("rb") as f:
+		if f.read(len(magic)) != magic:
+			raise ValueError(f"{path} is not a {magic.decode()} file")
+		size = int.from_bytes(f.read(8), "little")
+		header = json.loads(f.read(size).decode("utf-8"))
+	if header.get("version") != version:
+		raise ValueError(f"{path}: unsupported version {header.get('version')}")
+	return header, -(-(len(magic) + 8 + size) // ALIGN) * ALIGN
+
+
+def map_array(path: Path, header: dict, base: int, name: str) -> np.ndarray:
+	"""Memory-map one array of a container read with read_header (read-only, zero-copy)."""
+	spec = header["arrays"][name]
+	if spec["length"] == 0:
+		return np.empty(0, dtype=spec["dtype"])
+	mm = np.memmap(path, dtype=spec["dtype"], mode="r", offset=base + spec["offset"], shape=(spec["length"],))
+	return mm.view(np.ndarray)  # same mapping, without np.memmap's per-operation overhead
+
+
+######## Write ########
+def save_counts(counts: NGramCounts, path: Path, source: Optional[Dict[str, object]] = None,
+				appended: Optional[List[Dict[str, object]]] = None):
+	arrays: Dict[str, np.ndarray] = {}
+	for n in range(1, counts.max_n + 1):
+		arrays[f"keys{n}"] = np.ascontiguousarray(counts.keys[n], dtype="<u8")
+		arrays[f"counts{n}"] = np.ascontiguousarray(counts.counts[n], dtype="<i8")
+	for n in range(1, counts.max_n + 1):
+		r, n_r = counts.count_of_counts(n)
+		arrays[f"coc_r{n}"] = np.ascontiguousarray(r, dtype="<i8")
+		arrays[f"coc_n{n}"] = np.ascontiguousarray(n_r, dtype="<i8")
+	arrays["ranks"] = np.ascontiguousarray(counts.vocab.sort_ranks(), dtype="<i8")
+	arrays["vocab"] = np.frombuffer("\n".join(counts.vocab.tokens).encode("utf-8"), dtype=np.uint8)
+	arrays["tail"] = np.ascontiguousarray(counts.tail, dtype="<i8")
+	write_arrays(path, {
+		"version": FORMAT_VERSION,
+		"max_n": counts.max_n,
+		"total_tokens": counts.total_tokens,
+		"vocab_size": len(counts.vocab),
+		"epsilon": counts.lossy.epsilon if counts.lossy else None,
+		"lossy": counts.lossy.to_json() if counts.lossy else None,
+		"source": source,
+		"appended": appended or [],
+	}, arrays)
+
+
+######## Read ########
+def load_counts(path: Path, max_n: Optional[int] = None) -> NGramCounts:
+	"""Memory-map a store; the tables stay on disk (shared through the page cache)."""
+	header, base = read_header(path)
+	max_n = max_n or header["max_n"]
+
+	def array(name: str) -> np.ndarray:
+		return map_array(path, header, base, name)
+
+	blob = array("vocab").tobytes().decode("utf-8")
+	vocab = Vocab.from_tokens(blob.split("\n") if blob else [])
+	vocab.set_ranks(array("ranks"))
+	keys = {n: array(f"keys{n}") for n in range(1, max_n + 1)}
+	counts = {n: array(f"counts{n}") for n in range(1, max_n + 1)}
+	lossy = LossyReport.from_json(header["lossy"]) if header.get("lossy") else None
+	coc = {n: (np.array(array(f"coc_r{n}")), np.array(array(f"coc_n{n}")))
+		   for n in range(1, max_n + 1) if f"coc_r{n}" in header["arrays"]}
+	return NGramCounts(vocab, keys, counts, header["total_tokens"], lossy, array("tail"), coc)
+
+
+def store_is_current(store: Path, corpus: Path, max_n: int, epsilon: Optional[float] = None) -> bool:
+	if not store.is_file():
+		return False
+	try:
+		header, _ = read_header(store)
+	except ValueError:
+		return False
+	source = header.get("source") or {}
+	if header["max_n"] < max_n or header.get("epsilon") != epsilon:
+		return False
+	st = corpus.stat()
+	if source.get("size") == st.st_size and source.get("mtime_ns") == st.st_mtime_ns:
+		return True
+	# touched or copied: fall back to the content hash
+	return source.get("size") == st.st_size and source.get("blake2b") == corpus_hash(corpus)
+
+
+######## Build Once ########
+def load_or_build(corpus: Path, max_n: int = 4, epsilon: Optional[float] = None, workers: int = 1,
+				  store: Optional[Path] = None, memory_budget: Optional[int] = None, pipeline: bool = False,
+				  monitor=None) -> NGramCounts:
+	"""Counts for `corpus`, from its store when that is current, otherwise counted and stored.
+
+	epsilon selects lossy counting for orders >= 2 (ngram_table.NGramCounter). With memory_budget
+	(bytes) set, counting is exact and serial and spills sorted runs to disk (ngram_external.py)
+	instead of holding every table in memory. pipeline selects threaded counting (ngram_pipeline.py).
+	monitor (ngram_monitor.CountingMonitor) reports progress while counting (not on a store hit).
+	"""
+	store = store or default_store_path(corpus)
+	if store_is_current(store, corpus, max_n, epsilon):
+		print(f"Loading n-gram counts from store: {store}")
+		return load_counts(store, max_n)
+	source = corpus_fingerprint(corpus)
+	if memory_budget is not None:
+		if epsilon is not None:
+			raise ValueError("memory_budget counts exactly and cannot be combined with lossy counting")
+		from ngram_external import count_ngrams_external
+		counts = count_ngrams_external(corpus, store, max_n, memory_budget, source, monitor=monitor)
+		print(f"Saved n-gram count store: {store}")
+		return counts
+	counts = count_ngrams(corpus, max_n, epsilon, workers=workers, pipeline=pipeline, monitor=monitor)
+	try:
+		save_counts(counts, store, source)
+		print(f"Saved n-gram count store: {store}")
+	except OSError as e:  # read-only corpus directory: still usable, just not cached
+		print(f"Could not write count store {store}: {e}")
+	return counts
+
+
+######## Append ########
+def appended_count_of_counts(coc: CountOfCounts, old: np.ndarray, merged: np.ndarray, moved: np.ndarray) -> CountOfCounts:
+	"""Count-of-counts after a merge, from the stored one: only rows whose count changed or that are new.
+
+	moved[i] is the merged row of stored row i (merge_tables_mapped).
+	"""
+	now = merged[moved]
+	changed = np.flatnonzero(now != old)
+	added = np.ones(len(merged), dtype=bool)
+	added[moved] = False
+	r, n_r = count_of_counts(old[changed])
+	return merge_count_of_counts([coc, (r, -n_r), count_of_counts(now[changed]), count_of_counts(merged[added])])
+
+
+def append_to_store(store: Path, new_text: Path, chunk_tokens: int = CHUNK_TOKENS) -> NGramCounts:
+	"""Count only `new_text`, as if it followed the stored stream, and merge it into the store.
+
+	A file whose content (size and blake2b; not mtime, so touching it changes nothing) is already
+	recorded in the store is not counted twice. Lossy stores stay within their bound: the new
+	tokens are counted exactly.
+	"""
+	header, _ = read_header(store)
+	base = load_counts(store)
+	fingerprint = {k: v for k, v in corpus_fingerprint(new_text).items() if k in ("size", "blake2b")}
+	if any({k: f.get(k) for k in fingerprint} == fingerprint for f in header["appended"]):
+		print(f"Already in the store: {new_text}")
+		return base
+	vocab = Vocab.from_tokens(list(base.vocab.tokens))
+	counter = NGramCounter(vocab, base.max_n)
+	counter.prime(base.tail)
+	for ids in stream_token_ids(new_text, vocab, chunk_tokens):
+		counter.update(ids)
+	delta = counter.finalize()
+	(keys, counts), moved = merge_tables_mapped((base.keys, base.counts), (delta.keys, delta.counts))  # fresh arrays
+	coc = {n: appended_count_of_counts(base.count_of_counts(n), base.counts[n], counts[n], moved[n])
+		   for n in range(1, base.max_n + 1)}
+	# delta.tail already continues the stored tail (the counter was primed with it)
+	merged = NGramCounts(vocab, keys, counts, base.total_tokens + delta.total_tokens, base.lossy, delta.tail, coc)
+	new_types = len(vocab) - len(base.vocab)
+	del base  # release the mappings before the file is replaced
+	save_counts(merged, store, header["source"], header["appended"] + [fingerprint])
+	print(f"Appended {delta.total_tokens} tokens from {new_text} ({new_types} new types)")
+	return load_counts(store)
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Build the binary n-gram count store for a corpus.")
+	ap.add_argument("corpus", type=Path)
+	ap.add_argument("--max-n", type=int, default=4)
+	ap.add_argument("--workers", type=int, default=1)
+	ap.add_argument("--store", type=Path, help="output path (default: <corpus>.ngrams)")
+	ap.add_argument("--memory-mb", type=int, help="count exactly within this budget, spilling runs to disk")
+	ap.add_argument("--epsilon", type=float, help="lossy counting for orders >= 2 with this error bound")
+	ap.add_argument("--append", type=Path, nargs="+", default=[], help="text files to count into the existing store")
+	args = ap.parse_args()
+	budget = args.memory_mb << 20 if args.memory_mb else None
+	counts = load_or_build(args.corpus, args.max_n, args.epsilon, args.workers, args.store, budget)
+	for path in args.append:
+		counts = append_to_store(args.store or default_store_path(args.corpus), path)
+	print(f"Total tokens: {counts.total_tokens}; Vocabulary size: {len(counts.vocab)}")
+	if counts.lossy:
+		print("\n".join(counts.lossy.lines()))
+	for n in range(1, counts.max_n + 1):
+		print(f"Unique {n}-grams: {counts.unique(n)} ({counts.nbytes(n) / 2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,233 @@
+"""
+Lab 4 - Suffix-Array Index (n-gram counts of any order)
+
+The per-order tables of ngram_table.py store every n-gram explicitly, so each extra order costs
+another ~16 bytes per unique n-gram. A suffix array over the corpus token ids answers the same
+questions for every n from 8 bytes per token (int32 text + int32 suffix array):
+
+  text[i]  - id of the i-th corpus token (ids of the count store's vocabulary)
+  sa[r]    - start of the r-th smallest suffix of text, comparing suffixes by token id
+			 (a suffix that runs out of tokens sorts before every longer one)
+
+All suffixes that start with w1..wn form one contiguous block sa[lo:hi], so
+  count(w1..wn) = hi - lo                     (one pair of binary searches per token)
+  c(h), c(h w)  = the block after n-1 tokens, and after n tokens
+  followers of h: text[sa[lo:hi] + |h|] is sorted, so the distinct next tokens and their counts
+				  (N1+(h•), the continuation counts of h) are one run-length pass over the block.
+Batch queries (count_many) run the binary searches for all n-grams at once, one vectorized step
+per halving, and return (c(h,w), c(h)) like NGramCounts.count_many, so score_sentences accepts the
+index in place of the tables for orders above MAX_N.
+
+Construction is prefix doubling (Manber & Myers) that only re-sorts unresolved groups (Larsson &
+Sadakane): after round r, suffixes are ranked by their first 2^r tokens and suffixes whose rank is
+already unique drop out. Natural text resolves after log2(longest repeated span) rounds; most
+suffixes leave after two or three.
+
+The index covers the corpus file only (not text appended to the store later). It is saved next to
+the count store (<corpus>.ngrams.sa, same container as ngram_store.py), memory-mapped by later runs
+and rebuilt when the store changes.
+
+Usage:
+  python ngram_suffix.py [corpus.txt] [--orders 5 6 8]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from ngram_store import default_store_path, load_or_build, map_array, read_header, store_stamp, write_arrays
+from ngram_table import NGramCounts, Vocab, stream_token_ids
+
+SA_MAGIC = b"NGRAMSA1"
+SA_VERSION = 1
+SA_SUFFIX = ".sa"
+
+
+######## Construction ########
+def suffix_array(text: np.ndarray) -> np.ndarray:
+	"""Suffix array of an int id sequence (see module docstring for the algorithm)."""
+	n = len(text)
+	sa = np.argsort(text, kind="stable").astype(np.int64)
+	# rank[i] = first position in sa of the group of suffix i; groups share their first k tokens
+	srt = text[sa]
+	start = np.flatnonzero(np.concatenate(([True], srt[1:] != srt[:-1]))) if n else np.empty(0, dtype=np.int64)
+	rank = np.empty(n + 1, dtype=np.int64)
+	rank[sa] = np.repeat(start, np.diff(np.append(start, n)))
+	rank[n] = -1  # past the end: before every token
+	k = 1
+	while True:
+		g = rank[sa]
+		same = g[1:] == g[:-1]
+		open_ = np.zeros(n, dtype=bool)
+		open_[1:] |= same
+		open_[:-1] |= same
+		pos = np.flatnonzero(open_)
+		if len(pos) == 0:
+			return sa
+		idx = sa[pos]
+		r1, r2 = rank[idx], rank[np.minimum(idx + k, n)]
+		order = np.lexsort((r2, r1))  # r1 is sorted by position, so every group stays in its block
+		idx, r1, r2 = idx[order], r1[order], r2[order]
+		sa[pos] = idx
+		new = np.ones(len(pos), dtype=bool)
+		new[1:] = (r1[1:] != r1[:-1]) | (r2[1:] != r2[:-1])
+		rank[idx] = np.maximum.accumulate(np.where(new, pos, 0))
+		k *= 2
+
+
+######## Index ########
+class SuffixIndex:
+	"""Token ids of a corpus plus their suffix array (layout in the module docstring)."""
+
+	def __init__(self, vocab: Vocab, text: np.ndarray, sa: np.ndarray):
+		self.vocab = vocab
+		self.text = text
+		self.sa = sa
+		self.total_tokens = len(text)
+
+	@classmethod
+	def build(cls, corpus: Path, vocab: Vocab) -> "SuffixIndex":
+		"""Tokenize `corpus` with `vocab` (a copy gets any new tokens) and sort its suffixes."""
+		vocab = Vocab.from_tokens(list(vocab.tokens))
+		chunks = list(stream_token_ids(corpus, vocab))
+		text = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+		sa = suffix_array(text)
+		dtype = np.int32 if len(text) < 2**31 and len(vocab) < 2**31 else np.int64
+		return cls(vocab, text.astype(dtype), sa.astype(dtype))
+
+	def _token_at(self, r: np.ndarray, j: int) -> np.ndarray:
+		"""Token j of suffix sa[r] (-1 past the end of the text)."""
+		p = self.sa[r].astype(np.int64) + j
+		inside = p < len(self.text)
+		return np.where(inside, self.text[np.where(inside, p, 0)] if len(self.text) else -1, -1)
+
+	def _bound(self, lo: np.ndarray, hi: np.ndarray, j: int, tok: np.ndarray, right: bool) -> np.ndarray:
+		"""First r in [lo, hi) whose token j is >= tok (> tok with right), per query."""
+		lo, hi = lo.copy(), hi.copy()
+		active = np.flatnonzero(lo < hi)
+		while len(active):
+			mid = (lo[active] + hi[active]) // 2
+			v = self._token_at(mid, j)
+			go = v <= tok[active] if right else v < tok[active]
+			lo[active] = np.where(go, mid + 1, lo[active])
+			hi[active] = np.where(go, hi[active], mid)
+			active = active[lo[active] < hi[active]]
+		return lo
+
+	def ranges(self, grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+		"""Blocks sa[lo:hi] of an (m, n) array of n-gram ids; also returns the hi - lo after n - 1 tokens."""
+		grams = np.asarray(grams, dtype=np.int64)
+		m, n = grams.shape
+		lo = np.zeros(m, dtype=np.int64)
+		hi = np.full(m, len(self.text), dtype=np.int64)
+		prev = hi - lo
+		for j in range(n):
+			prev = hi - lo
+			tok = grams[:, j]
+			hi = np.where(tok >= 0, hi, lo)  # unknown token: empty block (-1 is also the end marker)
+			lo, hi = self._bound(lo, hi, j, tok, False), self._bound(lo, hi, j, tok, True)
+		return lo, hi, prev
+
+	def count_many(self, grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		"""(c(h,w), c(h)) for an (m, n) array of n-gram ids; c(h) of a unigram is total_tokens."""
+		lo, hi, prev = self.ranges(grams)
+		return hi - lo, prev
+
+	def count(self, gram_ids: Sequence[int]) -> int:
+		return int(self.count_many(np.asarray([gram_ids], dtype=np.int64))[0][0])
+
+	def continuations(self, history: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+		"""(follower ids, counts) of every token seen after `history`, ids ascending.
+
+		len(ids) is N1+(h•); an empty history gives the unigram counts.
+		"""
+		if len(history):
+			lo, hi, _ = self.ranges(np.asarray([history], dtype=np.int64))
+			lo, hi = int(lo[0]), int(hi[0])
+		else:
+			lo, hi = 0, len(self.text)
+		nxt = self._token_at(np.arange(lo, hi), len(history))
+		nxt = nxt[nxt >= 0]  # the block's one suffix that ends right after the history, if any
+		if len(nxt) == 0:
+			return nxt, np.empty(0, dtype=np.int64)
+		start = np.flatnonzero(np.concatenate(([True], nxt[1:] != nxt[:-1])))
+		return nxt[start], np.diff(np.append(start, len(nxt)))
+
+	def nbytes(self) -> int:
+		return int(self.text.nbytes + self.sa.nbytes)
+
+
+######## Store ########
+def default_sa_path(store: Path) -> Path:
+	return store.with_name(store.name + SA_SUFFIX)
+
+
+def save_suffix_index(index: SuffixIndex, path: Path, store: Path):
+	write_arrays(path, {
+		"version": SA_VERSION,
+		"total_tokens": index.total_tokens,
+		"vocab_size": len(index.vocab),
+		"store": store_stamp(store),
+	}, {"text": np.ascontiguousarray(index.text, dtype=index.text.dtype.newbyteorder("<")),
+		"sa": np.ascontiguousarray(index.sa, dtype=index.sa.dtype.newbyteorder("<"))}, SA_MAGIC)
+
+
+def load_suffix_index(path: Path, vocab: Vocab) -> SuffixIndex:
+	header, base = read_header(path, SA_MAGIC, SA_VERSION)
+	if header["vocab_size"] > len(vocab):
+		raise ValueError(f"{path} was built with a larger vocabulary than the store's")
+	return SuffixIndex(vocab, map_array(path, header, base, "text"), map_array(path, header, base, "sa"))
+
+
+def load_or_build_suffix_index(corpus: Path, counts: NGramCounts, store: Optional[Path] = None) -> SuffixIndex:
+	"""Memory-map the index saved next to the store, or build and save it if the store changed."""
+	store = store or default_store_path(corpus)
+	path = default_sa_path(store)
+	if path.is_file() and store.is_file():
+		try:
+			header, _ = read_header(path, SA_MAGIC, SA_VERSION)
+			if header["store"] == store_stamp(store):
+				return load_suffix_index(path, counts.vocab)
+		except (ValueError, KeyError, OSError):
+			pass
+	index = SuffixIndex.build(corpus, counts.vocab)
+	if store.is_file():
+		save_suffix_index(index, path, store)
+		index = load_suffix_index(path, index.vocab)
+	return index
+
+
+def main():
+	from ngram_scoring import score_sentences
+	from q3 import ADD_K, INPUT_FILENAME, MAX_N, SENTENCE_FILE, find_file, read_sentences
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	ap.add_argument("--orders", type=int, nargs="+", default=[2, 4, 6, 8], help="orders to score q3_data.txt with")
+	args = ap.parse_args()
+
+	corpus = args.corpus or find_file(INPUT_FILENAME)
+	counts = load_or_build(corpus, MAX_N)
+	t0 = time.perf_counter()
+	index = load_or_build_suffix_index(corpus, counts)
+	print(f"Suffix array: {index.total_tokens} tokens, {index.nbytes() / 2**20:.1f} MB ({time.perf_counter() - t0:.2f} s); "
+		  f"tables n=1..{counts.max_n}: {sum(counts.nbytes(n) for n in range(1, counts.max_n + 1)) / 2**20:.1f} MB")
+
+	sentences = [toks for _, toks in read_sentences(find_file(SENTENCE_FILE))]
+	n_tokens = sum(len(t) for t in sentences)
+	t0 = time.perf_counter()
+	scores = score_sentences(sentences, args.orders, index, len(counts.vocab), ADD_K)
+	print(f"Scored {len(sentences)} sentences at orders {args.orders} in {time.perf_counter() - t0:.2f} s")
+	print(f"{'n':>3} {'Add-One':>12} {f'Add-{ADD_K}':>12}")
+	for n in args.orders:
+		perps = [10 ** (-float(scores[n][c].sum()) / n_tokens) if n_tokens else 0.0 for c in ("add1_log10", "addK_log10")]
+		print(f"{n:>3} " + " ".join(f"{p:>12.2f}" for p in perps))
+
+
+if __name__ == "__main__":
+	main()
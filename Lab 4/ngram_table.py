@@ -0,0 +1,774 @@
+"""
+Lab 4 - Integer-ID N‑gram Tables (shared by q1, q2, q3)
+
+Tokens are mapped to dense integer ids while streaming, and every n-gram order is kept
+as a sorted uint64 key array with a parallel int64 count array:
+
+  * order 1:  key = token id
+  * order n:  key = (row of the (n-1)-gram prefix in table n-1) << 32 | id of last token
+
+A prefix row index grows with the prefix's lexicographic id order, so order-n keys sort
+lexicographically by id tuple. Two consequences we rely on everywhere:
+  * c(h) for row i of order n is just counts[n-1][keys[n][i] >> 32] (no lookup at all)
+  * finding an n-gram costs one binary search per order.
+
+Tokenizing is bulk: the corpus is read in large binary blocks cut at a line (or whitespace)
+boundary, each block is decoded and split in one call, and Vocab.add_many maps the whole block to
+ids with one dict lookup per token (new tokens, rare after the first blocks, take the slow path).
+
+Counting works on chunks of token ids. Each chunk becomes a small sorted table and
+tables are merged pairwise (log-structured), so the working set is ~24 bytes per unique
+n-gram instead of a tuple of str plus a dict slot. Strings only come back in the writers.
+
+Rows with count 0 can appear in intermediate tables: they are prefixes kept so that a
+higher-order row can point at them (chunk boundaries, lossy counting). Writers skip them.
+
+Every finished table also carries its count-of-counts N_r per order (how many n-grams occur exactly
+r times), taken once when counting ends and kept in the store, so frequency-of-frequency
+smoothers (Good-Turing, Kneser-Ney discounts) and diagnostics never rescan the tables.
+"""
+
+from __future__ import annotations
+
+import math
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ID_BITS = 32
+KEY_SHIFT = np.uint64(ID_BITS)
+ID_MASK = np.uint64((1 << ID_BITS) - 1)
+CHUNK_TOKENS = 1 << 18       # token ids per counting chunk
+READ_BYTES = 1 << 22         # bytes per read when tokenizing
+
+Tables = Tuple[Dict[int, np.ndarray], Dict[int, np.ndarray]]  # (keys by order, counts by order)
+CountOfCounts = Tuple[np.ndarray, np.ndarray]  # (r ascending, N_r) for every r >= 1 that occurs
+
+
+######## Streaming ########
+def read_byte_blocks(path: Path, block_bytes: int = READ_BYTES) -> Iterator[bytes]:
+	"""Raw blocks of about block_bytes, each ending at a line break (or other ASCII whitespace).
+
+	Splitting the decoded blocks gives the same tokens as splitting the file line by line: a cut
+	at an ASCII byte never falls inside a UTF-8 sequence.
+	"""
+	rest = b""
+	with path.open("rb") as f:
+		while True:
+			block = f.read(block_bytes)
+			if not block:
+				break
+			data = rest + block
+			cut = data.rfind(b"\n")
+			if cut < 0:  # one very long line
+				cut = max(data.rfind(b" "), data.rfind(b"\t"), data.rfind(b"\r"))
+			if cut < 0:
+				rest = data
+				continue
+			rest = data[cut + 1:]
+			yield data[:cut + 1]
+	if rest:
+		yield rest
+
+
+def read_text_blocks(path: Path, block_bytes: int = READ_BYTES) -> Iterator[str]:
+	for data in read_byte_blocks(path, block_bytes):
+		yield data.decode("utf-8", errors="ignore")
+
+
+def stream_tokens(path: Path) -> Iterator[str]:
+	"""Tokens one at a time (compatibility wrapper; counting uses stream_token_ids)."""
+	for text in read_text_blocks(path):
+		yield from text.split()
+
+
+class Vocab:
+	"""Dense token <-> id mapping; ids are handed out in first-seen order."""
+
+	def __init__(self, tokens: Iterable[str] = ()):
+		self.tokens: List[str] = []
+		self._ids: Dict[str, int] = {}
+		self._ranks: Optional[np.ndarray] = None
+		for tok in tokens:
+			self.add(tok)
+
+	@classmethod
+	def from_tokens(cls, tokens: List[str]) -> "Vocab":
+		"""Rebuild a vocabulary whose ids are the list positions (tokens must be unique)."""
+		vocab = cls()
+		vocab.tokens = tokens
+		vocab._ids = dict(zip(tokens, range(len(tokens))))
+		return vocab
+
+	def __len__(self) -> int:
+		return len(self.tokens)
+
+	def add(self, tok: str) -> int:
+		i = self._ids.get(tok)
+		if i is None:
+			i = len(self.tokens)
+			if i > int(ID_MASK):
+				raise OverflowError(f"vocabulary exceeds {ID_BITS}-bit token ids")
+			self._ids[tok] = i
+			self.tokens.append(tok)
+			self._ranks = None
+		return i
+
+	def add_many(self, toks: List[str]) -> np.ndarray:
+		"""Ids of a batch of tokens as an int64 array, adding new ones in order (like add per token)."""
+		ids = self.encode_array(toks)
+		return self.add_missing(ids, unknown_tokens(toks, ids))
+
+	def encode_array(self, toks: List[str]) -> np.ndarray:
+		"""encode() as an int64 array. Only reads the mapping, so other threads may run it during add()."""
+		return np.fromiter(map(self._ids.get, toks, repeat(-1)), dtype=np.int64, count=len(toks))
+
+	def add_missing(self, ids: np.ndarray, missing: List[str]) -> np.ndarray:
+		"""Fill the -1 entries of ids (from encode_array) with the ids of `missing`, the tokens at those
+		positions, adding new ones in order; returns ids."""
+		new = np.flatnonzero(ids < 0)
+		if len(new):
+			for tok in dict.fromkeys(missing):  # distinct, in first-seen order
+				self.add(tok)
+			ids[new] = np.fromiter(map(self._ids.__getitem__, missing), dtype=np.int64, count=len(missing))
+		return ids
+
+	def get(self, tok: str, default: int = -1) -> int:
+		return self._ids.get(tok, default)
+
+	def encode(self, toks: Iterable[str]) -> List[int]:
+		"""Ids for known tokens, -1 for out-of-vocabulary ones."""
+		get = self._ids.get
+		return [get(t, -1) for t in toks]
+
+	def decode(self, ids: Iterable[int]) -> List[str]:
+		return [self.tokens[i] for i in ids]
+
+	def set_ranks(self, ranks: np.ndarray):
+		"""Reuse sort ranks computed earlier (e.g. stored alongside the tables)."""
+		self._ranks = ranks
+
+	def sort_ranks(self) -> np.ndarray:
+		"""rank[id] = position of the token in Python string order (same order as tuple-of-str sorting)."""
+		if self._ranks is None or len(self._ranks) != len(self.tokens):
+			order = sorted(range(len(self.tokens)), key=self.tokens.__getitem__)
+			ranks = np.empty(len(order), dtype=np.int64)
+			ranks[np.asarray(order, dtype=np.int64)] = np.arange(len(order), dtype=np.int64)
+			self._ranks = ranks
+		return self._ranks
+
+
+def unknown_tokens(toks: List[str], ids: np.ndarray) -> List[str]:
+	"""The tokens encode_array left at -1, in order (what add_missing needs)."""
+	return [toks[i] for i in np.flatnonzero(ids < 0).tolist()]
+
+
+def stream_token_ids(path: Path, vocab: Vocab, chunk_tokens: int = CHUNK_TOKENS) -> Iterator[np.ndarray]:
+	"""Yield int64 arrays of chunk_tokens token ids (the last one shorter), assigning new ids in `vocab`."""
+	parts: List[np.ndarray] = []
+	have = 0
+	for text in read_text_blocks(path):
+		ids = vocab.add_many(text.split())
+		parts.append(ids)
+		have += len(ids)
+		while have >= chunk_tokens:
+			ids = np.concatenate(parts) if len(parts) > 1 else parts[0]
+			yield ids[:chunk_tokens]
+			parts = [ids[chunk_tokens:]]
+			have -= chunk_tokens
+	if have:
+		yield np.concatenate(parts)
+
+
+######## Table Primitives ########
+def _sum_by_key(keys: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""Return (unique sorted keys, summed weights, inverse index of every input key)."""
+	if len(keys) == 0:
+		return keys.astype(np.uint64), weights.astype(np.int64), np.empty(0, dtype=np.int64)
+	order = np.argsort(keys, kind="stable")
+	sk = keys[order]
+	first = np.empty(len(sk), dtype=bool)
+	first[0] = True
+	np.not_equal(sk[1:], sk[:-1], out=first[1:])
+	starts = np.flatnonzero(first)
+	summed = np.add.reduceat(weights[order], starts).astype(np.int64, copy=False)
+	inv = np.empty(len(keys), dtype=np.int64)
+	inv[order] = np.cumsum(first) - 1
+	return sk[starts], summed, inv
+
+
+def _encode_chunk(x: np.ndarray, s: int, max_n: int) -> Tables:
+	"""Count the n-grams ending in x[s:]; x[:s] is the carried tail of the previous chunk.
+
+	Order n covers positions p >= a1 + n - 1. Positions inside the tail get weight 0:
+	they are only there so the first new n-grams have a prefix row to point at.
+	"""
+	keys: Dict[int, np.ndarray] = {}
+	counts: Dict[int, np.ndarray] = {}
+	a1 = max(0, s - (max_n - 1))
+	xu = x.astype(np.uint64)
+	inv_prev = None
+	for n in range(1, max_n + 1):
+		a = a1 + n - 1
+		if n == 1:
+			k = xu[a:]
+		else:
+			k = (inv_prev[:-1].astype(np.uint64) << KEY_SHIFT) | xu[a:]
+		w = np.ones(len(k), dtype=np.int64)
+		w[:max(0, s - a)] = 0
+		keys[n], counts[n], inv_prev = _sum_by_key(k, w)
+	return keys, counts
+
+
+def _merge_sorted(ka: np.ndarray, ca: np.ndarray, kb: np.ndarray, cb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""Union of two sorted unique key arrays; returns (keys, counts, rows of a, rows of b)."""
+	pos = np.searchsorted(ka, kb)
+	hit = pos < len(ka)
+	hit[hit] = ka[pos[hit]] == kb[hit]
+	new_pos = pos[~hit]
+	# every a row moves down by the number of new b keys inserted before it
+	map_a = np.arange(len(ka), dtype=np.int64)
+	map_a += np.searchsorted(new_pos, map_a, side="right")
+	map_b = np.empty(len(kb), dtype=np.int64)
+	map_b[hit] = map_a[pos[hit]]
+	map_b[~hit] = new_pos + np.arange(len(new_pos), dtype=np.int64)
+	del pos, new_pos
+	keys = np.empty(len(ka) + len(kb) - int(np.count_nonzero(hit)), dtype=np.uint64)
+	keys[map_a] = ka
+	keys[map_b] = kb
+	counts = np.zeros(len(keys), dtype=np.int64)
+	counts[map_a] = ca
+	counts[map_b] += cb
+	return keys, counts, map_a, map_b
+
+
+def merge_tables_mapped(a: Tables, b: Tables) -> Tuple[Tables, Dict[int, np.ndarray]]:
+	"""merge_tables, also returning where every row of `a` ended up (per order)."""
+	ka_all, ca_all = a
+	kb_all, cb_all = b
+	keys: Dict[int, np.ndarray] = {}
+	counts: Dict[int, np.ndarray] = {}
+	maps: Dict[int, np.ndarray] = {}
+	map_a = map_b = None
+	for n in sorted(ka_all):
+		ka, kb = ka_all[n], kb_all[n]
+		if n > 1:
+			# re-point prefixes at their rows in the merged (n-1) table; the mapping is monotone
+			ka = (map_a[ka >> KEY_SHIFT].astype(np.uint64) << KEY_SHIFT) | (ka & ID_MASK)
+			kb = (map_b[kb >> KEY_SHIFT].astype(np.uint64) << KEY_SHIFT) | (kb & ID_MASK)
+		keys[n], counts[n], map_a, map_b = _merge_sorted(ka, ca_all[n], kb, cb_all[n])
+		maps[n] = map_a
+	return (keys, counts), maps
+
+
+def merge_tables(a: Tables, b: Tables) -> Tables:
+	"""Merge two tables built over the same vocabulary, summing counts."""
+	return merge_tables_mapped(a, b)[0]
+
+
+def remap_ids(tables: Tables, id_map: np.ndarray) -> Tables:
+	"""Rewrite a table onto another vocabulary: token id i becomes id_map[i]."""
+	keys_in, counts_in = tables
+	keys: Dict[int, np.ndarray] = {}
+	counts: Dict[int, np.ndarray] = {}
+	id_map = np.asarray(id_map, dtype=np.uint64)
+	row_map = None
+	for n in sorted(keys_in):
+		k = keys_in[n]
+		if n == 1:
+			k = id_map[k.astype(np.int64)]
+		else:
+			k = (row_map[k >> KEY_SHIFT].astype(np.uint64) << KEY_SHIFT) | id_map[(k & ID_MASK).astype(np.int64)]
+		order = np.argsort(k, kind="stable")
+		keys[n], counts[n] = k[order], counts_in[n][order]
+		row_map = np.empty(len(order), dtype=np.int64)
+		row_map[order] = np.arange(len(order), dtype=np.int64)
+	return keys, counts
+
+
+def table_cuts(keys: Dict[int, np.ndarray], id_bounds: Sequence[int]) -> Dict[int, np.ndarray]:
+	"""Per order, the first row whose first-token id is >= each of the (ascending) id_bounds.
+
+	Only binary searches on the key arrays, so memory-mapped tables are not read in full.
+	"""
+	cuts: Dict[int, np.ndarray] = {}
+	prev = None
+	for n in sorted(keys):
+		q = np.asarray(id_bounds, dtype=np.uint64) if n == 1 else prev.astype(np.uint64) << KEY_SHIFT
+		prev = cuts[n] = keys[n].searchsorted(q)
+	return cuts
+
+
+def split_tables(tables: Tables, id_bounds: Sequence[int]) -> List[Tables]:
+	"""Cut a table into parts by first-token id range [id_bounds[i], id_bounds[i+1]).
+
+	Rows sort by id tuple, so every part is a contiguous block of rows in every order.
+	"""
+	keys, counts = tables
+	cuts = table_cuts(keys, id_bounds)
+	parts: List[Tables] = [({}, {}) for _ in range(len(id_bounds) - 1)]
+	for n in sorted(keys):
+		k = keys[n]
+		for i, (lo, hi) in enumerate(zip(cuts[n][:-1], cuts[n][1:])):
+			part = k[lo:hi]
+			if n > 1:
+				part = part - (np.uint64(cuts[n - 1][i]) << KEY_SHIFT)  # prefix rows relative to the part
+			parts[i][0][n], parts[i][1][n] = part, counts[n][lo:hi]
+	return parts
+
+
+def concat_tables(parts: Sequence[Tables]) -> Tables:
+	"""Inverse of split_tables: stack parts that cover increasing first-token id ranges."""
+	keys: Dict[int, np.ndarray] = {}
+	counts: Dict[int, np.ndarray] = {}
+	offsets = None
+	for n in sorted(parts[0][0]):
+		pieces = [p[0][n] for p in parts]
+		if n > 1:
+			pieces = [k + (np.uint64(off) << KEY_SHIFT) for k, off in zip(pieces, offsets)]
+		keys[n] = np.concatenate(pieces)
+		counts[n] = np.concatenate([p[1][n] for p in parts])
+		offsets = np.concatenate(([0], np.cumsum([len(p[0][n]) for p in parts])[:-1]))
+	return keys, counts
+
+
+def merge_all(parts: List[Tables]) -> Tables:
+	"""Merge any number of tables pairwise (a balanced k-way merge)."""
+	while len(parts) > 1:
+		parts = [merge_tables(parts[i], parts[i + 1]) if i + 1 < len(parts) else parts[i] for i in range(0, len(parts), 2)]
+	return parts[0]
+
+
+def table_nbytes(tables: Tables) -> int:
+	return sum(int(k.nbytes + c.nbytes) for k, c in zip(tables[0].values(), tables[1].values()))
+
+
+def tables_from_grams(grams: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> Tables:
+	"""Build tables from explicit n-grams: {n: ((m, n) id matrix, counts)} for n = 1..max_n.
+
+	Prefixes that are not listed themselves become count-0 rows, as in counted tables.
+	"""
+	max_n = max(grams)
+	need = {n: np.asarray(grams[n][0], dtype=np.int64).reshape(-1, n) for n in grams}
+	for n in range(max_n, 1, -1):
+		need[n - 1] = np.concatenate((need[n - 1], need[n][:, :-1]))
+	keys: Dict[int, np.ndarray] = {}
+	counts: Dict[int, np.ndarray] = {}
+
+	def key_of(ids: np.ndarray) -> np.ndarray:
+		k = ids[:, 0].astype(np.uint64)
+		for j in range(1, ids.shape[1]):
+			k = (keys[j].searchsorted(k).astype(np.uint64) << KEY_SHIFT) | ids[:, j].astype(np.uint64)
+		return k
+
+	for n in range(1, max_n + 1):
+		keys[n] = np.unique(key_of(need[n]))
+		counts[n] = np.zeros(len(keys[n]), dtype=np.int64)
+		ids, c = grams[n]
+		counts[n][keys[n].searchsorted(key_of(np.asarray(ids, dtype=np.int64).reshape(-1, n)))] = c
+	return keys, counts
+
+
+def live_rows(tables: Tables) -> Dict[int, np.ndarray]:
+	"""Per order, a mask of the rows with a count plus the prefix rows that live rows point at."""
+	keys, counts = tables
+	live: Dict[int, np.ndarray] = {}
+	referenced = None
+	for n in range(max(keys), 0, -1):
+		keep = counts[n] > 0
+		if referenced is not None:
+			keep |= referenced
+		if n > 1:
+			referenced = np.zeros(len(keys[n - 1]), dtype=bool)
+			referenced[(keys[n][keep] >> KEY_SHIFT).astype(np.int64)] = True
+		live[n] = keep
+	return live
+
+
+def compact_tables(tables: Tables, keep: Optional[Dict[int, np.ndarray]] = None) -> Tables:
+	"""Drop the rows outside `keep` (default: live_rows), renumbering prefixes."""
+	keep = keep or live_rows(tables)
+	keys, counts = dict(tables[0]), dict(tables[1])
+	for n in sorted(keys):
+		if n > 1:
+			new_row = np.cumsum(keep[n - 1]) - 1
+			k = keys[n]
+			keys[n] = (new_row[k >> KEY_SHIFT].astype(np.uint64) << KEY_SHIFT) | (k & ID_MASK)
+		keys[n], counts[n] = keys[n][keep[n]], counts[n][keep[n]]
+	return keys, counts
+
+
+######## Count-of-Counts ########
+def count_of_counts(c: np.ndarray) -> CountOfCounts:
+	"""(r, N_r) of a count array: N_r rows have count exactly r (count-0 placeholder rows are left out)."""
+	c = np.asarray(c, dtype=np.int64)
+	c = c[c > 0]
+	if len(c) == 0:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+	if int(c.max()) <= 4 * len(c) + 1024:  # dense enough for one bincount
+		n_r = np.bincount(c)
+		r = np.flatnonzero(n_r)
+		return r.astype(np.int64), n_r[r].astype(np.int64)
+	r, n_r = np.unique(c, return_counts=True)
+	return r.astype(np.int64), n_r.astype(np.int64)
+
+
+def merge_count_of_counts(parts: Sequence[CountOfCounts]) -> CountOfCounts:
+	"""Sum histograms (negative N_r take rows out), e.g. of tables over disjoint key ranges."""
+	if not parts:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+	r, inv = np.unique(np.concatenate([p[0] for p in parts]), return_inverse=True)
+	n_r = np.zeros(len(r), dtype=np.int64)
+	np.add.at(n_r, inv, np.concatenate([p[1] for p in parts]).astype(np.int64))
+	keep = n_r != 0
+	return r[keep].astype(np.int64), n_r[keep]
+
+
+######## Counting ########
+class LossyReport:
+	"""What lossy counting gave up, per order n >= 2 (unigrams are always exact)."""
+
+	def __init__(self, epsilon: float, max_n: int):
+		self.epsilon = epsilon
+		self.dropped = {n: 0 for n in range(2, max_n + 1)}        # table entries deleted
+		self.dropped_count = {n: 0 for n in range(2, max_n + 1)}  # occurrences deleted with them
+		self.undercount_bound = 0  # no kept count is low by more than this (<= epsilon * tokens)
+
+	def merge(self, other: "LossyReport"):
+		"""Add up the reports of disjoint streams (e.g. shards); their bounds add up too."""
+		for n in self.dropped:
+			self.dropped[n] += other.dropped[n]
+			self.dropped_count[n] += other.dropped_count[n]
+		self.undercount_bound += other.undercount_bound
+
+	def to_json(self) -> Dict[str, object]:
+		return {"epsilon": self.epsilon, "undercount_bound": self.undercount_bound,
+				"dropped": {str(n): d for n, d in self.dropped.items()},
+				"dropped_count": {str(n): d for n, d in self.dropped_count.items()}}
+
+	@classmethod
+	def from_json(cls, data: Dict[str, object]) -> "LossyReport":
+		report = cls(data["epsilon"], 1)
+		report.undercount_bound = data["undercount_bound"]
+		report.dropped = {int(n): d for n, d in data["dropped"].items()}
+		report.dropped_count = {int(n): d for n, d in data["dropped_count"].items()}
+		return report
+
+	def lines(self) -> List[str]:
+		out = [f"Lossy counting (epsilon = {self.epsilon:g}): every kept count is low by at most "
+			   f"{self.undercount_bound}; n-grams seen more often than that are all kept"]
+		for n in self.dropped:
+			out.append(f"  {n}-grams: {self.dropped[n]} entries dropped ({self.dropped_count[n]} occurrences)")
+		return out
+
+
+class NGramCounter:
+	"""Streaming n-gram counter over token-id chunks.
+
+	With epsilon set, orders n >= 2 use lossy counting (Manku & Motwani) instead of exact
+	counting. The stream is cut into buckets of ceil(1/epsilon) tokens. Every row carries
+	delta = buckets completed when it was (re)inserted, which bounds what it missed while absent.
+	Whenever a chunk completes a bucket, rows with count + delta <= buckets completed are deleted.
+	That is one vectorized pass per bucket, amortized O(1) per token. Kept counts are low by at
+	most epsilon * tokens, and every n-gram occurring more often than that is kept.
+
+	A monitor (ngram_monitor.CountingMonitor) is ticked after every chunk and gets the final counts.
+	"""
+
+	def __init__(self, vocab: Vocab, max_n: int = 4, epsilon: Optional[float] = None, monitor=None):
+		self.vocab = vocab
+		self.max_n = max_n
+		self.epsilon = epsilon
+		self.monitor = monitor
+		if monitor is not None:
+			monitor.start()  # count from here, not from when the monitor was built (corpus hashing etc.)
+		self.total_tokens = 0
+		self._tail = np.empty(0, dtype=np.int64)
+		self._runs: List[Tables] = []
+		if epsilon is not None:
+			self.bucket_width = math.ceil(1 / epsilon)
+			self.lossy = LossyReport(epsilon, max_n)
+			self._bucket = 0                          # buckets completed at the last prune
+			self._delta: Dict[int, np.ndarray] = {}   # per-row delta, aligned with the single run
+
+	def prime(self, ids: np.ndarray):
+		"""Set the history carried into the first chunk (tokens preceding this stream) without counting it."""
+		ids = np.asarray(ids, dtype=np.int64)
+		self._tail = ids[max(0, len(ids) - (self.max_n - 1)):] if self.max_n > 1 else ids[:0]
+
+	def update(self, ids: np.ndarray):
+		if len(ids) == 0:
+			return
+		x = np.concatenate((self._tail, np.asarray(ids, dtype=np.int64)))
+		self.total_tokens += len(ids)
+		self._push(_encode_chunk(x, len(self._tail), self.max_n))
+		self._tail = x[max(0, len(x) - (self.max_n - 1)):] if self.max_n > 1 else x[:0]
+		if self.monitor is not None:
+			self.monitor.tick(self)
+
+	def add_tables(self, tables: Tables, n_tokens: int):
+		"""Fold in a table counted elsewhere (e.g. a shard) over this counter's vocabulary."""
+		self.total_tokens += n_tokens
+		self._push(tables)
+
+	def table_stats(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+		"""(rows, bytes) per order held right now; rows bound the unique n-grams while runs are pending."""
+		rows = {n: sum(len(keys[n]) for keys, _ in self._runs) for n in range(1, self.max_n + 1)}
+		nbytes = {n: sum(int(keys[n].nbytes + counts[n].nbytes) for keys, counts in self._runs)
+				  for n in range(1, self.max_n + 1)}
+		if self.epsilon is not None:
+			for n, delta in self._delta.items():
+				nbytes[n] += int(delta.nbytes)
+		return rows, nbytes
+
+	def _push(self, run: Tables):
+		runs = self._runs
+		if self.epsilon is not None:
+			self._push_lossy(run)
+			return
+		runs.append(run)
+		# log-structured merging: fold the newest run in while the one below is not much bigger
+		while len(runs) > 1 and len(runs[-2][0][self.max_n]) <= 2 * len(runs[-1][0][self.max_n]):
+			b = runs.pop()
+			runs[-1] = merge_tables(runs[-1], b)
+
+	def _push_lossy(self, run: Tables):
+		if self._runs:
+			merged, maps = merge_tables_mapped(self._runs[0], run)
+		else:
+			merged, maps = run, {n: np.empty(0, dtype=np.int64) for n in run[0]}
+		for n in range(2, self.max_n + 1):
+			delta = np.full(len(merged[0][n]), self._bucket, dtype=np.int64)  # new rows
+			if n in self._delta:
+				delta[maps[n]] = self._delta[n]
+			self._delta[n] = delta
+		self._runs = [merged]
+		bucket = self.total_tokens // self.bucket_width
+		if bucket > self._bucket:
+			self._bucket = bucket
+			self._prune_lossy()
+
+	def _prune_lossy(self):
+		keys, counts = self._runs[0]
+		counts = dict(counts)
+		b = self._bucket
+		referenced = None
+		for n in range(self.max_n, 1, -1):
+			c = counts[n]
+			drop = (c > 0) & (c + self._delta[n] <= b)
+			if referenced is not None:
+				drop &= ~referenced  # a prefix of a kept row keeps its count (c(h) >= c(h,w))
+			self.lossy.dropped[n] += int(np.count_nonzero(drop))
+			self.lossy.dropped_count[n] += int(c[drop].sum())
+			counts[n] = np.where(drop, 0, c)
+			keep = (counts[n] > 0) | (referenced if referenced is not None else False)
+			referenced = np.zeros(len(keys[n - 1]), dtype=bool)
+			referenced[(keys[n][keep] >> KEY_SHIFT).astype(np.int64)] = True
+		keep = live_rows((keys, counts))
+		self._runs = [compact_tables((keys, counts), keep)]
+		for n in range(2, self.max_n + 1):
+			self._delta[n] = self._delta[n][keep[n]]
+		self.lossy.undercount_bound = b
+
+	def finalize(self) -> "NGramCounts":
+		runs = self._runs
+		while len(runs) > 1:
+			b = runs.pop()
+			runs[-1] = merge_tables(runs[-1], b)
+		if runs:
+			keys, counts = runs[0]
+		else:
+			keys = {n: np.empty(0, dtype=np.uint64) for n in range(1, self.max_n + 1)}
+			counts = {n: np.empty(0, dtype=np.int64) for n in range(1, self.max_n + 1)}
+		lossy = self.lossy if self.epsilon is not None else None
+		coc = {n: count_of_counts(counts[n]) for n in counts}
+		result = NGramCounts(self.vocab, keys, counts, self.total_tokens, lossy, self._tail.copy(), coc)
+		if self.monitor is not None:
+			self.monitor.finish(result)
+		return result
+
+
+def count_ngrams(path: Path, max_n: int = 4, epsilon: Optional[float] = None,
+				 chunk_tokens: int = CHUNK_TOKENS, workers: int = 1, pipeline: bool = False,
+				 monitor=None) -> "NGramCounts":
+	"""Count n-grams of orders 1..max_n; workers > 1 counts byte-range shards in a process pool.
+
+	epsilon switches orders n >= 2 to lossy counting (see NGramCounter). pipeline overlaps reading,
+	tokenizing and counting in threads (ngram_pipeline.py) and prints its per-stage utilization.
+	monitor (ngram_monitor.CountingMonitor) gets periodic progress snapshots (with workers > 1,
+	only the final one).
+	"""
+	if workers > 1 and pipeline:
+		raise ValueError("pipeline counts in one process and cannot be combined with workers > 1")
+	if pipeline:
+		from ngram_pipeline import count_ngrams_pipelined
+		counts, report = count_ngrams_pipelined(path, max_n, epsilon, chunk_tokens, monitor=monitor)
+		print("\n".join(report.lines()))
+		return counts
+	if workers > 1:
+		from ngram_parallel import count_ngrams_parallel
+		if monitor is not None:
+			monitor.start()
+		counts = count_ngrams_parallel(path, max_n, workers, epsilon=epsilon, chunk_tokens=chunk_tokens)
+		if monitor is not None:
+			monitor.finish(counts)
+		return counts
+	vocab = Vocab()
+	counter = NGramCounter(vocab, max_n, epsilon, monitor)
+	for ids in stream_token_ids(path, vocab, chunk_tokens):
+		counter.update(ids)
+	return counter.finalize()
+
+
+######## Query / Decode ########
+class NGramCounts:
+	"""Finalized per-order tables (see module docstring for the key layout)."""
+
+	def __init__(self, vocab: Vocab, keys: Dict[int, np.ndarray], counts: Dict[int, np.ndarray], total_tokens: int,
+				 lossy: Optional[LossyReport] = None, tail: Optional[np.ndarray] = None,
+				 coc: Optional[Dict[int, CountOfCounts]] = None):
+		self.vocab = vocab
+		self.keys = keys
+		self.counts = counts
+		self.total_tokens = total_tokens
+		self.lossy = lossy  # set when the counts come from lossy counting
+		# last max_n - 1 token ids of the counted stream: the context an appended stream continues from
+		self.tail = np.empty(0, dtype=np.int64) if tail is None else np.asarray(tail, dtype=np.int64)
+		self.max_n = len(keys)
+		self._sorted: Dict[int, np.ndarray] = {}
+		self._coc: Dict[int, CountOfCounts] = dict(coc or {})
+		self.bloom: Optional[Dict[int, object]] = None  # per-order key filters (ngram_bloom.py), checked by lookup
+
+	def unique(self, n: int) -> int:
+		return int(np.count_nonzero(self.counts[n]))
+
+	def count_of_counts(self, n: int) -> CountOfCounts:
+		"""(r, N_r) of table n, as kept by counting (computed here only for tables that came without it)."""
+		if n not in self._coc:
+			self._coc[n] = count_of_counts(self.counts[n])
+		return self._coc[n]
+
+	def _child(self, n: int, row: int, tok: int) -> int:
+		"""Row in table n of (n-1)-gram row `row` extended by `tok` (row is ignored for n = 1), or -1."""
+		key = np.uint64(tok if n == 1 else (row << ID_BITS) | tok)
+		keys = self.keys[n]
+		i = int(keys.searchsorted(key))  # the method skips np.searchsorted's dispatch overhead
+		return i if i < len(keys) and keys[i] == key else -1
+
+	def index(self, gram_ids: Sequence[int]) -> int:
+		"""Row of the n-gram in table len(gram_ids), or -1 if it was never seen."""
+		row = 0
+		for n, tok in enumerate(gram_ids, 1):
+			if tok < 0:
+				return -1
+			row = self._child(n, row, tok)
+			if row < 0:
+				return -1
+		return row
+
+	def count(self, gram_ids: Sequence[int]) -> int:
+		i = self.index(gram_ids)
+		return int(self.counts[len(gram_ids)][i]) if i >= 0 else 0
+
+	def count_pair(self, gram_ids: Sequence[int]) -> Tuple[int, int]:
+		"""(c(h,w), c(h)) from a single walk; c(h) of a unigram is total_tokens."""
+		n = len(gram_ids)
+		if n == 1:
+			return self.count(gram_ids), self.total_tokens
+		h = self.index(gram_ids[:-1])
+		if h < 0:
+			return 0, 0
+		c_h = int(self.counts[n - 1][h])
+		row = self._child(n, h, gram_ids[-1]) if gram_ids[-1] >= 0 else -1
+		return (int(self.counts[n][row]) if row >= 0 else 0), c_h
+
+	def lookup(self, grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		"""Batch version of index() for an (m, n) array of token ids (-1 = unknown token).
+
+		Returns (rows of the n-grams, rows of their (n-1)-gram histories), -1 where absent.
+		Each level is one vectorized binary search; queries are searched in sorted order so
+		neighbouring probes land on the same pages of a memory-mapped table. Only queries whose
+		history was found are searched, and with `bloom` set only those its filter may contain.
+		"""
+		grams = np.asarray(grams, dtype=np.int64)
+		m, order = grams.shape
+		row = np.zeros(m, dtype=np.int64)
+		prev = np.full(m, -1, dtype=np.int64)
+		for n in range(1, order + 1):
+			prev = row
+			ok = (row >= 0) & (grams[:, n - 1] >= 0)
+			tok = grams[:, n - 1].clip(0).astype(np.uint64)
+			q = tok if n == 1 else (row.clip(0).astype(np.uint64) << KEY_SHIFT) | tok
+			keys = self.keys[n]
+			cand = np.flatnonzero(ok)
+			bloom = self.bloom.get(n) if self.bloom else None
+			if bloom is not None:
+				cand = cand[bloom.contains(q[cand])]  # definite misses skip the search
+			qc = q[cand]
+			srt = np.argsort(qc, kind="stable")
+			pos = np.empty(len(cand), dtype=np.int64)
+			pos[srt] = np.searchsorted(keys, qc[srt])
+			hit = pos < len(keys)
+			hit[hit] = keys[pos[hit]] == qc[hit]
+			if bloom is not None:
+				bloom.false_positives += len(hit) - int(np.count_nonzero(hit))
+			row = np.full(m, -1, dtype=np.int64)
+			row[cand[hit]] = pos[hit]
+		return row, (prev if order > 1 else np.full(m, -1, dtype=np.int64))
+
+	def count_many(self, grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		"""(c(h,w), c(h)) for an (m, n) array of n-gram ids; c(h) of a unigram is total_tokens."""
+		grams = np.asarray(grams, dtype=np.int64)
+		order = grams.shape[1]
+		row, hist = self.lookup(grams)
+		c = self.counts[order]
+		c_hw = np.where(row >= 0, c[row.clip(0)] if len(c) else 0, 0)
+		if order == 1:
+			return c_hw, np.full(len(row), self.total_tokens, dtype=np.int64)
+		ch = self.counts[order - 1]
+		return c_hw, np.where(hist >= 0, ch[hist.clip(0)] if len(ch) else 0, 0)
+
+	def history_counts(self, n: int) -> np.ndarray:
+		"""c(h) for every row of order n (n >= 2)."""
+		return self.counts[n - 1][(self.keys[n] >> KEY_SHIFT).astype(np.int64)]
+
+	def rows(self, n: int, idx: Optional[np.ndarray] = None) -> np.ndarray:
+		"""Decode rows of order n (all, or those at idx) into an (m, n) array of token ids."""
+		k = self.keys[n] if idx is None else self.keys[n][idx]
+		out = np.empty((len(k), n), dtype=np.int64)
+		for j in range(n - 1, 0, -1):
+			out[:, j] = (k & ID_MASK).astype(np.int64)
+			k = self.keys[j][(k >> KEY_SHIFT).astype(np.int64)]
+		out[:, 0] = k.astype(np.int64)
+		return out
+
+	def sorted_rows(self, n: int, limit: Optional[int] = None) -> np.ndarray:
+		"""Row indices of non-zero n-grams ordered by (-count, tokens), like sorted(dict.items()).
+
+		The order is computed once per n, so the TSV, columnar and top-k outputs share one sort.
+		"""
+		if n not in self._sorted:
+			c = self.counts[n]
+			live = np.flatnonzero(c > 0)
+			ranks = self.vocab.sort_ranks()
+			ids = self.rows(n, live)
+			neg = -c[live].astype(np.int64, copy=False)  # counts may be packed unsigned (ngram_trie.py)
+			self._sorted[n] = live[np.lexsort(tuple(ranks[ids[:, j]] for j in range(n - 1, -1, -1)) + (neg,))]
+		return self._sorted[n] if limit is None else self._sorted[n][:limit]
+
+	def iter_sorted(self, n: int, limit: Optional[int] = None) -> Iterator[Tuple[Tuple[str, ...], int]]:
+		"""(gram strings, count) pairs in sorted_rows order."""
+		idx = self.sorted_rows(n, limit)
+		tokens = self.vocab.tokens
+		for ids, c in zip(self.rows(n, idx).tolist(), self.counts[n][idx].tolist()):
+			yield tuple(tokens[i] for i in ids), c
+
+	def nbytes(self, n: int) -> int:
+		return int(self.keys[n].nbytes + self.counts[n].nbytes)
+
+	def table_stats(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+		"""(unique n-grams, table bytes) per order, as reported by a counting monitor."""
+		return ({n: self.unique(n) for n in range(1, self.max_n + 1)},
+				{n: self.nbytes(n) for n in range(1, self.max_n + 1)})
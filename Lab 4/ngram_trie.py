@@ -0,0 +1,213 @@
+"""
+Lab 4 - Context Trie (n-gram storage with shared prefixes, packed per level)
+
+The tables of ngram_table.py already share prefixes: an order-n row stores its (n-1)-gram prefix
+as a row number, never as tokens. ContextTrie keeps the same rows in the same order but stores them
+as a trie in flat arrays, so the per-row cost drops from 16 bytes (uint64 key + int64 count):
+
+  ids[n]     - uint32 token id of every node at depth n (rows of table n, same order)
+  starts[n]  - children of node r at depth n-1 are nodes starts[n][r]:starts[n][r + 1] at depth n,
+			   sorted by id (uint32 when the level has fewer than 2^32 nodes)
+  counts[n]  - count of every node, in the narrowest unsigned dtype that holds the level's maximum
+
+A walk w1..wn is one binary search per level, each within a single node's children, and the node
+reached after n-1 steps holds c(h): count_pair returns (c(h,w), c(h)) from that one walk. Parents
+are not stored (a binary search in starts finds them); history_counts and rows recover them for
+the writers.
+
+ContextTrie is an NGramCounts, so the q1 writers, print_top, sentence_prob and score_sentences run
+on it unchanged. Code that needs the flat key layout (KneserNey.build, SentenceScorer) gets `keys`
+rebuilt on first use, which costs the memory the trie saves.
+
+Usage:
+  python ngram_trie.py [corpus.txt]    # memory per order, tables vs trie, and a q3 timing on both
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ngram_table import ID_MASK, KEY_SHIFT, CountOfCounts, LossyReport, NGramCounts, Vocab
+
+
+def pack_counts(c: np.ndarray) -> np.ndarray:
+	"""c in the narrowest unsigned dtype holding its maximum."""
+	top = int(c.max()) if len(c) else 0
+	for dtype in (np.uint8, np.uint16, np.uint32):
+		if top <= np.iinfo(dtype).max:
+			return c.astype(dtype)
+	return c.astype(np.uint64)
+
+
+def _index_dtype(n_rows: int):
+	return np.uint32 if n_rows < 2**32 else np.int64
+
+
+def walk(ids: Dict[int, np.ndarray], starts: Dict[int, np.ndarray], grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Rows of an (m, n) array of n-grams and of their histories (-1 = absent), one walk each.
+
+	Each level is a vectorized binary search, every query within its own node's children. ids and
+	starts only need len() and integer-array indexing (ngram_compact.py walks bit-packed ones).
+	"""
+	grams = np.asarray(grams, dtype=np.int64)
+	m, order = grams.shape
+	row = np.zeros(m, dtype=np.int64)
+	prev = np.full(m, -1, dtype=np.int64)
+	for n in range(1, order + 1):
+		prev = row
+		level = ids[n]
+		tok = grams[:, n - 1]
+		ok = (row >= 0) & (tok >= 0)
+		if n == 1:
+			lo, hi = np.zeros(m, dtype=np.int64), np.full(m, len(level), dtype=np.int64)
+		else:
+			r = row.clip(0)
+			lo, hi = starts[n][r].astype(np.int64), starts[n][r + 1].astype(np.int64)
+		lo, hi = np.where(ok, lo, 0), np.where(ok, hi, 0)
+		end = hi.copy()
+		active = np.flatnonzero(lo < hi)
+		while len(active):  # first child with id >= tok
+			mid = (lo[active] + hi[active]) // 2
+			go = level[mid] < tok[active]
+			lo[active] = np.where(go, mid + 1, lo[active])
+			hi[active] = np.where(go, hi[active], mid)
+			active = active[lo[active] < hi[active]]
+		hit = lo < end
+		hit[hit] = level[lo[hit]] == tok[hit]
+		row = np.where(hit, lo, -1)
+	return row, (prev if order > 1 else np.full(m, -1, dtype=np.int64))
+
+
+######## Trie ########
+class ContextTrie(NGramCounts):
+	"""Trie over token ids with packed per-level arrays (layout in the module docstring)."""
+
+	def __init__(self, vocab: Vocab, ids: Dict[int, np.ndarray], starts: Dict[int, np.ndarray],
+				 counts: Dict[int, np.ndarray], total_tokens: int, lossy: Optional[LossyReport] = None,
+				 tail: Optional[np.ndarray] = None, coc: Optional[Dict[int, CountOfCounts]] = None):
+		super().__init__(vocab, {}, counts, total_tokens, lossy, tail, coc)
+		self.ids = ids
+		self.starts = starts
+		self.max_n = len(ids)
+		self._keys: Optional[Dict[int, np.ndarray]] = None
+
+	@classmethod
+	def from_counts(cls, counts: NGramCounts) -> "ContextTrie":
+		ids: Dict[int, np.ndarray] = {}
+		starts: Dict[int, np.ndarray] = {}
+		packed: Dict[int, np.ndarray] = {}
+		for n in range(1, counts.max_n + 1):
+			keys = counts.keys[n]
+			ids[n] = (keys & ID_MASK).astype(np.uint32)
+			if n > 1:
+				n_parents = len(counts.keys[n - 1])
+				starts[n] = np.searchsorted(keys >> KEY_SHIFT, np.arange(n_parents + 1, dtype=np.uint64)).astype(_index_dtype(len(keys)))
+			packed[n] = pack_counts(np.asarray(counts.counts[n]))
+		coc = {n: counts.count_of_counts(n) for n in range(1, counts.max_n + 1)}
+		return cls(counts.vocab, ids, starts, packed, counts.total_tokens, counts.lossy, counts.tail, coc)
+
+	@property
+	def keys(self) -> Dict[int, np.ndarray]:
+		"""The flat (prefix row << 32 | id) keys of ngram_table.py, rebuilt once on first use."""
+		if self._keys is None:
+			self._keys = {n: self.ids[n].astype(np.uint64) if n == 1
+						  else (self.parents(n).astype(np.uint64) << KEY_SHIFT) | self.ids[n]
+						  for n in range(1, self.max_n + 1)}
+		return self._keys
+
+	@keys.setter
+	def keys(self, keys: Dict[int, np.ndarray]):
+		self._keys = keys or None  # NGramCounts.__init__ gets {}: the flat keys are rebuilt on demand
+
+	def parents(self, n: int, idx: Optional[np.ndarray] = None) -> np.ndarray:
+		"""Parent node (row of depth n-1) of every node at depth n, or of the nodes at idx."""
+		starts = self.starts[n]
+		if idx is None:
+			return np.repeat(np.arange(len(starts) - 1, dtype=np.int64), np.diff(starts.astype(np.int64)))
+		return np.searchsorted(starts, idx, side="right").astype(np.int64) - 1
+
+	######## Walks ########
+	def _child(self, n: int, row: int, tok: int) -> int:
+		ids = self.ids[n]
+		if n == 1:
+			lo, hi = 0, len(ids)
+		else:
+			lo, hi = int(self.starts[n][row]), int(self.starts[n][row + 1])
+		i = lo + int(ids[lo:hi].searchsorted(tok))
+		return i if i < hi and ids[i] == tok else -1
+
+	def lookup(self, grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		return walk(self.ids, self.starts, grams)
+
+	def count_many(self, grams: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		grams = np.asarray(grams, dtype=np.int64)
+		order = grams.shape[1]
+		row, hist = self.lookup(grams)
+		c = self.counts[order]
+		c_hw = np.where(row >= 0, c[row.clip(0)].astype(np.int64) if len(c) else 0, 0)
+		if order == 1:
+			return c_hw, np.full(len(row), self.total_tokens, dtype=np.int64)
+		ch = self.counts[order - 1]
+		return c_hw, np.where(hist >= 0, ch[hist.clip(0)].astype(np.int64) if len(ch) else 0, 0)
+
+	######## Writers ########
+	def history_counts(self, n: int) -> np.ndarray:
+		return self.counts[n - 1][self.parents(n)].astype(np.int64)
+
+	def rows(self, n: int, idx: Optional[np.ndarray] = None) -> np.ndarray:
+		r = np.arange(len(self.ids[n]), dtype=np.int64) if idx is None else np.asarray(idx, dtype=np.int64)
+		out = np.empty((len(r), n), dtype=np.int64)
+		for j in range(n, 0, -1):
+			out[:, j - 1] = self.ids[j][r]
+			if j > 1:
+				r = self.parents(j, r)
+		return out
+
+	def nbytes(self, n: int) -> int:
+		return int(self.ids[n].nbytes + self.counts[n].nbytes + (self.starts[n].nbytes if n > 1 else 0))
+
+
+def main():
+	from q3 import INPUT_FILENAME, MAX_N, SENTENCE_FILE, find_file, read_sentences, sentence_prob
+	from ngram_store import default_store_path, load_counts, load_or_build
+
+	ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	ap.add_argument("corpus", nargs="?", type=Path)
+	args = ap.parse_args()
+
+	corpus = args.corpus or find_file(INPUT_FILENAME)
+	load_or_build(corpus, MAX_N)
+	store = default_store_path(corpus)
+	tables = load_counts(store)
+	tables = NGramCounts(tables.vocab, {n: np.array(k) for n, k in tables.keys.items()},  # into memory, like fresh counts
+						 {n: np.array(c) for n, c in tables.counts.items()}, tables.total_tokens, tables.lossy, tables.tail)
+	t0 = time.perf_counter()
+	trie = ContextTrie.from_counts(tables)
+	print(f"Trie built from the tables in {time.perf_counter() - t0:.2f} s\n")
+	print(f"{'n':>2} {'rows':>10} {'tables MB':>10} {'trie MB':>8} {'count dtype':>12}")
+	for n in range(1, MAX_N + 1):
+		print(f"{n:>2} {len(trie.ids[n]):>10,} {tables.nbytes(n) / 2**20:>10.1f} {trie.nbytes(n) / 2**20:>8.1f} "
+			  f"{trie.counts[n].dtype.name:>12}")
+	total_t = sum(tables.nbytes(n) for n in range(1, MAX_N + 1))
+	total_r = sum(trie.nbytes(n) for n in range(1, MAX_N + 1))
+	print(f"{'all':>2} {'':>10} {total_t / 2**20:>10.1f} {total_r / 2**20:>8.1f}  ({1 - total_r / total_t:.0%} smaller)")
+
+	sentences = [toks for _, toks in read_sentences(find_file(SENTENCE_FILE))]
+	V = len(tables.vocab)
+	print(f"\nsentence_prob over {SENTENCE_FILE}, n = 4:")
+	for name, counts in (("tables", tables), ("trie", trie)):
+		t0 = time.perf_counter()
+		out = [sentence_prob(toks, 4, counts, V) for toks in sentences]
+		print(f"  {name:<7} {time.perf_counter() - t0:.2f} s")
+		if name == "tables":
+			ref = out
+	print(f"  same results: {out == ref}")
+
+
+if __name__ == "__main__":
+	main()
@@ -3,97 +3,180 @@ Lab 4 - Simple N‑gram Models (Unigram, Bigram, Trigram, Quadragram)
 
 Requirement adjustments:
  - Memory-friendly: stream tokens instead of loading whole list; maintain rolling window.
+   Tokens become integer ids and n-grams packed uint64 keys (see ngram_table.py).
+ - Counts are cached in <corpus>.ngrams (ngram_store.py) and shared with q2/q3.
  - Outputs: unigrams.tsv, bigrams.tsv, trigrams.tsv, quadragrams.tsv
    * Unigrams: token \t count \t p(token)
    * Higher n: w1..wn \t count \t p(last|history)
+ - The same tables in columnar binary form (columns/*.cols + columns/vocab.txt, see ngram_columns.py),
+   computed as arrays and memory-mapped by readers; the TSVs are optional (WRITE_TSV).
  - Prints top 10 most frequent n‑grams for each order.
+ - The corpus is looked up like in q2/q3 (next to the script, one level up, Lab 1/, working directory);
+   `python q1.py path/to/corpus.txt` overrides it.
+ - APPEND_FILES: new text (e.g. one file per day) counted into the existing store without recounting
+   the corpus; n-grams spanning the boundary are included, and each file is only ever added once.
+ - APPROXIMATE = True swaps exact counting for fixed-memory sketches (ngram_sketch.py): the TSVs and
+   top-10 then cover the tracked heavy hitters, with estimated counts and the printed error bounds.
+ - TRIE = True runs the writers on a ContextTrie (ngram_trie.py): the same rows with shared-prefix
+   nodes and packed counts, in less memory than the flat tables.
+ - PIPELINE = True counts with reader, tokenizer and counter threads joined by bounded queues
+   (ngram_pipeline.py) and prints how busy each stage was.
+ - PROGRESS_SECONDS: while counting, print tokens/s, unique n-grams and table bytes per order and
+   process RSS every so many seconds (ngram_monitor.py); PROGRESS_JSONL also appends them to a file.
 """
 
 from __future__ import annotations
+import sys
 from pathlib import Path
-from collections import defaultdict, deque
-from typing import Dict, Tuple, Deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ngram_columns import write_columns, write_vocab
+from ngram_monitor import CountingMonitor, JsonLinesSink, LogSink
+from ngram_sketch import SketchCounts, count_ngrams_sketch
+from ngram_store import append_to_store, default_store_path, load_or_build
+from ngram_table import NGramCounts
+from ngram_trie import ContextTrie
 
 INPUT_FILENAME = "indiccorp_gu_words.txt"
 MAX_N = 4
 TOP_PRINT = 10
-MAX_UNIQUE_PER_ORDER = None  # e.g., 500000 to cap memory
-
-def stream_tokens(path: Path):
-	with path.open("r", encoding="utf-8", errors="ignore") as f:
-		for line in f:
-			for tok in line.strip().split():
-				t = tok.strip()
-				if t:
-					yield t
+LOSSY_EPSILON = None  # e.g., 1e-6: lossy counting for n>=2, counts low by at most epsilon * tokens
+WORKERS = 1  # >1 counts byte-range shards in a process pool (same counts, see ngram_parallel.py)
+MEMORY_BUDGET_MB = None  # e.g., 256: exact counts within this budget, spilling sorted runs to disk (ngram_external.py)
+APPEND_FILES = ()  # e.g., ("new_day.txt",): counted into the store after the corpus, recorded there (ngram_store.py)
+APPROXIMATE = False  # True: Count-Min + Misra-Gries sketches in fixed memory (top n-grams and rough counts only)
+TRIE = False  # True: writers read a ContextTrie built from the counts (ngram_trie.py)
+PIPELINE = False  # True: threaded read -> tokenize -> count pipeline with per-stage utilization (ngram_pipeline.py)
+WRITE_TSV = True  # human-readable export; the columnar files are always written
+COLUMNS_FLOAT = "float64"  # dtype of the probability columns ("float32" halves them)
+PROGRESS_SECONDS = None  # e.g., 10: counting progress snapshot every so many seconds (ngram_monitor.py)
+PROGRESS_JSONL = None  # e.g., "progress.jsonl": snapshots also appended there as JSON lines
+
+def find_input_file() -> Path:
+	here = Path(__file__).resolve().parent
+	candidates = [
+		here / INPUT_FILENAME,
+		here.parent / INPUT_FILENAME,
+		here.parent / "Lab 1" / INPUT_FILENAME,
+		Path.cwd() / INPUT_FILENAME,
+	]
+	for p in candidates:
+		if p.is_file():
+			return p
+	raise FileNotFoundError("Could not locate input file. Checked:\n" + "\n".join(str(c) for c in candidates))
 
 def unigram_prob(count: int, total: int) -> float:
 	return count / total if total else 0.0
 
-def conditional_prob(ngram: Tuple[str, ...], counts_n: Dict[Tuple[str, ...], int], counts_prev: Dict[Tuple[str, ...], int]) -> float:
-	history = ngram[:-1]
-	denom = counts_prev.get(history, 0) # frequency of history
-	return counts_n.get(ngram, 0) / denom if denom else 0.0 # P(w_n | history)
+def conditional_prob(count_hw: int, count_h: int) -> float:
+	return count_hw / count_h if count_h else 0.0 # P(w_n | history)
 
-def write_unigrams(counts: Dict[Tuple[str, ...], int], total: int, out_path: Path):
-	rows = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+def write_unigrams(counts: NGramCounts, out_path: Path):
+	total = counts.total_tokens
 	with out_path.open("w", encoding="utf-8") as f:
 		f.write("token\tcount\tp\n")
-		for (tok,), c in rows:
+		for (tok,), c in counts.iter_sorted(1):
 			f.write(f"{tok}\t{c}\t{unigram_prob(c, total):.8f}\n")
 
 
-def write_higher(n: int, counts_n: Dict[Tuple[str, ...], int], counts_prev: Dict[Tuple[str, ...], int], out_path: Path):
-	rows = sorted(counts_n.items(), key=lambda kv: (-kv[1], kv[0]))
+def write_higher(n: int, counts: NGramCounts, out_path: Path):
+	# ids are decoded back to strings only here, row by row
+	idx = counts.sorted_rows(n)
+	hist_counts = counts.history_counts(n)[idx].tolist()
+	tokens = counts.vocab.tokens
 	header = [f"w{i+1}" for i in range(n)] + ["count", "p_cond"]
 	with out_path.open("w", encoding="utf-8") as f:
 		f.write("\t".join(header) + "\n")
-		for gram, c in rows:
-			p = conditional_prob(gram, counts_n, counts_prev)
-			f.write("\t".join(list(gram) + [str(c), f"{p:.8f}"]) + "\n")
+		for ids, c, ch in zip(counts.rows(n, idx).tolist(), counts.counts[n][idx].tolist(), hist_counts):
+			p = conditional_prob(c, ch)
+			f.write("\t".join([tokens[i] for i in ids] + [str(c), f"{p:.8f}"]) + "\n")
+
+
+def unigram_columns(counts: NGramCounts) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+	idx = counts.sorted_rows(1)
+	c = np.asarray(counts.counts[1][idx], dtype=np.int64)  # trie counts are packed
+	total = counts.total_tokens
+	p = c / total if total else np.zeros(len(c))
+	return counts.rows(1, idx), {"count": c, "p": p.astype(COLUMNS_FLOAT)}
 
 
-def print_top(counts: Dict[Tuple[str, ...], int], n: int):
-	rows = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:TOP_PRINT]
+def higher_columns(n: int, counts: NGramCounts) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+	# same rows and values as write_higher, without the per-row strings
+	idx = counts.sorted_rows(n)
+	c = np.asarray(counts.counts[n][idx], dtype=np.int64)
+	ch = counts.history_counts(n)[idx]
+	p = np.where(ch > 0, c / np.maximum(ch, 1), 0.0)
+	return counts.rows(n, idx), {"count": c, "p_cond": p.astype(COLUMNS_FLOAT)}
+
+
+def print_top(counts: NGramCounts, n: int):
+	rows = list(counts.iter_sorted(n, TOP_PRINT))
 	print(f"Top {len(rows)} {n}-grams:")
 	for gram, c in rows:
 		print(f"  {' '.join(gram):<60} {c}")
 	print()
 
-inp = Path("C:\\Users\\rudra\\OneDrive\\Desktop\\AI I53\\Sem V\\NLP\\Lab\\Lab 1\\indiccorp_gu_words.txt")
-print(f"Streaming tokens from: {inp}")
-
-counts: Dict[int, Dict[Tuple[str, ...], int]] = {n: defaultdict(int) for n in range(1, MAX_N + 1)}
-total_tokens = 0
-vocab = set()
-window: Deque[str] = deque(maxlen=MAX_N - 1)
-
-for tok in stream_tokens(inp):
-	total_tokens += 1
-	vocab.add(tok)
-	counts[1][(tok,)] += 1
-	if MAX_N > 1:
-		hist = list(window)
-		hl = len(hist) # ketli lambi history available che te
-		for n in range(2, MAX_N + 1):
-			need = n - 1 
-			if hl >= need:
-				gram = tuple(hist[-need:] + [tok])
-				counts[n][gram] += 1
-				
-	window.append(tok)
-
-print(f"Total tokens: {total_tokens}; Vocabulary size: {len(vocab)}")
-for n in range(1, MAX_N + 1):
-	print(f"Unique {n}-grams: {len(counts[n])}")
-
-out_dir = Path(__file__).parent
-write_unigrams(counts[1], total_tokens, out_dir / "unigrams.tsv")
-print_top(counts[1], 1)
-
-file_names = {2: "bigrams.tsv", 3: "trigrams.tsv", 4: "quadragrams.tsv"}
-for n in range(2, MAX_N + 1):
-	write_higher(n, counts[n], counts[n - 1], out_dir / file_names[n])
-	print_top(counts[n], n)
-
-print("Saras!!")
\ No newline at end of file
+def print_error_bounds(counts: SketchCounts):
+	print("Approximate counts: reported count - true count lies in [0, min(overcount, undercount)]")
+	for n, b in counts.error_bounds().items():
+		print(f"  {n}-grams: Count-Min overcount <= {b['overcount']:.1f} (prob. >= 1 - delta), "
+			  f"Misra-Gries undercount <= {b['undercount']} of {b['n_grams']}")
+	print()
+
+def main(corpus: Optional[Path] = None, out_dir: Optional[Path] = None):
+	inp = corpus or find_input_file()
+	print(f"Streaming tokens from: {inp}")
+
+	if APPROXIMATE:
+		counts = count_ngrams_sketch(inp, MAX_N)
+		print_error_bounds(counts)
+	else:
+		budget = MEMORY_BUDGET_MB * 2**20 if MEMORY_BUDGET_MB else None
+		monitor, jsonl = None, None
+		if PROGRESS_SECONDS is not None:
+			jsonl = JsonLinesSink(Path(PROGRESS_JSONL)) if PROGRESS_JSONL else None
+			monitor = CountingMonitor([LogSink()] + ([jsonl] if jsonl else []), PROGRESS_SECONDS)
+		try:
+			counts = load_or_build(inp, MAX_N, LOSSY_EPSILON, WORKERS, memory_budget=budget, pipeline=PIPELINE,
+								   monitor=monitor)
+		finally:
+			if jsonl:
+				jsonl.close()
+		for extra in APPEND_FILES:
+			counts = append_to_store(default_store_path(inp), Path(extra))
+		if TRIE:
+			counts = ContextTrie.from_counts(counts)
+	total_tokens = counts.total_tokens
+	vocab = counts.vocab
+
+	print(f"Total tokens: {total_tokens}; Vocabulary size: {len(vocab)}")
+	for n in range(1, MAX_N + 1):
+		print(f"Unique {n}-grams: {counts.unique(n)}")
+	if counts.lossy:
+		print("\n".join(counts.lossy.lines()))
+
+	out_dir = out_dir or Path(__file__).parent
+	col_dir = out_dir / "columns"
+	col_dir.mkdir(exist_ok=True)
+	write_vocab(vocab, col_dir)
+	meta = {"total_tokens": total_tokens, "vocab_size": len(vocab)}
+
+	if WRITE_TSV:
+		write_unigrams(counts, out_dir / "unigrams.tsv")
+	write_columns(col_dir / "unigrams.cols", *unigram_columns(counts), meta)
+	print_top(counts, 1)
+
+	file_names = {2: "bigrams", 3: "trigrams", 4: "quadragrams"}
+	for n in range(2, MAX_N + 1):
+		if WRITE_TSV:
+			write_higher(n, counts, out_dir / f"{file_names[n]}.tsv")
+		write_columns(col_dir / f"{file_names[n]}.cols", *higher_columns(n, counts), meta)
+		print_top(counts, n)
+
+	print("Saras!!")
+
+
+if __name__ == "__main__":
+	main(Path(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -1,7 +1,7 @@
 """
 Lab 4 - Q2: Smoothing Techniques for N‑gram Models
 
-Implements three smoothing variants for n-grams (n=2..4) over the Gujarati token corpus:
+Implements five smoothing variants for n-grams (n=2..4) over the Gujarati token corpus:
   a. Add-One (Laplace) Smoothing
 	   P_add1(w_n | h) = (c(h, w_n) + 1) / (c(h) + V)
   b. Add-K Smoothing (generalized Laplace, K configurable)
@@ -12,6 +12,15 @@ Implements three smoothing variants for n-grams (n=2..4) over the Gujarati token
 	   Rationale: Adds a pseudo-count proportional to lexical diversity of the predicted token.
 	   Because we do not simultaneously adjust the denominator across vocabulary, these scores
 	   are for ranking only (they will not sum to 1 over w_n).
+  d. Interpolated Modified Kneser-Ney (ngram_kneser_ney.py)
+	   P_KN(w_n | h) = max(c(h, w_n) - D(c), 0) / c(h) + gamma(h) * P_KN(w_n | h')
+	   with continuation counts at the lower orders and three discounts per order; the discounts
+	   and backoff weights are precomputed once and saved next to the count store.
+  e. Simple Good-Turing (ngram_good_turing.py)
+	   P_GT(w_n | h) = c*(c(h, w_n)) / c(h)
+	   with c* the Gale & Sampson adjusted count of order n, fitted from the count-of-counts N_r
+	   that counting keeps per order (no extra pass over the tables). Per history this sums to
+	   less than 1; the rest is the Good-Turing mass of unseen continuations.
 
 Outputs:
   - bigrams_smoothing.tsv
@@ -19,30 +28,55 @@ Outputs:
   - quadragrams_smoothing.tsv
 
 Each contains columns:
-  w1 .. wn, count, mle_p, add1_p, addK_p, token_type_score
+  w1 .. wn, count, mle_p, add1_p, addK_p, kn_p, gt_p, token_type_score
+
+The same columns are also written in binary columnar form (columns/*_smoothing.cols with
+columns/vocab.txt, see ngram_columns.py): token ids, counts and probabilities straight from arrays,
+memory-mapped by readers. The TSVs are an optional human-readable export (WRITE_TSV).
+With COMPACT_LM_BITS set, the Kneser-Ney model is also exported as a quantized compact language
+model (columns/kn_q8.lm, see ngram_compact.py) that scores sentences without the count store.
 
 Process:
   * Stream tokens from indiccorp_gu_words.txt (no full list retained) for memory efficiency.
-  * Maintain counts for n=1..4.
+  * Maintain counts for n=1..4 as integer-id tables (ngram_table.py); strings only come back on write.
+  * Counts are built once into <corpus>.ngrams (ngram_store.py) and memory-mapped by later runs.
   * After counting, compute probabilities for n>=2.
 
-Config knobs near top: INPUT_FILENAME, MAX_N, ADD_K, MAX_UNIQUE_PER_ORDER (optional pruning).
+Config knobs near top: INPUT_FILENAME, MAX_N, ADD_K, LOSSY_EPSILON (optional lossy counting), WORKERS,
+MEMORY_BUDGET_MB (exact counting with spill-to-disk). `python q2.py path/to/corpus.txt` overrides the
+corpus lookup.
 
-Note: Pruning (if enabled) may drop some rare higher-order n-grams (count==1) to save memory.
+Note: Lossy counting (if enabled) drops rare higher-order n-grams to save memory; every kept count is
+	  low by at most LOSSY_EPSILON * tokens. Pruning runs once per bucket of 1/epsilon tokens, not per token.
 """
 
 from __future__ import annotations
 
+import sys
 from pathlib import Path
-from collections import defaultdict, deque
-from typing import Dict, Tuple, Deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ngram_columns import write_columns, write_vocab
+from ngram_compact import CompactLM, save_compact_lm
+from ngram_good_turing import SimpleGoodTuring
+from ngram_kneser_ney import KneserNey, load_or_build_kneser_ney
+from ngram_store import default_store_path, load_or_build
+from ngram_table import NGramCounts, Vocab
 
 # ---------------- Configuration ---------------- #
 INPUT_FILENAME = "indiccorp_gu_words.txt"
 MAX_N = 4              # up to quadragram
 ADD_K = 0.5            # K for Add-K smoothing (change as desired)
 TOP_PRINT = 8          # small preview in console
-MAX_UNIQUE_PER_ORDER = None  # e.g., 600000 to cap memory; None disables pruning
+LOSSY_EPSILON = None   # e.g., 1e-6 for lossy counting of n>=2; None counts exactly
+WORKERS = 1            # >1 counts byte-range shards in a process pool (same counts, see ngram_parallel.py)
+MEMORY_BUDGET_MB = None  # e.g., 256: exact counts within this budget, spilling sorted runs to disk
+WRITE_TSV = True       # human-readable export; the columnar files are always written
+COLUMNS_FLOAT = "float64"  # dtype of the probability columns ("float32" halves them)
+WRITE_BLOCK_ROWS = 1 << 18  # TSV rows formatted and written per block
+COMPACT_LM_BITS = None  # 8 or 16: also export columns/kn_q<bits>.lm (quantized Kneser-Ney, ngram_compact.py)
 
 
 # ---------------- File Location ---------------- #
@@ -60,79 +94,67 @@ def find_input_file() -> Path:
 	raise FileNotFoundError("Could not locate input file. Checked:\n" + "\n".join(str(c) for c in candidates))
 
 
-# ---------------- Streaming Tokens ---------------- #
-def stream_tokens(path: Path):
-	with path.open("r", encoding="utf-8", errors="ignore") as f:
-		for line in f:
-			for tok in line.strip().split():
-				t = tok.strip()
-				if t:
-					yield t
-
-
-# ---------------- Counting ---------------- #
-def prune_if_needed(counts: Dict[Tuple[str, ...], int]):
-	if MAX_UNIQUE_PER_ORDER is None:
-		return
-	if len(counts) <= MAX_UNIQUE_PER_ORDER:
-		return
-	# remove count==1 entries
-	to_drop = [k for k, v in counts.items() if v == 1]
-	for k in to_drop:
-		del counts[k]
-
-
-# ---------------- Probability Helpers ---------------- #
-def mle_conditional(ngram: Tuple[str, ...], counts_n: Dict[Tuple[str, ...], int], counts_prev: Dict[Tuple[str, ...], int]) -> float:
-	hist = ngram[:-1]
-	denom = counts_prev.get(hist, 0)
-	return counts_n.get(ngram, 0) / denom if denom else 0.0
-
-
-def add_one_conditional(ngram: Tuple[str, ...], counts_n: Dict[Tuple[str, ...], int], counts_prev: Dict[Tuple[str, ...], int], vocab_size: int) -> float:
-	hist = ngram[:-1]
-	denom = counts_prev.get(hist, 0)
-	return (counts_n.get(ngram, 0) + 1) / (denom + vocab_size) if denom or vocab_size else 0.0
-
-
-def add_k_conditional(ngram: Tuple[str, ...], counts_n: Dict[Tuple[str, ...], int], counts_prev: Dict[Tuple[str, ...], int], vocab_size: int, k: float) -> float:
-	hist = ngram[:-1]
-	denom = counts_prev.get(hist, 0)
-	return (counts_n.get(ngram, 0) + k) / (denom + k * vocab_size) if denom or vocab_size else 0.0
-
-
-def token_type_score(ngram: Tuple[str, ...], counts_n: Dict[Tuple[str, ...], int]) -> float:
-	# Add number of unique characters in predicted token to raw count (NOT normalized)
-	predicted = ngram[-1]
-	return counts_n.get(ngram, 0) + len(set(predicted))
+# ---------------- Output ---------------- #
+def char_type_counts(vocab: Vocab) -> np.ndarray:
+	"""Unique characters of every vocabulary token, by id (the token-type pseudo-count)."""
+	return np.fromiter((len(set(t)) for t in vocab.tokens), dtype=np.int64, count=len(vocab))
+
+
+def smoothed_columns(n: int, counts: NGramCounts, vocab_size: int, kn: KneserNey, gt: SimpleGoodTuring,
+					 char_types: Optional[np.ndarray] = None,
+					 float_dtype: str = COLUMNS_FLOAT) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+	"""The smoothing table of order n as arrays: mle_p = c(h, w_n) / c(h) (0 for an unseen history)
+	and the smoothers of the module docstring, each defined only here.
+
+	Rows are in sorted_rows order; c(h) is gathered once for the whole table and the
+	per-token unique-character counts come from char_types (computed once per vocabulary).
+	"""
+	idx = counts.sorted_rows(n)
+	ids = counts.rows(n, idx)
+	c = counts.counts[n][idx]
+	ch = counts.history_counts(n)[idx]
+	if char_types is None:
+		char_types = char_type_counts(counts.vocab)
+	return ids, {
+		"count": c,
+		"mle_p": np.where(ch > 0, c / np.maximum(ch, 1), 0.0).astype(float_dtype),
+		"add1_p": ((c + 1) / (ch + vocab_size)).astype(float_dtype),
+		f"add{ADD_K}_p": ((c + ADD_K) / (ch + ADD_K * vocab_size)).astype(float_dtype),
+		"kn_p": kn.probs(ids).astype(float_dtype),
+		"gt_p": np.where(ch > 0, gt.adjusted(c) / np.maximum(ch, 1), 0.0).astype(float_dtype),
+		"token_type_score": c + char_types[ids[:, -1]],
+	}
+
+
+def write_smoothed_table(vocab: Vocab, ids: np.ndarray, columns: Dict[str, np.ndarray], out_path: Path,
+						 block_rows: int = WRITE_BLOCK_ROWS):
+	"""Write smoothed_columns as TSV: each column is formatted as a whole, one write per block of rows."""
+	n = ids.shape[1]
+	tokens = np.array(vocab.tokens, dtype=object)
+	header = [f"w{i+1}" for i in range(n)] + list(columns)
+	formats = {"count": str, "token_type_score": "%.4f".__mod__}
+	with out_path.open("w", encoding="utf-8") as f:
+		f.write("\t".join(header) + "\n")
+		for lo in range(0, len(ids), block_rows):
+			hi = min(lo + block_rows, len(ids))
+			cells = [tokens[ids[lo:hi, i]].tolist() for i in range(n)]
+			cells += [list(map(formats.get(name, "%.8f".__mod__), col[lo:hi].tolist())) for name, col in columns.items()]
+			f.write("\n".join(map("\t".join, zip(*cells))) + "\n")
 
 
-# ---------------- Output ---------------- #
 def write_smoothed(n: int,
-				   counts_n: Dict[Tuple[str, ...], int],
-				   counts_prev: Dict[Tuple[str, ...], int],
+				   counts: NGramCounts,
 				   vocab_size: int,
-				   out_path: Path):
-	rows = sorted(counts_n.items(), key=lambda kv: (-kv[1], kv[0]))
-	header = [f"w{i+1}" for i in range(n)] + ["count", "mle_p", "add1_p", f"add{ADD_K}_p", "token_type_score"]
-	with out_path.open("w", encoding="utf-8") as f:
-		f.write("\t".join(header) + "\n")
-		for gram, c in rows:
-			mle_p = mle_conditional(gram, counts_n, counts_prev)
-			add1_p = add_one_conditional(gram, counts_n, counts_prev, vocab_size)
-			addk_p = add_k_conditional(gram, counts_n, counts_prev, vocab_size, ADD_K)
-			tts = token_type_score(gram, counts_n)
-			f.write("\t".join(list(gram) + [
-				str(c),
-				f"{mle_p:.8f}",
-				f"{add1_p:.8f}",
-				f"{addk_p:.8f}",
-				f"{tts:.4f}",
-			]) + "\n")
-
-
-def print_preview(n: int, counts_n: Dict[Tuple[str, ...], int]):
-	rows = sorted(counts_n.items(), key=lambda kv: (-kv[1], kv[0]))[:TOP_PRINT]
+				   kn: KneserNey,
+				   gt: SimpleGoodTuring,
+				   out_path: Path,
+				   char_types: Optional[np.ndarray] = None):
+	ids, columns = smoothed_columns(n, counts, vocab_size, kn, gt, char_types, "float64")
+	write_smoothed_table(counts.vocab, ids, columns, out_path)
+
+
+def print_preview(n: int, counts: NGramCounts):
+	rows = list(counts.iter_sorted(n, TOP_PRINT))
 	print(f"Top {len(rows)} {n}-grams (by raw count):")
 	for gram, c in rows:
 		print(f"  {' '.join(gram):<60} {c}")
@@ -140,46 +162,57 @@ def print_preview(n: int, counts_n: Dict[Tuple[str, ...], int]):
 
 
 # ---------------- Main ---------------- #
-def main():
-	inp = find_input_file()
+def main(corpus: Optional[Path] = None, out_dir: Optional[Path] = None):
+	inp = corpus or find_input_file()
 	print(f"Streaming tokens from: {inp}")
 
-	counts: Dict[int, Dict[Tuple[str, ...], int]] = {i: defaultdict(int) for i in range(1, MAX_N + 1)}
-	total_tokens = 0
-	vocab = set()
-	window: Deque[str] = deque(maxlen=MAX_N - 1)
-
-	for tok in stream_tokens(inp):
-		total_tokens += 1
-		vocab.add(tok)
-		counts[1][(tok,)] += 1
-		if MAX_N > 1:
-			hist = list(window)
-			hl = len(hist)
-			for n in range(2, MAX_N + 1):
-				needed = n - 1
-				if hl >= needed:
-					gram = tuple(hist[-needed:] + [tok])
-					counts[n][gram] += 1
-					prune_if_needed(counts[n])
-		window.append(tok)
-
-	vocab_size = len(vocab)
+	budget = MEMORY_BUDGET_MB * 2**20 if MEMORY_BUDGET_MB else None
+	counts = load_or_build(inp, MAX_N, LOSSY_EPSILON, WORKERS, memory_budget=budget)
+	total_tokens = counts.total_tokens
+
+	vocab_size = len(counts.vocab)
 	print(f"Total tokens: {total_tokens}; Vocabulary size: {vocab_size}")
 	for n in range(1, MAX_N + 1):
-		print(f"Unique {n}-grams: {len(counts[n])}")
-
-	out_dir = Path(__file__).parent
-	file_map = {2: "bigrams_smoothing.tsv", 3: "trigrams_smoothing.tsv", 4: "quadragrams_smoothing.tsv"}
+		print(f"Unique {n}-grams: {counts.unique(n)}")
+	if counts.lossy:
+		print("\n".join(counts.lossy.lines()))
+	kn = load_or_build_kneser_ney(counts, default_store_path(inp))
+	print("Kneser-Ney discounts (D1, D2, D3+): " + "; ".join(
+		f"n={n}: " + ", ".join(f"{d:.3f}" for d in kn.discounts["top"][n]) for n in range(2, MAX_N + 1)))
+	gt = {n: SimpleGoodTuring.fit(counts.count_of_counts(n)) for n in range(2, MAX_N + 1)}
+	for n in range(2, MAX_N + 1):
+		r, n_r = counts.count_of_counts(n)
+		print(f"{n}-gram count-of-counts N_1..N_5: " + ", ".join(str(int(n_r[r == i].sum())) for i in range(1, 6))
+			  + f"; Good-Turing P0 = {gt[n].p0:.4f}, slope = {gt[n].slope:.3f}")
+
+	out_dir = out_dir or Path(__file__).parent
+	col_dir = out_dir / "columns"
+	col_dir.mkdir(exist_ok=True)
+	write_vocab(counts.vocab, col_dir)
+	char_types = char_type_counts(counts.vocab)
+	meta = {"total_tokens": total_tokens, "vocab_size": vocab_size, "add_k": ADD_K}
+	file_map = {2: "bigrams_smoothing", 3: "trigrams_smoothing", 4: "quadragrams_smoothing"}
 	for n in range(2, MAX_N + 1):
-		write_smoothed(n, counts[n], counts[n - 1], vocab_size, out_dir / file_map[n])
-		print_preview(n, counts[n])
+		ids, columns = smoothed_columns(n, counts, vocab_size, kn, gt[n], char_types, "float64")
+		if WRITE_TSV:
+			write_smoothed_table(counts.vocab, ids, columns, out_dir / f"{file_map[n]}.tsv")
+		columns = {name: col.astype(COLUMNS_FLOAT) if col.dtype.kind == "f" else col for name, col in columns.items()}
+		write_columns(col_dir / f"{file_map[n]}.cols", ids, columns, meta)
+		print_preview(n, counts)
+	if COMPACT_LM_BITS:
+		save_compact_lm(CompactLM.build(counts, kn, COMPACT_LM_BITS), col_dir / f"kn_q{COMPACT_LM_BITS}.lm")
 
 	print("Done. Files written:")
 	for n in range(2, MAX_N + 1):
-		print(f"  {file_map[n]}")
-	print("Add-One & Add-K are proper probability distributions (sum to 1 per history). Token-type score is not.")
+		if WRITE_TSV:
+			print(f"  {file_map[n]}.tsv")
+		print(f"  columns/{file_map[n]}.cols")
+	print("  columns/vocab.txt")
+	if COMPACT_LM_BITS:
+		print(f"  columns/kn_q{COMPACT_LM_BITS}.lm")
+	print("Add-One, Add-K & Kneser-Ney are proper probability distributions (sum to 1 per history). "
+		  "Good-Turing leaves each history's unseen mass unassigned; token-type score is not a probability.")
 
 
 if __name__ == "__main__":
-	main()
+	main(Path(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -9,9 +9,13 @@ Models:
   Add-One (Laplace):      P(w|h) = (c(h,w)+1)/(c(h)+V)
   Add-K (general K>0):    P(w|h) = (c(h,w)+K)/(c(h)+K*V)
   Token-Type score:       score(h,w) = c(h,w) + unique_char_count(w)  (NOT a probability)
+  Kneser-Ney (modified, interpolated): discounted counts interpolated with lower-order continuation
+						  distributions (ngram_kneser_ney.py; tables precomputed next to the count store)
 
 Implementation notes:
-  * Stream corpus tokens from indiccorp_gu_words.txt (no full token list held) to build counts for n=1..4.
+  * Stream corpus tokens from indiccorp_gu_words.txt (no full token list held) to build counts for n=1..4
+	(integer-id tables from ngram_table.py; sentence tokens are mapped to ids, unseen tokens count 0).
+	The counts are memory-mapped from <corpus>.ngrams when q1/q2 already built it (ngram_store.py).
   * Sentence tokens are taken directly from q3_data.txt (simple whitespace split after stripping the numeric prefix "N.").
   * We do NOT introduce <s> or </s> markers to keep consistent with training counts.
   * For an n-gram whose history never appeared (denom=0) we still apply smoothing denominator (c(h)=0):
@@ -20,29 +24,62 @@ Implementation notes:
   * Quadragram probabilities back off implicitly when history length < n-1 by using the available preceding tokens (i.e. we only form n-grams once enough tokens observed). For first few tokens of a sentence under higher-order model we use progressively smaller n (unigram probability for the first token).
   * Log probabilities (base 10) are reported to avoid underflow. Also perplexity = 10^(-log10P / m) where m = number of conditional factors used.
   * Token-Type scores are summed (not multiplied) per sentence to give a comparable ranking feature; they do not form a probability distribution.
+  * main() scores all sentences and orders in one batch (ngram_scoring.score_sentences); sentence_prob is the
+	per-sentence reference it reproduces exactly. SCORER = "multi" scores sentence by sentence instead, every
+	order in one walk over the tokens with an LRU cache of table lookups (ngram_scoring.SentenceScorer), and
+	prints the cache hit rate; the output is the same.
+  * Kneser-Ney needs no special case at sentence start: tokens with a shorter history are scored with the
+	model's own lower-order (continuation) distributions. A corpus-level perplexity per method and order
+	(all q3_data tokens together) is printed at the end.
+  * TRIE = True scores from a ContextTrie (ngram_trie.py; shared-prefix nodes, packed counts) instead of
+	the flat tables; the Kneser-Ney tables are still built from the flat tables first.
+  * LONG_ORDERS (orders above MAX_N) are scored from a suffix array of the corpus instead of more tables
+	(ngram_suffix.py): Add-One/Add-K perplexities only, printed after the table above.
+  * BLOOM_FP_RATE builds per-order Bloom filters over the table keys (ngram_bloom.py, saved next to the store);
+	lookups skip the binary search for n-grams the filter rules out, with identical results.
+  * ADD_K_SWEEP (a grid of K values) evaluates Add-K for every K in one pass (ngram_scoring.add_k_sweep:
+	counts gathered once per order, log10 P broadcast over the K axis) and prints the held-out log10
+	likelihood and perplexity curve per order with the best K; the curve is also written to add_k_sweep.tsv.
 
 Outputs:
   sentence_probs.tsv with columns:
-	 sent_id \t n \t tokens_used \t add1_log10P \t add1_perplexity \t addK_log10P \t addK_perplexity \t token_type_sum
+	 sent_id \t n \t tokens_used \t add1_log10P \t add1_perplexity \t addK_log10P \t addK_perplexity \t kn_log10P \t kn_perplexity \t token_type_sum
 
-Config knobs below: INPUT_FILENAME, SENTENCE_FILE, ADD_K, MAX_N, MAX_UNIQUE_PER_ORDER.
+Config knobs below: INPUT_FILENAME, SENTENCE_FILE, ADD_K, MAX_N, LOSSY_EPSILON, WORKERS, MEMORY_BUDGET_MB, SCORER, TRIE, LONG_ORDERS,
+ADD_K_SWEEP, BLOOM_FP_RATE.
+`python q3.py path/to/corpus.txt` overrides the corpus lookup.
 """
 
 from __future__ import annotations
 
 from pathlib import Path
-from collections import defaultdict, deque
-from typing import Dict, Tuple, Deque, List
+from typing import Optional, Tuple, List
 import math
 import re
+import sys
+
+from ngram_bloom import load_or_build_filters
+from ngram_kneser_ney import load_or_build_kneser_ney
+from ngram_scoring import SentenceScorer, add_k_sweep, score_sentences
+from ngram_store import default_store_path, load_or_build
+from ngram_suffix import load_or_build_suffix_index
+from ngram_table import NGramCounts
+from ngram_trie import ContextTrie
 
 ######## Configuration ########
 INPUT_FILENAME = "indiccorp_gu_words.txt"
 SENTENCE_FILE = "q3_data.txt"
 ADD_K = 0.5          # K value for Add-K smoothing
 MAX_N = 4            # build up to quadragram counts
-MAX_UNIQUE_PER_ORDER = None  # optional pruning cap; None disables
+LOSSY_EPSILON = None  # lossy counting error bound for n>=2; None counts exactly
 NGRAM_ORDERS = (2, 3, 4)      # which n values to evaluate for sentences
+WORKERS = 1          # >1 counts byte-range shards in a process pool (same counts)
+MEMORY_BUDGET_MB = None  # exact counts within this budget, spilling sorted runs to disk
+SCORER = "batch"     # "multi": per sentence, all orders in one walk with an LRU lookup cache (SentenceScorer)
+TRIE = False         # True: score from a ContextTrie built from the counts (ngram_trie.py)
+LONG_ORDERS = ()     # e.g. (6, 8): orders above MAX_N, counted from the suffix-array index (ngram_suffix.py)
+BLOOM_FP_RATE = None  # e.g. 0.01: skip lookups of n-grams a per-order Bloom filter rules out (flat tables only)
+ADD_K_SWEEP = ()     # e.g. (0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0): Add-K curve and best K per order
 
 
 ######## File Discovery ########
@@ -60,28 +97,6 @@ def find_file(name: str) -> Path:
 	raise FileNotFoundError(f"Could not locate {name}. Checked:\n" + "\n".join(str(c) for c in candidates))
 
 
-######## Streaming Corpus Tokens ########
-def stream_tokens(path: Path):
-	with path.open("r", encoding="utf-8", errors="ignore") as f:
-		for line in f:
-			for tok in line.strip().split():
-				t = tok.strip()
-				if t:
-					yield t
-
-
-######## Counting ########
-def prune_if_needed(counts: Dict[Tuple[str, ...], int]):
-	if MAX_UNIQUE_PER_ORDER is None:
-		return
-	if len(counts) <= MAX_UNIQUE_PER_ORDER:
-		return
-	# remove singletons
-	to_drop = [k for k, v in counts.items() if v == 1]
-	for k in to_drop:
-		del counts[k]
-
-
 ######## Probability Helpers ########
 def add_one_prob(count_hw: int, count_h: int, V: int) -> float:
 	return (count_hw + 1) / (count_h + V) if V else 0.0
@@ -117,7 +132,7 @@ def read_sentences(path: Path) -> List[Tuple[int, List[str]]]:
 	return sentences
 
 
-def sentence_prob(tokens: List[str], n: int, counts: Dict[int, Dict[Tuple[str, ...], int]], vocab_size: int) -> Tuple[float, float, float]:
+def sentence_prob(tokens: List[str], n: int, counts: NGramCounts, vocab_size: int) -> Tuple[float, float, float]:
 	"""Return (add1_log10P, addK_log10P, token_type_sum) for the sentence with model order n.
 	We back off implicitly at sentence start (use shorter histories until enough tokens seen).
 	log10P computed over the sequence of conditional factors actually formed.
@@ -126,14 +141,14 @@ def sentence_prob(tokens: List[str], n: int, counts: Dict[int, Dict[Tuple[str, .
 	log10_addK = 0.0
 	token_type_sum = 0.0
 	factors = 0
-	history: List[str] = []
-	for w in tokens:
-		history.append(w)  # we will use history excluding current; adjust below
+	history: List[int] = []
+	total_tokens = counts.total_tokens
+	for w, wid in zip(tokens, counts.vocab.encode(tokens)):
+		history.append(wid)  # we will use history excluding current; adjust below
 		# Determine effective history length (up to n-1 previous words)
 		if len(history) == 1:  # first token; use unigram prob approximation via total count
 			# Unigram counts
-			count_w = counts[1].get((w,), 0)
-			total_tokens = sum(counts[1].values())
+			count_w = counts.count((wid,))
 			# Add-one on unigram: (c(w)+1)/(N+V)
 			add1_p = (count_w + 1) / (total_tokens + vocab_size)
 			addK_p = (count_w + ADD_K) / (total_tokens + ADD_K * vocab_size)
@@ -145,16 +160,14 @@ def sentence_prob(tokens: List[str], n: int, counts: Dict[int, Dict[Tuple[str, .
 			while order > 1 and len(use_hist) < order - 1:
 				order -= 1
 			if order == 1:
-				count_w = counts[1].get((w,), 0)
-				total_tokens = sum(counts[1].values())
+				count_w = counts.count((wid,))
 				add1_p = (count_w + 1) / (total_tokens + vocab_size)
 				addK_p = (count_w + ADD_K) / (total_tokens + ADD_K * vocab_size)
 				token_type_sum += token_type_score(count_w, w)
 			else:
 				hist_slice = tuple(use_hist[-(order - 1):])
-				gram = hist_slice + (w,)
-				count_hw = counts[order].get(gram, 0)
-				count_h = counts[order - 1].get(hist_slice, 0)
+				gram = hist_slice + (wid,)
+				count_hw, count_h = counts.count_pair(gram)  # one walk for both
 				add1_p = add_one_prob(count_hw, count_h, vocab_size)
 				addK_p = add_k_prob(count_hw, count_h, vocab_size, ADD_K)
 				token_type_sum += token_type_score(count_hw, w)
@@ -169,50 +182,99 @@ def sentence_prob(tokens: List[str], n: int, counts: Dict[int, Dict[Tuple[str, .
 	return log10_add1, log10_addK, token_type_sum
 
 
+def write_sweep(curves, n_tokens: int, out_path: Path):
+	"""Print the Add-K perplexity curve per order (best K marked) and write it as TSV."""
+	orders = list(curves)
+	print(f"\nAdd-K sweep on {SENTENCE_FILE} (perplexity; * = best K per order):")
+	print(f"{'K':>10} " + " ".join(f"{f'n={n}':>13}" for n in orders))
+	best = {n: int(curves[n].argmax()) for n in orders}
+	with out_path.open("w", encoding="utf-8") as f:
+		f.write("n\tK\tlog10_likelihood\tperplexity\tbest\n")
+		for i, k in enumerate(ADD_K_SWEEP):
+			cells = []
+			for n in orders:
+				ll = float(curves[n][i])
+				perp = 10 ** (-ll / n_tokens)
+				cells.append(f"{perp:>12.2f}{'*' if best[n] == i else ' '}")
+				f.write(f"{n}\t{k}\t{ll:.6f}\t{perp:.4f}\t{int(best[n] == i)}\n")
+			print(f"{k:>10g} " + " ".join(cells))
+	for n in orders:
+		edge = "; at the edge of the grid" if best[n] in (0, len(ADD_K_SWEEP) - 1) else ""
+		print(f"  n={n}: best K = {ADD_K_SWEEP[best[n]]:g} (perplexity {10 ** (-float(curves[n][best[n]]) / n_tokens):.2f}{edge})")
+	print(f"Wrote Add-K sweep to {out_path}")
+
+
 ######## Main ########
-def main():
-	corpus_path = find_file(INPUT_FILENAME)
+def main(corpus: Optional[Path] = None, out_dir: Optional[Path] = None):
+	corpus_path = corpus or find_file(INPUT_FILENAME)
 	sent_path = find_file(SENTENCE_FILE)
 	print(f"Building n-gram counts from: {corpus_path}")
 
-	counts: Dict[int, Dict[Tuple[str, ...], int]] = {i: defaultdict(int) for i in range(1, MAX_N + 1)}
-	vocab = set()
-	window: Deque[str] = deque(maxlen=MAX_N - 1)
-	total_tokens = 0
-	for tok in stream_tokens(corpus_path):
-		total_tokens += 1
-		vocab.add(tok)
-		counts[1][(tok,)] += 1
-		if MAX_N > 1:
-			hist = list(window)
-			hl = len(hist)
-			for n in range(2, MAX_N + 1):
-				need = n - 1
-				if hl >= need:
-					gram = tuple(hist[-need:] + [tok])
-					counts[n][gram] += 1
-					prune_if_needed(counts[n])
-		window.append(tok)
-	vocab_size = len(vocab)
+	budget = MEMORY_BUDGET_MB * 2**20 if MEMORY_BUDGET_MB else None
+	counts = load_or_build(corpus_path, MAX_N, LOSSY_EPSILON, WORKERS, memory_budget=budget)
+	total_tokens = counts.total_tokens
+	vocab_size = len(counts.vocab)
 	print(f"Total tokens: {total_tokens}; Vocab size: {vocab_size}")
+	if counts.lossy:
+		print("\n".join(counts.lossy.lines()))
+	kn = load_or_build_kneser_ney(counts, default_store_path(corpus_path))
+	if TRIE:
+		counts = ContextTrie.from_counts(counts)
+	elif BLOOM_FP_RATE:
+		counts.bloom = load_or_build_filters(counts, default_store_path(corpus_path), BLOOM_FP_RATE)
 
 	sentences = read_sentences(sent_path)
 	print(f"Loaded {len(sentences)} sentences from {SENTENCE_FILE}")
 
-	out_path = Path(__file__).parent / "sentence_probs.tsv"
+	out_path = (out_dir or Path(__file__).parent) / "sentence_probs.tsv"
 	with out_path.open("w", encoding="utf-8") as f:
-		f.write("sent_id\tn\ttokens_used\tadd1_log10P\tadd1_perplexity\taddK_log10P\taddK_perplexity\ttoken_type_sum\n")
-		for sid, toks in sentences:
+		f.write("sent_id\tn\ttokens_used\tadd1_log10P\tadd1_perplexity\taddK_log10P\taddK_perplexity"
+				"\tkn_log10P\tkn_perplexity\ttoken_type_sum\n")
+		# all sentences x all orders in one vectorized pass (or one walk per sentence); identical to sentence_prob
+		scorer = SentenceScorer(counts, vocab_size, ADD_K, kn=kn) if SCORER == "multi" else None
+		if scorer is not None:
+			scores = scorer.score_many([toks for _, toks in sentences], NGRAM_ORDERS)
+		else:
+			scores = score_sentences([toks for _, toks in sentences], NGRAM_ORDERS, counts, vocab_size, ADD_K, kn)
+		methods = ("add1_log10", "addK_log10", "kn_log10")
+		columns = {n: [scores[n][c].tolist() for c in methods + ("token_type",)] for n in NGRAM_ORDERS}
+		for i, (sid, toks) in enumerate(sentences):
 			for n in NGRAM_ORDERS:
-				log10_add1, log10_addK, tts = sentence_prob(toks, n, counts, vocab_size)
+				log10_add1, log10_addK, log10_kn, tts = (col[i] for col in columns[n])
 				m = len(toks)
 				add1_perp = 10 ** (-log10_add1 / m) if m else 0.0
 				addK_perp = 10 ** (-log10_addK / m) if m else 0.0
+				kn_perp = 10 ** (-log10_kn / m) if m else 0.0
 				f.write(
-					f"{sid}\t{n}\t{m}\t{log10_add1:.6f}\t{add1_perp:.4f}\t{log10_addK:.6f}\t{addK_perp:.4f}\t{tts:.2f}\n"
+					f"{sid}\t{n}\t{m}\t{log10_add1:.6f}\t{add1_perp:.4f}\t{log10_addK:.6f}\t{addK_perp:.4f}"
+					f"\t{log10_kn:.6f}\t{kn_perp:.4f}\t{tts:.2f}\n"
 				)
 	print(f"Wrote sentence probabilities to {out_path}")
+	if scorer is not None:
+		print(f"SentenceScorer lookup cache: {scorer.cache.line()}")
+
+	n_tokens = sum(len(toks) for _, toks in sentences)
+	print(f"\nPerplexity on {SENTENCE_FILE} ({n_tokens} tokens):")
+	print(f"{'n':>3} {'Add-One':>12} {f'Add-{ADD_K}':>12} {'Kneser-Ney':>12}")
+	for n in NGRAM_ORDERS:
+		perps = [10 ** (-float(scores[n][c].sum()) / n_tokens) if n_tokens else 0.0 for c in methods]
+		print(f"{n:>3} " + " ".join(f"{p:>12.2f}" for p in perps))
+
+	index = None
+	if LONG_ORDERS:
+		index = load_or_build_suffix_index(corpus_path, counts)
+		long_scores = score_sentences([toks for _, toks in sentences], LONG_ORDERS, index, vocab_size, ADD_K)
+		for n in LONG_ORDERS:
+			perps = [10 ** (-float(long_scores[n][c].sum()) / n_tokens) if n_tokens else 0.0 for c in methods[:2]]
+			print(f"{n:>3} " + " ".join(f"{p:>12.2f}" for p in perps) + f" {'-':>12}  (suffix array)")
+
+	if ADD_K_SWEEP and n_tokens:
+		toks = [toks for _, toks in sentences]
+		curves = add_k_sweep(toks, NGRAM_ORDERS, counts, vocab_size, ADD_K_SWEEP)
+		if index is not None:
+			curves.update(add_k_sweep(toks, LONG_ORDERS, index, vocab_size, ADD_K_SWEEP))
+		write_sweep(curves, n_tokens, (out_dir or Path(__file__).parent) / "add_k_sweep.tsv")
 
 
 if __name__ == "__main__":
-	main()
+	main(Path(sys.argv[1]) if len(sys.argv) > 1 else None)